@@ -0,0 +1,221 @@
+import logging
+import threading
+import time
+import weakref
+from urllib.parse import urlparse
+
+import requests
+
+from http_transport import get_transport
+from metrics import metrics
+
+# In-flight requests per host when a run starts
+INITIAL_LIMIT = 4
+# The most in-flight requests per host; the scrapers' thread pools are sized to this
+MAX_LIMIT = 16
+# The limit is multiplied by this on throttling, server errors, timeouts or rising latency
+BACKOFF_FACTOR = 0.5
+# Back off once the smoothed latency exceeds the host's baseline by this factor
+LATENCY_TOLERANCE = 3.0
+# ... and by at least this many seconds, so jitter on a very fast host is not read as congestion
+MIN_LATENCY_RISE = 0.25
+# Seconds before a request without its own timeout gives up; a timeout is a backoff signal
+REQUEST_TIMEOUT = 30
+
+# Weight of the newest sample in the smoothed latency
+_LATENCY_SMOOTHING = 0.2
+# The baseline follows a host that has become slower for good by rising 1% per slower sample
+_BASELINE_DRIFT = 1.01
+# Interval between two decreases before any latency is known; afterwards it is one smoothed round trip
+_INITIAL_DECREASE_INTERVAL = 1.0
+# Statuses sites answer with when they throttle a client; 403 is how some WAFs rate-limit
+_THROTTLE_STATUSES = {403, 429, 503}
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limit on the in-flight requests to one host.
+
+    Every successful request within the latency tolerance raises the limit by 1/limit, i.e. by
+    one per round of requests. A 403/429/503 (honouring Retry-After), another 5xx, a timeout, a
+    connection error or latency above LATENCY_TOLERANCE times the host's baseline halves it,
+    at most once per round trip. Other 4xx responses count as successes. The limit stays
+    between 1 and the ceiling.
+    """
+
+    def __init__(self, host, initial=INITIAL_LIMIT, ceiling=MAX_LIMIT, backoff=BACKOFF_FACTOR,
+                 latency_tolerance=LATENCY_TOLERANCE):
+        self.host = host
+        self.ceiling = ceiling
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.limit = float(min(initial, ceiling))
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        self.baseline = None
+        self.smoothed = None
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.decreases = 0
+        self.peak = self.limit
+
+    def acquire(self):
+        """Take one of the host's in-flight slots, waiting while the host is at its limit or paused."""
+        with self.condition:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    break
+                self.condition.wait(timeout=wait if wait > 0 else None)
+            self.in_flight += 1
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def record_response(self, response, latency):
+        if response.status_code in _THROTTLE_STATUSES:
+            self._pause(response.headers.get('Retry-After'))
+            self.record_failure(f"http_{response.status_code}")
+        elif response.status_code >= 500:
+            self.record_failure(f"http_{response.status_code}")
+        else:
+            self.record_success(latency)
+
+    def record_success(self, latency):
+        with self.condition:
+            self.smoothed = latency if self.smoothed is None else \
+                (1 - _LATENCY_SMOOTHING) * self.smoothed + _LATENCY_SMOOTHING * latency
+            self.baseline = latency if self.baseline is None else min(latency, self.baseline * _BASELINE_DRIFT)
+            if self.smoothed > max(self.baseline * self.latency_tolerance, self.baseline + MIN_LATENCY_RISE):
+                self._decrease('latency')
+            else:
+                self.limit = min(self.ceiling, self.limit + 1 / self.limit)
+                self.peak = max(self.peak, self.limit)
+                self.condition.notify_all()
+
+    def record_failure(self, reason):
+        with self.condition:
+            self._decrease(reason)
+
+    def _decrease(self, reason):
+        now = time.monotonic()
+        # One decrease per round trip, so a burst of errors from the same round counts once
+        if now - self.last_decrease < (self.smoothed or _INITIAL_DECREASE_INTERVAL):
+            return
+        previous = self.limit
+        self.limit = max(1.0, self.limit * self.backoff)
+        self.last_decrease = now
+        self.decreases += 1
+        metrics.inc('scraper_backoffs_total', host=self.host, reason=reason)
+        logging.info(f"{self.host}: {reason}, in-flight limit {previous:.1f} -> {self.limit:.1f}")
+
+    def _pause(self, retry_after):
+        try:
+            seconds = float(retry_after)
+        except (TypeError, ValueError):
+            return
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        logging.info(f"{self.host}: pausing {seconds:.0f}s for Retry-After")
+
+
+def _hold_until_closed(response, limiter):
+    """
+    Keep a streamed response's slot until its body has been read to the end or it is closed.
+
+    The slot is also given back if the response is garbage-collected unread.
+    """
+    once = threading.Lock()
+
+    def release():
+        if once.acquire(blocking=False):
+            limiter.release()
+
+    close, iter_content = response.close, response.iter_content
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            release()
+
+    def iter_content_and_release(*args, **kwargs):
+        try:
+            yield from iter_content(*args, **kwargs)
+        finally:
+            release()
+
+    # Instance attributes, so requests' content, iter_lines and __exit__ go through them too
+    response.close, response.iter_content = close_and_release, iter_content_and_release
+    weakref.finalize(response, release)
+    return response
+
+
+class ConcurrencyController:
+    """
+    One AdaptiveLimiter per host, shared by the threads of a scraper process.
+
+    Usage:
+        response = controller.request('GET', url, headers=headers)
+        response = controller.request('POST', url, cookies=cookies, data=payload)
+    """
+
+    def __init__(self, initial=INITIAL_LIMIT, ceiling=MAX_LIMIT):
+        self.initial = initial
+        self.ceiling = ceiling
+        self.limiters = {}
+        self.lock = threading.Lock()
+
+    def limiter(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.limiters:
+                self.limiters[host] = AdaptiveLimiter(host, self.initial, self.ceiling)
+            return self.limiters[host]
+
+    def request(self, method, url, session=None, **kwargs):
+        """
+        Send a request within the host's in-flight limit and feed the outcome back to the limiter.
+
+        Args:
+            method (str): 'GET', 'POST', ...
+            url (str): The request URL; its host selects the limiter.
+            session (requests.Session): Send with this session instead of the host's pooled one.
+            **kwargs: requests-style arguments; 'timeout' defaults to REQUEST_TIMEOUT.
+
+        Returns:
+            requests.Response: The response. Timeouts and connection errors are re-raised. With
+                stream=True the slot is held until the body is read or the response is closed.
+        """
+        limiter = self.limiter(url)
+        kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+        limiter.acquire()
+        try:
+            start = time.perf_counter()
+            try:
+                response = get_transport().request(method, url, session=session, **kwargs)
+            except requests.Timeout:
+                limiter.record_failure('timeout')
+                raise
+            except requests.ConnectionError:
+                limiter.record_failure('connection_error')
+                raise
+            limiter.record_response(response, time.perf_counter() - start)
+        except BaseException:
+            limiter.release()
+            raise
+        if kwargs.get('stream'):
+            return _hold_until_closed(response, limiter)
+        limiter.release()
+        return response
+
+    def log_summary(self):
+        for host, limiter in sorted(self.limiters.items()):
+            logging.info(f"{host}: final in-flight limit {limiter.limit:.1f}, peak {limiter.peak:.1f}, "
+                         f"{limiter.decreases} backoffs, baseline latency {limiter.baseline or 0:.3f}s")
+
+
+# Shared by every module of one scraper process
+controller = ConcurrencyController()
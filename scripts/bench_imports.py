@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ENTRY_POINTS = ['scrape_checkers', 'scrape_shoprite', 'scrape_pnp', 'scrape_woolworths', 'daily_scrape']
+# Dependencies that should only be imported on the code paths that use them
+HEAVY_MODULES = ['pandas', 'numpy', 'bs4', 'supabase', 'httpx', 'pytz', 'psutil']
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{'seconds': elapsed, 'loaded': [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def _top_imports(module, workdir, top):
+    """Return the top-level packages that took longest to import, from python -X importtime."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"], cwd=workdir,
+                            capture_output=True, text=True, env={**os.environ, 'PYTHONPATH': SCRIPTS_DIR})
+    imports = []
+    for line in result.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        # Imports made while importing the entry point are indented by three spaces, its own line by one
+        if len(name) - len(name.lstrip()) == 3:
+            imports.append((int(parts[1]) / 1e6, name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def measure(module, workdir, repeat):
+    """
+    Import an entry point in fresh interpreters, as daily_scrape.py starts it.
+
+    Returns:
+        dict: The median and best import and process seconds, and the heavy modules that were
+        imported, or the error if the module failed to import.
+    """
+    import_seconds, process_seconds, loaded = [], [], []
+    probe = _PROBE.format(module=module, heavy=HEAVY_MODULES)
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', probe], cwd=workdir, capture_output=True, text=True,
+                                env={**os.environ, 'PYTHONPATH': SCRIPTS_DIR})
+        process_seconds.append(time.perf_counter() - started)
+        if result.returncode != 0:
+            return {'module': module, 'error': result.stderr.strip().splitlines()[-1]}
+        sample = json.loads(result.stdout.strip().splitlines()[-1])
+        import_seconds.append(sample['seconds'])
+        loaded = sample['loaded']
+    return {
+        'module': module,
+        'import_median': statistics.median(import_seconds),
+        'import_best': min(import_seconds),
+        'process_median': statistics.median(process_seconds),
+        'loaded': loaded,
+    }
+
+
+def main(modules, repeat, top):
+    # The scrapers create their log files and folders on import, so run them in a scratch directory
+    workdir = tempfile.mkdtemp(prefix='bench_imports_')
+    try:
+        baseline = measure('os', workdir, repeat)
+        results = [measure(module, workdir, repeat) for module in modules]
+
+        print(f"\nCold start of each entry point, {repeat} runs. The interpreter alone starts in "
+              f"{baseline['process_median'] * 1000:.0f} ms.")
+        print(f"{'entry point':<20}{'import ms':>11}{'best ms':>10}{'process ms':>12}  heavy modules imported")
+        for result in results:
+            if 'error' in result:
+                print(f"{result['module']:<20} failed: {result['error']}")
+                continue
+            print(f"{result['module']:<20}{result['import_median'] * 1000:>11.0f}{result['import_best'] * 1000:>10.0f}"
+                  f"{result['process_median'] * 1000:>12.0f}  {', '.join(result['loaded']) or 'none'}")
+
+        if top:
+            for result in results:
+                if 'error' in result:
+                    continue
+                print(f"\nSlowest imports of {result['module']}:")
+                for seconds, name in _top_imports(result['module'], workdir, top):
+                    print(f"{seconds * 1000:>9.1f} ms  {name}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the cold import time of the scraper entry points.")
+    parser.add_argument("modules", nargs="*", default=ENTRY_POINTS, help="Entry points to measure (default: all)")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per entry point (default: 5)")
+    parser.add_argument("--top", type=int, default=0, help="Also list this many slowest imports per entry point")
+    args = parser.parse_args()
+
+    main(args.modules, args.repeat, args.top)
@@ -0,0 +1,109 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from profiling import profiled
+from supabase_standin import STANDIN_KEY, start_server
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_phase(server, name, products, func):
+    """
+    Time one code path against the stand-in and normalize its cost to 1,000 products.
+
+    Returns:
+        dict: The phase name, requests issued, bytes sent and received, and wall time per 1,000 products.
+    """
+    server.state.reset_stats()
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    stats = server.state.snapshot()
+    scale = 1000 / products
+    return {
+        'phase': name,
+        'requests': stats['requests'] * scale,
+        'bytes_sent': stats['bytes_received'] * scale,
+        'bytes_received': stats['bytes_sent'] * scale,
+        'seconds': elapsed * scale,
+        'failures_injected': stats['failures_injected'],
+    }
+
+
+def main(products, latency_ms, jitter_ms, failure_rate, image_bytes):
+    server, url = start_server(latency_ms=latency_ms, jitter_ms=jitter_ms, failure_rate=failure_rate)
+    workdir = tempfile.mkdtemp(prefix='bench_supabase_')
+    os.chdir(workdir)
+    sys.path.insert(0, SCRIPTS_DIR)
+
+    # Imported here so the scraper's log folder and snapshots land in the scratch directory
+    import scrape_checkers
+
+    scrape_checkers.SUPABASE_URL = url
+    scrape_checkers.SUPABASE_KEY = STANDIN_KEY
+
+    os.makedirs(scrape_checkers.LOCAL_FOLDER_PATH, exist_ok=True)
+    rows, images = [], []
+    for i in range(products):
+        file_name = f"checkers_image_bench_product_{i}.jpg"
+        local_path = os.path.join(scrape_checkers.LOCAL_FOLDER_PATH, file_name)
+        with open(local_path, 'wb') as f:
+            f.write(os.urandom(image_bytes))
+        images.append((local_path, f"{scrape_checkers.REMOTE_FOLDER_PATH}{file_name}"))
+        rows.append({
+            'product_id': f"checkers:BENCH{i}",
+            'name': f"Bench Product {i} 500g",
+            'price': f"R{10 + i % 90}.99",
+            'promotion_price': 'No promo' if i % 4 else f"R{9 + i % 90}.99",
+            'retailer': 'Checkers',
+            'image_url': f"{url}/storage/v1/object/public/{scrape_checkers.BUCKET_NAME}/{file_name}",
+            'promotion_valid': ' ',
+        })
+
+    def upload():
+        for local_path, remote_path in images:
+            scrape_checkers.upload_file_to_supabase(local_path, scrape_checkers.BUCKET_NAME, remote_path)
+
+    def verify():
+        for _, remote_path in images:
+            scrape_checkers.verify_file_in_supabase(scrape_checkers.BUCKET_NAME, remote_path)
+
+    def upsert():
+        scrape_checkers.upsert_to_supabase(rows)
+
+    results = [
+        run_phase(server, 'upload', products, upload),
+        run_phase(server, 'verify', products, verify),
+        run_phase(server, 'upsert (first run)', products, upsert),
+        run_phase(server, 'upsert (unchanged)', products, upsert),
+    ]
+
+    server.shutdown()
+    os.chdir(SCRIPTS_DIR)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\nSupabase stand-in benchmark: {products} products, latency {latency_ms} ms, "
+          f"failure rate {failure_rate:.0%}. Figures are per 1,000 products.")
+    print(f"{'phase':<22}{'requests':>10}{'bytes sent':>14}{'bytes recv':>14}{'wall s':>10}")
+    for result in results:
+        print(f"{result['phase']:<22}{result['requests']:>10.0f}{result['bytes_sent']:>14.0f}"
+              f"{result['bytes_received']:>14.0f}{result['seconds']:>10.2f}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Supabase upload, verify and upsert paths against a local stand-in.")
+    parser.add_argument("--products", type=int, default=1000, help="Number of synthetic products (default: 1000)")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Latency added to every stand-in request (default: 20)")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Random extra latency of up to this many milliseconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of stand-in requests that fail")
+    parser.add_argument("--image-bytes", type=int, default=20_000, help="Size of each synthetic image (default: 20000)")
+    parser.add_argument("--profile", action="store_true", help="Write a sampling profile of the benchmark to profiles/")
+    args = parser.parse_args()
+
+    with profiled('bench_supabase', enabled=args.profile):
+        main(args.products, args.latency_ms, args.jitter_ms, args.failure_rate, args.image_bytes)
@@ -0,0 +1,177 @@
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from log_setup import CONSOLE
+from supabase_sync import retailer_slug
+
+CHECKPOINT_FOLDER = "checkpoints"
+
+
+class CrawlCheckpoint:
+    """
+    Durable progress of one retailer's crawl, so an interrupted run can be resumed.
+
+    The state file records the run ID, every completed page with the byte range its rows
+    occupy in the output CSV, and image jobs that were started but not finished. It is
+    rewritten atomically after every page. Output writes go through page(), which also
+    serializes appends from the scrapers' worker threads.
+    """
+
+    def __init__(self, retailer, output_file, folder=CHECKPOINT_FOLDER):
+        self.retailer = retailer
+        self.output_file = output_file
+        self.path = os.path.join(folder, f"{retailer_slug(retailer)}.json")
+        self.lock = threading.RLock()
+        self.state = None
+
+    def _new_state(self):
+        return {
+            'run_id': f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}",
+            'retailer': self.retailer,
+            'output_file': self.output_file,
+            'started_at': time.time(),
+            'updated_at': time.time(),
+            'finished': False,
+            'pages': {},
+            'pending_images': {},
+            'images': {},
+        }
+
+    def _save(self):
+        self.state['updated_at'] = time.time()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def begin(self, resume=False):
+        """
+        Start a new run, or continue the last unfinished one.
+
+        A resumed run cuts the output file back to the end of its last completed page, dropping
+        rows of a page that was being written when the crawl stopped. A new run starts with an
+        empty output file.
+
+        Args:
+            resume (bool): Continue from the last checkpoint if it is unfinished.
+
+        Returns:
+            bool: True if a previous run is being resumed.
+        """
+        with self.lock:
+            previous = load_state(self.path)
+            if resume and previous and not previous['finished'] and os.path.exists(self.output_file):
+                self.state = previous
+                committed = max((page['offset_end'] for page in previous['pages'].values()), default=0)
+                if committed == 0:
+                    # Nothing was committed, so let the next write start the file with its header
+                    os.remove(self.output_file)
+                elif os.path.getsize(self.output_file) > committed:
+                    with open(self.output_file, 'r+b') as f:
+                        f.truncate(committed)
+                logging.info(f"Resuming {self.retailer} run {previous['run_id']}: {len(previous['pages'])} pages done, "
+                             f"{len(previous['pending_images'])} image jobs pending.", extra=CONSOLE)
+                self._save()
+                return True
+
+            if resume:
+                logging.info(f"No unfinished {self.retailer} run to resume. Starting a new run.")
+            if os.path.exists(self.output_file):
+                os.remove(self.output_file)
+            self.state = self._new_state()
+            self._save()
+            return False
+
+    @property
+    def run_id(self):
+        return self.state['run_id']
+
+    def is_complete(self, page_key):
+        with self.lock:
+            return str(page_key) in self.state['pages']
+
+    def page_info(self, page_key):
+        """Return the extra values recorded with a completed page, e.g. the page count of a category."""
+        with self.lock:
+            return self.state['pages'].get(str(page_key), {}).get('info', {})
+
+    @contextmanager
+    def page(self, page_key, **info):
+        """
+        Write a page's rows to the output file and mark it complete.
+
+        Usage:
+            with checkpoint.page(page):
+                save_to_csv(rows, filename=checkpoint.output_file)
+
+        Args:
+            page_key: The page number, or any other identifier of the page within the retailer.
+            **info: JSON-serializable values to keep with the page, returned by page_info().
+        """
+        with self.lock:
+            offset_start = os.path.getsize(self.output_file) if os.path.exists(self.output_file) else 0
+            yield
+            offset_end = os.path.getsize(self.output_file) if os.path.exists(self.output_file) else 0
+            self.state['pages'][str(page_key)] = {'offset_start': offset_start, 'offset_end': offset_end, 'info': info}
+            self._save()
+
+    # Image jobs are written out with the next completed page rather than one state file write per image
+    def image_started(self, remote_path, source_url, local_path):
+        with self.lock:
+            self.state['pending_images'][remote_path] = {'source_url': source_url, 'local_path': local_path}
+
+    def image_finished(self, remote_path, public_url):
+        with self.lock:
+            self.state['pending_images'].pop(remote_path, None)
+            if public_url:
+                self.state['images'][remote_path] = public_url
+
+    def uploaded_image(self, remote_path):
+        """Return the public URL of an image already uploaded in this run, or None."""
+        with self.lock:
+            return self.state['images'].get(remote_path)
+
+    def pending_images(self):
+        with self.lock:
+            return dict(self.state['pending_images'])
+
+    def finish(self):
+        """Mark the crawl complete. A later --resume then starts a new run."""
+        with self.lock:
+            self.state['finished'] = True
+            self._save()
+        logging.info(f"{self.retailer} run {self.run_id} finished with {len(self.state['pages'])} pages.")
+
+
+def load_state(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not read crawl checkpoint {path}: {e}")
+        return None
+
+
+def unfinished_crawls(folder=CHECKPOINT_FOLDER):
+    """
+    Return the crawls that stopped before finishing.
+
+    Returns:
+        dict: The output file of every unfinished crawl, mapped to its retailer.
+    """
+    crawls = {}
+    for path in glob.glob(os.path.join(folder, '*.json')):
+        state = load_state(path)
+        if state and not state['finished']:
+            crawls[state['output_file']] = state['retailer']
+    return crawls
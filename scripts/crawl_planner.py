@@ -0,0 +1,188 @@
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from crawl_checkpoint import CHECKPOINT_FOLDER
+from log_setup import CONSOLE
+from supabase_sync import retailer_slug
+
+# Seconds a page takes on top of the crawl delay before any page has been measured
+DEFAULT_PAGE_LATENCY = 3.0
+# A page is only started if it is expected to finish this many seconds before the window closes
+WINDOW_MARGIN_SECONDS = 30
+# The longest wait for a window that has not opened yet; a run started earlier than this exits
+MAX_WAIT_FOR_WINDOW = timedelta(hours=2)
+
+# Weight of the newest measurement in the seconds-per-page estimate and the change rates
+_SMOOTHING = 0.2
+
+
+class CrawlWindow:
+    """A daily time window, in UTC, in which a site may be crawled, e.g. 04:00-08:45."""
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+    def bounds(self, now):
+        """Return the opening and closing time of today's window."""
+        day = now.astimezone(timezone.utc).date()
+        return (datetime.combine(day, self.start, tzinfo=timezone.utc),
+                datetime.combine(day, self.end, tzinfo=timezone.utc))
+
+    def is_open(self, now):
+        opens, closes = self.bounds(now)
+        return opens <= now <= closes
+
+    def seconds_left(self, now):
+        _, closes = self.bounds(now)
+        return max(0.0, (closes - now).total_seconds()) if self.is_open(now) else 0.0
+
+    def __str__(self):
+        return f"{self.start:%H:%M}-{self.end:%H:%M} UTC"
+
+
+class CrawlPlanner:
+    """
+    Plans a crawl that has to fit in a daily window, across as many windows as it takes.
+
+    Each page costs the crawl delay plus its measured latency, smoothed over past runs. Before
+    crawling, plan() works out whether the pending pages fit in what is left of the window.
+    order() puts the most valuable pages first: the ones whose products or prices changed most
+    often, then the ones with most promotions. A page is only started if it can finish before
+    the window closes. If the window closes first, the run is marked as carried over and the
+    next run resumes it, so the next window picks up the remaining pages.
+
+    State is kept in '<retailer>_plan.json' next to the crawl checkpoints.
+    """
+
+    def __init__(self, retailer, window, crawl_delay, expected_pages, folder=CHECKPOINT_FOLDER):
+        self.retailer = retailer
+        self.window = window
+        self.crawl_delay = crawl_delay
+        self.path = os.path.join(folder, f"{retailer_slug(retailer)}_plan.json")
+        self.state = {'seconds_per_page': None, 'page_count': expected_pages, 'carried_over_run': None, 'pages': {}}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    self.state.update(json.load(f))
+            except (OSError, ValueError) as e:
+                logging.warning(f"Could not read the crawl plan {self.path}: {e}. Starting without history.")
+
+    @property
+    def page_count(self):
+        return self.state['page_count']
+
+    def set_page_count(self, count):
+        """Record the page count the site reports, so the next plan uses it."""
+        if count != self.state['page_count']:
+            logging.info(f"{self.retailer} now has {count} pages (planned {self.state['page_count']}).")
+            self.state['page_count'] = count
+
+    def page_seconds(self):
+        """Return the expected seconds per page, crawl delay included."""
+        measured = self.state['seconds_per_page']
+        return measured if measured is not None else self.crawl_delay + DEFAULT_PAGE_LATENCY
+
+    def order(self, pages):
+        """Sort page numbers so that pages that change most often, then those with most promotions, come first."""
+        def priority(page):
+            stats = self.state['pages'].get(str(page), {})
+            return -stats.get('change_rate', 0.0), -stats.get('promotions', 0), page
+        return sorted(pages, key=priority)
+
+    def plan(self, pending, now=None):
+        """
+        Work out whether the pending pages fit in what is left of the crawl window.
+
+        Args:
+            pending (int): Pages still to crawl.
+            now (datetime): The current time (default: now).
+
+        Returns:
+            dict: 'fits', 'pages_that_fit', 'seconds_needed' and 'seconds_left'.
+        """
+        now = now or datetime.now(timezone.utc)
+        seconds_left = self.window.seconds_left(now)
+        if not self.window.is_open(now) and now < self.window.bounds(now)[0]:
+            # Planned ahead of the window, which will then be open in full
+            opens, closes = self.window.bounds(now)
+            seconds_left = (closes - opens).total_seconds()
+        per_page = self.page_seconds()
+        usable = max(0.0, seconds_left - WINDOW_MARGIN_SECONDS)
+        plan = {
+            'fits': pending * per_page <= usable,
+            'pages_that_fit': min(pending, int(usable // per_page)),
+            'seconds_needed': pending * per_page,
+            'seconds_left': seconds_left,
+        }
+        if plan['fits']:
+            message = (f"{self.retailer} plan: {pending} pages at ~{per_page:.1f}s each take "
+                       f"{plan['seconds_needed'] / 60:.0f} min of the {seconds_left / 60:.0f} min left in the {self.window} window.")
+        else:
+            message = (f"{self.retailer} plan: only {plan['pages_that_fit']} of {pending} pages fit in the {seconds_left / 60:.0f} min "
+                       f"left in the {self.window} window at ~{per_page:.1f}s each. The rest carry over to the next window.")
+        logging.info(message, extra=CONSOLE)
+        return plan
+
+    def wait_for_window(self, now=None):
+        """
+        Wait for the window to open if it opens soon.
+
+        Returns:
+            bool: True once the window is open; False if it has closed for today or opens too late.
+        """
+        now = now or datetime.now(timezone.utc)
+        opens, closes = self.window.bounds(now)
+        if now > closes:
+            message = f"The {self.retailer} crawl window ({self.window}) has closed for today."
+        elif now < opens and opens - now > MAX_WAIT_FOR_WINDOW:
+            message = f"The {self.retailer} crawl window ({self.window}) opens in {opens - now}, too long to wait."
+        else:
+            if now < opens:
+                logging.info(f"Waiting {opens - now} for the {self.retailer} crawl window ({self.window}) to open.", extra=CONSOLE)
+                time.sleep((opens - now).total_seconds())
+            return True
+        logging.warning(message)
+        return False
+
+    def can_start_page(self, now=None):
+        """Return whether one more page is expected to finish before the window closes."""
+        now = now or datetime.now(timezone.utc)
+        return self.window.seconds_left(now) - WINDOW_MARGIN_SECONDS >= self.page_seconds()
+
+    def page_done(self, page, seconds, changed, promotions):
+        """
+        Record a crawled page.
+
+        Args:
+            page (int): The page number.
+            seconds (float): Wall time of the page, crawl delay included.
+            changed (bool): Whether the page's fingerprint differed from the previous run.
+            promotions (int): Products on promotion on the page.
+        """
+        measured = self.state['seconds_per_page']
+        self.state['seconds_per_page'] = seconds if measured is None else (1 - _SMOOTHING) * measured + _SMOOTHING * seconds
+        stats = self.state['pages'].setdefault(str(page), {'change_rate': 1.0, 'promotions': 0})
+        stats['change_rate'] = (1 - _SMOOTHING) * stats['change_rate'] + _SMOOTHING * float(changed)
+        stats['promotions'] = int(promotions)
+        stats['crawled_at'] = time.time()
+
+    def carried_over_run(self):
+        """Return the run ID of a crawl the window closed on, to be resumed, or None."""
+        return self.state['carried_over_run']
+
+    def carry_over(self, run_id):
+        """Mark a run as stopped by the window closing, so the next run resumes it."""
+        self.state['carried_over_run'] = run_id
+
+    def save(self, finished=False):
+        if finished:
+            self.state['carried_over_run'] = None
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
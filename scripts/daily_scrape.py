@@ -1,16 +1,27 @@
+import argparse
 import os
-import shutil
 import subprocess
+import sys
 from datetime import datetime
-import pandas as pd  # Ensure pandas is installed: pip install pandas
 import logging
+from lazy_imports import lazy_import
+from crawl_checkpoint import unfinished_crawls
+from data_quality import rejected_retailers
+from supabase_sync import latest_backup_file, retailer_slug
+from log_setup import console_handler
+from metrics import metrics
+from profiling import memory_report, profiled
+from scheduler import InstanceLocked, instance_lock
+from snapshot_store import SnapshotStore
 
-# Configure logging
+pd = lazy_import('pandas')  # Ensure pandas is installed: pip install pandas
+
+# Configure logging; records logged with extra=CONSOLE, warnings and errors also go to stdout
 LOG_FILE = f"scrape_log_{datetime.now().strftime('%Y-%m-%d')}.log"
 logging.basicConfig(
-    filename=LOG_FILE,
     level=logging.INFO,
     format="%(asctime)s - %(levelname)s - %(message)s",
+    handlers=[logging.FileHandler(LOG_FILE), console_handler()],
 )
 
 # Commands
@@ -22,37 +33,39 @@ SCRAPE_WOOLWORTHS_CMD = ["python", "scrape_woolworths.py"]
 # File Paths
 PRODUCTS_FILE = "products.csv"
 BACKUP_FOLDER = "backup"
-SCRAPER_OUTPUT_FILES = [
-    "products_checkers.csv",
-    "products_shoprite.csv",
-    "products_pnp.csv",
-    "products_woolies.csv",
-]
+# Rows read at a time when combining the scraper outputs
+COMBINE_CHUNK_ROWS = 20_000
+# Scraper command and output file per retailer, in start order
+RETAILERS = {
+    "Checkers": (SCRAPE_CHECKERS_CMD, "products_checkers.csv"),
+    "Pick n Pay": (SCRAPE_PNP_CMD, "products_pnp.csv"),
+    "Shoprite": (SCRAPE_SHOPRITE_CMD, "products_shoprite.csv"),
+    "Woolworths": (SCRAPE_WOOLWORTHS_CMD, "products_woolies.csv"),
+}
+# Held for the whole run, so a manual run and a scheduled one never overlap
+LOCK_FILE = "daily_scrape.lock"
 
 def backup_products_file():
-    """Move the current products.csv file to the backup folder with a timestamped name."""
+    """Move the current products.csv file into the snapshot store in the backup folder."""
     if not os.path.exists(PRODUCTS_FILE):
         logging.warning(f"{PRODUCTS_FILE} does not exist. No backup needed.")
         return
 
-    os.makedirs(BACKUP_FOLDER, exist_ok=True)
-    backup_filename = os.path.join(
-        BACKUP_FOLDER,
-        f"products_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv"
-    )
-    shutil.move(PRODUCTS_FILE, backup_filename)
-    logging.info(f"Moved {PRODUCTS_FILE} to {backup_filename}.")
-
-def run_all_scrapers():
-    """Run all scrapers simultaneously."""
-    logging.info("Starting all scrapers in parallel...")
+    snapshot = SnapshotStore(BACKUP_FOLDER).add(PRODUCTS_FILE)
+    os.remove(PRODUCTS_FILE)
+    logging.info(f"Moved {PRODUCTS_FILE} to snapshot {snapshot['timestamp']} in {BACKUP_FOLDER}.")
+
+def run_all_scrapers(resume=False, profile=False, report_memory=False, retailers=None):
+    """Run the scrapers of all or the given retailers simultaneously, optionally resuming or profiling them."""
+    logging.info(f"Starting {'all' if retailers is None else ', '.join(retailers)} scrapers in parallel...")
     processes = []
-    commands = [
-        SCRAPE_CHECKERS_CMD,
-        SCRAPE_PNP_CMD,
-        SCRAPE_SHOPRITE_CMD,
-        SCRAPE_WOOLWORTHS_CMD,
-    ]
+    commands = [command for retailer, (command, _) in RETAILERS.items() if retailers is None or retailer in retailers]
+    if resume:
+        commands = [cmd + ["--resume"] for cmd in commands]
+    if profile:
+        commands = [cmd + ["--profile"] for cmd in commands]
+    if report_memory:
+        commands = [cmd + ["--memory-report"] for cmd in commands]
     for cmd in commands:
         try:
             process = subprocess.Popen(cmd)
@@ -72,41 +85,177 @@ def run_all_scrapers():
         except Exception as e:
             logging.error(f"Error waiting for {cmd[1]} scraper to complete: {e}")
 
-def combine_csv_files():
-    """Combine all scraper output files into a single products.csv and delete the individual files."""
+def combine_csv_files(retailers=None):
+    """
+    Combine all scraper output files into a single products.csv and delete the individual files.
+
+    The files are streamed in chunks of COMBINE_CHUNK_ROWS rows, so memory use does not grow with
+    the catalogue. The partial output of a crawl that stopped before finishing is kept for a later
+    --resume run, and that retailer's rows are taken from the latest backup instead. So are the
+    rows of retailers whose output the quality gate rejected, and of retailers that were not
+    scraped in this run when only some retailers are given.
+    """
     logging.info("Combining scraper output files...")
-    combined_data = []
-    for file in SCRAPER_OUTPUT_FILES:
-        if os.path.exists(file):
-            try:
-                data = pd.read_csv(file)
-                combined_data.append(data)
-                logging.info(f"Loaded {file} successfully.")
-            except Exception as e:
-                logging.error(f"Failed to load {file}: {e}")
+    sources = []
+    unfinished = unfinished_crawls()
+    rejected = rejected_retailers()
+    backup_file = latest_backup_file(BACKUP_FOLDER) if unfinished or rejected or retailers is not None else None
+    for retailer, (_, file) in RETAILERS.items():
+        if retailers is not None and retailer not in retailers:
+            if backup_file:
+                logging.info(f"{retailer} was not scraped in this run. Keeping its rows from {backup_file}.")
+                sources.append((backup_file, retailer))
+        elif file in unfinished:
+            logging.warning(f"{unfinished[file]} crawl is unfinished. Keeping {file} for --resume.")
+            if backup_file:
+                sources.append((backup_file, unfinished[file]))
+        elif os.path.exists(file):
+            sources.append((file, None))
+        elif retailer in rejected:
+            logging.warning(f"The quality gate rejected the {retailer} output. Keeping its rows from {backup_file}.")
+            if backup_file:
+                sources.append((backup_file, retailer))
         else:
             logging.warning(f"{file} not found. Skipping.")
 
-    if combined_data:
+    # The retailers' files can have different columns, so write the union of their headers
+    columns = []
+    for file, _ in sources:
         try:
-            combined_df = pd.concat(combined_data, ignore_index=True)
-            combined_df.to_csv(PRODUCTS_FILE, index=False)
-            logging.info(f"Combined data saved to {PRODUCTS_FILE}.")
+            columns += [column for column in pd.read_csv(file, nrows=0).columns if column not in columns]
         except Exception as e:
-            logging.error(f"Failed to combine and save data: {e}")
+            logging.error(f"Failed to read the header of {file}: {e}")
+
+    if columns:
+        tmp_path = f"{PRODUCTS_FILE}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+            pd.DataFrame(columns=columns).to_csv(f, index=False)
+            for file, retailer in sources:
+                position = f.tell()
+                try:
+                    for chunk in pd.read_csv(file, chunksize=COMBINE_CHUNK_ROWS):
+                        if retailer is not None:
+                            chunk = chunk[chunk['retailer'] == retailer]
+                        chunk.reindex(columns=columns).to_csv(f, header=False, index=False)
+                    logging.info(f"Loaded {retailer + ' rows from ' if retailer else ''}{file} successfully.")
+                except Exception as e:
+                    # Drop whatever part of this file was written
+                    f.seek(position)
+                    f.truncate()
+                    logging.error(f"Failed to load {file}: {e}")
+        os.replace(tmp_path, PRODUCTS_FILE)
+        logging.info(f"Combined data saved to {PRODUCTS_FILE}.")
 
-    # Delete individual scraper files
-    for file in SCRAPER_OUTPUT_FILES:
-        if os.path.exists(file):
+    # Delete the output files of the scrapers that ran
+    for retailer, (_, file) in RETAILERS.items():
+        if retailers is not None and retailer not in retailers:
+            continue
+        if os.path.exists(file) and file not in unfinished:
             try:
                 os.remove(file)
                 logging.info(f"Deleted {file}.")
             except Exception as e:
                 logging.error(f"Failed to delete {file}: {e}")
 
-if __name__ == "__main__":
-    logging.info("Starting daily scrape process...")
-    backup_products_file()
-    run_all_scrapers()
-    combine_csv_files()
+def update_product_matches():
+    """Update the cross-retailer product match table from the combined products.csv."""
+    if not os.path.exists(PRODUCTS_FILE):
+        logging.warning(f"{PRODUCTS_FILE} not found. Skipping product matching.")
+        return
+    try:
+        from product_matching import update_matches
+        update_matches(PRODUCTS_FILE)
+    except Exception as e:
+        logging.error(f"Failed to update product matches: {e}")
+
+def update_search_index():
+    """Incrementally rebuild the product search index from the combined products.csv."""
+    if not os.path.exists(PRODUCTS_FILE):
+        logging.warning(f"{PRODUCTS_FILE} not found. Skipping search index update.")
+        return
+    try:
+        from product_search import update_index
+        update_index(PRODUCTS_FILE)
+    except Exception as e:
+        logging.error(f"Failed to update search index: {e}")
+
+def update_price_history():
+    """Append today's prices from the combined products.csv to the price history."""
+    if not os.path.exists(PRODUCTS_FILE):
+        logging.warning(f"{PRODUCTS_FILE} not found. Skipping price history.")
+        return
+    try:
+        from price_history import ingest_file
+        ingest_file(PRODUCTS_FILE)
+    except Exception as e:
+        logging.error(f"Failed to update price history: {e}")
+
+def update_promotion_expiry():
+    """Rebuild the promotion expiry index from the combined products.csv and clear the promotions that have ended."""
+    if not os.path.exists(PRODUCTS_FILE):
+        logging.warning(f"{PRODUCTS_FILE} not found. Skipping promotion expiry index.")
+        return
+    try:
+        from promo_validity import expire_promotions, update_expiry_index
+        update_expiry_index(PRODUCTS_FILE)
+        expire_promotions(PRODUCTS_FILE)
+    except Exception as e:
+        logging.error(f"Failed to update promotion expiry: {e}")
+
+def run_work_queue(resume=False, retailers=None, workers=0, queue_port=None, queue_host=None):
+    """Crawl through the work queue, with local worker processes and any workers on other machines."""
+    from work_queue import DEFAULT_HOST, coordinate
+    queue_host = queue_host or DEFAULT_HOST
+    output_files = {retailer: file for retailer, (_, file) in RETAILERS.items() if retailers is None or retailer in retailers}
+    logging.info(f"Crawling {', '.join(output_files)} through the work queue with {workers} local workers"
+                 f"{f' and remote workers on {queue_host}:{queue_port}' if queue_port else ''}...")
+    coordinate(output_files, workers=workers, port=queue_port, resume=resume, host=queue_host)
+
+def main(resume=False, profile=False, report_memory=False, retailers=None, workers=0, queue_port=None, queue_host=None):
+    """
+    Back up products.csv, run the scrapers, rebuild products.csv and update everything derived from it.
+
+    With workers or queue_port set, pages are crawled by work queue workers instead of one scraper process per retailer.
+    """
+    with profiled('daily', enabled=profile), memory_report('daily', enabled=report_memory):
+        logging.info("Starting daily scrape process...")
+        backup_products_file()
+        with metrics.timer('scrape', 'all'):
+            if workers or queue_port:
+                run_work_queue(resume=resume, retailers=retailers, workers=workers, queue_port=queue_port, queue_host=queue_host)
+            else:
+                run_all_scrapers(resume=resume, profile=profile, report_memory=report_memory, retailers=retailers)
+        with metrics.timer('combine', 'all'):
+            combine_csv_files(retailers)
+        # Before everything else derived from products.csv, so none of it sees ended promotions
+        with metrics.timer('promotion_expiry', 'all'):
+            update_promotion_expiry()
+        with metrics.timer('product_matching', 'all'):
+            update_product_matches()
+        with metrics.timer('search_index', 'all'):
+            update_search_index()
+        with metrics.timer('price_history', 'all'):
+            update_price_history()
+        metrics.write('daily')
     logging.info("Daily scrape process completed.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run all scrapers and rebuild products.csv.")
+    parser.add_argument("--resume", action="store_true", help="Continue interrupted crawls from their checkpoints")
+    parser.add_argument("--profile", action="store_true", help="Profile this run and every scraper, writing to profiles/")
+    parser.add_argument("--memory-report", action="store_true", help="Write a tracemalloc report for this run and every scraper")
+    parser.add_argument("--retailers", nargs="+", choices=[retailer_slug(retailer) for retailer in RETAILERS],
+                        help="Scrape only these retailers and keep the others' rows from the previous products.csv")
+    parser.add_argument("--workers", type=int, default=0, help="Crawl through the work queue with this many local worker processes")
+    parser.add_argument("--queue-port", type=int, help="Crawl through the work queue and serve it to workers on other machines on this port")
+    parser.add_argument("--queue-host", help="Address to serve the work queue on (default: 127.0.0.1; 0.0.0.0 for other machines)")
+    args = parser.parse_args()
+    retailers = None if args.retailers is None else [retailer for retailer in RETAILERS if retailer_slug(retailer) in args.retailers]
+
+    try:
+        with instance_lock(LOCK_FILE):
+            main(resume=args.resume, profile=args.profile, report_memory=args.memory_report, retailers=retailers,
+                 workers=args.workers, queue_port=args.queue_port, queue_host=args.queue_host)
+    except InstanceLocked as e:
+        logging.error(f"Another daily scrape is running: {e}")
+        sys.exit(1)
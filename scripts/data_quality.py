@@ -0,0 +1,237 @@
+import argparse
+import json
+import logging
+import os
+import time
+
+from lazy_imports import lazy_import
+from metrics import metrics
+from price_engine import PRICE_COLUMNS, annotate_prices
+from supabase_sync import retailer_slug
+
+pd = lazy_import('pandas')
+
+QUALITY_FOLDER = "quality"
+STATE_FILE = os.path.join(QUALITY_FOLDER, "state.json")
+# Columns every retailer's output must have
+REQUIRED_COLUMNS = ['product_id', 'name', 'price', 'promotion_price', 'retailer', 'image_url']
+# Row checks: whether failing rows are held back from publishing, and the largest share of rows
+# that may fail the check before the whole output is rejected
+CHECKS = {
+    'empty_name': (True, 0.02),
+    'unparseable_price': (True, 0.02),
+    'wrong_retailer': (True, 0.02),
+    'promo_not_below_price': (False, 0.05),
+    'invalid_image_url': (False, 0.05),
+    'placeholder_image': (False, 0.25),
+}
+# An output is rejected if it has fewer rows than this share of the last accepted output
+MIN_ROW_RATIO = 0.8
+# Columns written to the quarantine file next to the failed checks
+QUARANTINE_COLUMNS = ['product_id', 'name', 'price', 'promotion_price', 'image_url']
+
+
+def _text(column):
+    # pandas 3 reads text columns as strings already; only convert object columns
+    return column if isinstance(column.dtype, pd.StringDtype) else column.astype('string')
+
+
+def check_rows(df, retailer):
+    """
+    Run the row checks on a retailer's output, vectorized over all rows.
+
+    Args:
+        df (pd.DataFrame): The output, with at least REQUIRED_COLUMNS.
+        retailer (str): The retailer the rows should belong to.
+
+    Returns:
+        pd.DataFrame: One boolean column per check in CHECKS, True where the row fails it.
+    """
+    if not set(PRICE_COLUMNS) <= set(df.columns):
+        df = annotate_prices(df.copy())
+    names = _text(df['name']).str.strip()
+    image_urls = _text(df['image_url'])
+    price_cents = df['price_cents'].astype('Float64')
+    promo_qty = df['promo_qty'].astype('Float64').fillna(1).clip(lower=1)
+    unit_promo_cents = df['promo_cents'].astype('Float64') / promo_qty
+
+    failed = pd.DataFrame({
+        'empty_name': names.isna() | (names == ''),
+        'unparseable_price': price_cents.isna() | (price_cents <= 0),
+        'wrong_retailer': _text(df['retailer']) != retailer,
+        'promo_not_below_price': unit_promo_cents >= price_cents,
+        'invalid_image_url': ~image_urls.str.startswith(('https://', 'http://')).fillna(False).astype(bool),
+        'placeholder_image': image_urls.str.contains('placeholder', regex=False),
+    }, index=df.index)
+    return failed.fillna(False).astype(bool)
+
+
+class QualityReport:
+    """The outcome of one retailer's quality gate."""
+
+    def __init__(self, retailer, rows, failed, previous_rows, reasons):
+        self.retailer = retailer
+        self.rows = rows
+        self.failed_counts = {check: int(count) for check, count in failed.sum().items()}
+        self.held_back = int(failed[[check for check, (blocking, _) in CHECKS.items() if blocking]].any(axis=1).sum())
+        self.previous_rows = previous_rows
+        self.reasons = reasons
+
+    @property
+    def passed(self):
+        return not self.reasons
+
+    def to_dict(self):
+        return {
+            'checked_at': time.time(),
+            'rows': self.rows,
+            'held_back': self.held_back,
+            'previous_rows': self.previous_rows,
+            'failed': self.failed_counts,
+            'passed': self.passed,
+            'reasons': self.reasons,
+        }
+
+    def __str__(self):
+        failed = ', '.join(f"{count} {check}" for check, count in self.failed_counts.items() if count) or 'no failed checks'
+        verdict = 'passed' if self.passed else f"rejected: {'; '.join(self.reasons)}"
+        return f"{self.retailer} quality gate {verdict}. {self.rows} rows, {self.held_back} held back ({failed})."
+
+
+def validate(df, retailer, previous_rows=None):
+    """
+    Check a retailer's output and decide whether it may be published.
+
+    The output is rejected if a required column is missing, if more rows fail a check than
+    CHECKS allows, or if it has fewer than MIN_ROW_RATIO of the last accepted output's rows.
+
+    Args:
+        df (pd.DataFrame): The retailer's output.
+        retailer (str): The retailer.
+        previous_rows (int): Rows of the last accepted output (default: no row count check).
+
+    Returns:
+        tuple: The QualityReport and the per-check failures from check_rows().
+    """
+    missing = [column for column in REQUIRED_COLUMNS if column not in df.columns]
+    if missing:
+        failed = pd.DataFrame(False, index=df.index, columns=list(CHECKS))
+        return QualityReport(retailer, len(df), failed, previous_rows, [f"missing columns {', '.join(missing)}"]), failed
+
+    failed = check_rows(df, retailer)
+    reasons = []
+    if len(df):
+        for check, share in failed.mean().items():
+            if share > CHECKS[check][1]:
+                reasons.append(f"{share:.1%} of rows fail {check} (at most {CHECKS[check][1]:.0%})")
+    if previous_rows and len(df) < MIN_ROW_RATIO * previous_rows:
+        reasons.append(f"{len(df)} rows against {previous_rows} in the last accepted output")
+    return QualityReport(retailer, len(df), failed, previous_rows, reasons), failed
+
+
+def load_state(path=STATE_FILE):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not read {path}: {e}")
+        return {}
+
+
+def _save_state(state, path=STATE_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def quarantine_file(retailer, folder=QUALITY_FOLDER):
+    return os.path.join(folder, f"{retailer_slug(retailer)}_quarantine.csv")
+
+
+def rejected_file(retailer, folder=QUALITY_FOLDER):
+    return os.path.join(folder, f"{retailer_slug(retailer)}_rejected.csv")
+
+
+def quality_gate(retailer, csv_file, folder=QUALITY_FOLDER):
+    """
+    Validate a retailer's output file before it is published.
+
+    Rows that fail any check are written, with the checks they fail, to
+    '<retailer>_quarantine.csv'. If the output passes, rows failing a blocking check are removed
+    from csv_file and the rest is published as usual. If it is rejected, csv_file is moved to
+    '<retailer>_rejected.csv', so nothing is upserted and daily_scrape.py keeps the retailer's
+    previous rows.
+
+    Args:
+        retailer (str): The retailer.
+        csv_file (str): The retailer's deduplicated output.
+        folder (str): Where the quarantine file, rejected outputs and gate state are kept.
+
+    Returns:
+        QualityReport: The gate's decision; check report.passed before upserting.
+    """
+    state_path = os.path.join(folder, os.path.basename(STATE_FILE))
+    state = load_state(state_path)
+    previous = state.get(retailer, {})
+    with metrics.timer('quality', retailer):
+        try:
+            df = pd.read_csv(csv_file, encoding='utf-8')
+        except UnicodeDecodeError:
+            df = pd.read_csv(csv_file, encoding='latin1')
+        report, failed = validate(df, retailer, previous.get('accepted_rows'))
+
+    os.makedirs(folder, exist_ok=True)
+    flagged = failed.any(axis=1)
+    quarantined = df.loc[flagged, [column for column in QUARANTINE_COLUMNS if column in df.columns]].copy()
+    labels = pd.Series('', index=quarantined.index, dtype='string')
+    for check in CHECKS:
+        labels = labels + failed.loc[flagged, check].map({True: f"{check};", False: ''})
+    quarantined['failed_checks'] = labels.str.rstrip(';')
+    quarantined.to_csv(quarantine_file(retailer, folder), index=False)
+    for check, count in report.failed_counts.items():
+        metrics.inc('quality_failed_rows_total', count, retailer=retailer, check=check)
+
+    if report.passed:
+        blocking = failed[[check for check, (is_blocking, _) in CHECKS.items() if is_blocking]].any(axis=1)
+        if blocking.any():
+            tmp_path = f"{csv_file}.tmp"
+            df[~blocking].to_csv(tmp_path, index=False)
+            os.replace(tmp_path, csv_file)
+        if os.path.exists(rejected_file(retailer, folder)):
+            os.remove(rejected_file(retailer, folder))
+        entry = dict(report.to_dict(), accepted_rows=report.rows - report.held_back)
+        logging.info(str(report))
+    else:
+        os.replace(csv_file, rejected_file(retailer, folder))
+        # The row count check keeps comparing against the last accepted output
+        entry = dict(report.to_dict(), accepted_rows=previous.get('accepted_rows'))
+        logging.error(f"{report} {csv_file} moved to {rejected_file(retailer, folder)}; nothing is published.")
+    metrics.inc('quality_gate_total', retailer=retailer, outcome='passed' if report.passed else 'rejected')
+    state[retailer] = entry
+    _save_state(state, state_path)
+    return report
+
+
+def rejected_retailers(folder=QUALITY_FOLDER):
+    """Return the retailers whose latest output was rejected and is still held in the quality folder."""
+    state = load_state(os.path.join(folder, os.path.basename(STATE_FILE)))
+    return {retailer for retailer, entry in state.items()
+            if not entry.get('passed', True) and os.path.exists(rejected_file(retailer, folder))}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check a retailer's output file without publishing or moving it.")
+    parser.add_argument("retailer", help="Retailer name, e.g. 'Pick n Pay'")
+    parser.add_argument("csv_file", help="The retailer's output or a rejected output")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    frame = pd.read_csv(args.csv_file)
+    result, failures = validate(frame, args.retailer, load_state().get(args.retailer, {}).get('accepted_rows'))
+    print(f"{result} Checked in {(time.perf_counter() - started) * 1000:.0f} ms.")
+    for name, count in result.failed_counts.items():
+        print(f"  {name:<22}{count:>8}")
@@ -0,0 +1,249 @@
+import importlib.util
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from lazy_imports import lazy_import
+from metrics import metrics
+
+# Optional packages are only looked up here; httpx is imported when its transport is first used.
+# urllib3 and httpx pick up a brotli decoder by themselves when one is installed.
+HTTPX_AVAILABLE = importlib.util.find_spec('httpx') is not None
+BROTLI_AVAILABLE = any(importlib.util.find_spec(name) is not None for name in ('brotli', 'brotlicffi'))
+H2_AVAILABLE = importlib.util.find_spec('h2') is not None
+
+httpx = lazy_import('httpx')
+
+# 'requests' (HTTP/1.1 keep-alive) or 'httpx' (HTTP/2 multiplexing where the host supports it)
+TRANSPORT = 'requests'
+# Advertise brotli only when a decoder is installed; otherwise servers could send bodies we can't read
+ACCEPT_ENCODING = 'br, gzip, deflate' if BROTLI_AVAILABLE else 'gzip, deflate'
+# Connections kept open per host; matches the concurrency controller's ceiling
+POOL_MAXSIZE = 16
+HTTPX_MAX_CONNECTIONS = POOL_MAXSIZE
+
+
+def _host(url_or_host):
+    return urlparse(url_or_host).netloc if '://' in url_or_host else url_or_host
+
+
+class SessionPool:
+    """
+    One keep-alive requests.Session per host, shared by all threads of a scraper process.
+
+    Each session's connection pool holds POOL_MAXSIZE connections, so concurrent workers reuse
+    open TCP/TLS connections instead of opening one per request. Default headers and cookies
+    set with configure() go with every request to the host, through either transport.
+    """
+
+    def __init__(self, pool_maxsize=POOL_MAXSIZE):
+        self.pool_maxsize = pool_maxsize
+        self.sessions = {}
+        self.host_defaults = {}
+        self.lock = threading.Lock()
+
+    def configure(self, url_or_host, headers=None, cookies=None):
+        """Set default headers and cookies for a host, e.g. 'https://www.pnp.co.za'."""
+        host = _host(url_or_host)
+        with self.lock:
+            default_headers, default_cookies = self.host_defaults.setdefault(host, ({}, {}))
+            default_headers.update(headers or {})
+            default_cookies.update(cookies or {})
+            if host in self.sessions:
+                self.sessions[host].headers.update(headers or {})
+                self.sessions[host].cookies.update(cookies or {})
+
+    def defaults(self, url):
+        """Return copies of a host's default headers and cookies."""
+        with self.lock:
+            headers, cookies = self.host_defaults.get(_host(url), ({}, {}))
+            return dict(headers), dict(cookies)
+
+    def session(self, url):
+        host = _host(url)
+        with self.lock:
+            if host not in self.sessions:
+                session = requests.Session()
+                # Retries are left to the scrapers and the concurrency controller
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize, max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                headers, cookies = self.host_defaults.get(host, ({}, {}))
+                session.headers.update(headers)
+                session.cookies.update(cookies)
+                self.sessions[host] = session
+            return self.sessions[host]
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
+
+
+# Shared by every module of one scraper process
+sessions = SessionPool()
+
+
+def _record_transfer(host, version, ttfb, wire_bytes, body_bytes):
+    """Record one request's time to first byte and its compressed and decompressed body sizes."""
+    metrics.observe('http_ttfb_seconds', ttfb, host=host)
+    metrics.inc('http_requests_total', host=host, version=version)
+    if wire_bytes is not None:
+        metrics.inc('http_wire_bytes_total', wire_bytes, host=host)
+    if body_bytes is not None:
+        metrics.inc('http_body_bytes_total', body_bytes, host=host)
+
+
+class RequestsTransport:
+    """
+    HTTP/1.1 through requests.
+
+    Requests go through the host's session in the shared SessionPool unless a session is given.
+    Time to first byte is requests' 'elapsed', measured up to the parsed response headers.
+    Wire bytes are read from urllib3 before decoding. Streamed responses record only TTFB,
+    because their body is read later by the caller.
+    """
+
+    name = 'requests'
+
+    def request(self, method, url, session=None, **kwargs):
+        headers = kwargs.pop('headers', None) or {}
+        if not any(key.lower() == 'accept-encoding' for key in headers):
+            headers = {**headers, 'Accept-Encoding': ACCEPT_ENCODING}
+        response = (session or sessions.session(url)).request(method, url, headers=headers, **kwargs)
+
+        version = {10: 'HTTP/1.0', 11: 'HTTP/1.1', 20: 'HTTP/2'}.get(getattr(response.raw, 'version', None), 'HTTP/1.1')
+        if kwargs.get('stream'):
+            _record_transfer(urlparse(url).netloc, version, response.elapsed.total_seconds(), None, None)
+        else:
+            _record_transfer(urlparse(url).netloc, version, response.elapsed.total_seconds(),
+                             response.raw.tell() if hasattr(response.raw, 'tell') else None, len(response.content))
+        return response
+
+    def close(self):
+        pass
+
+
+class HttpxResponse:
+    """The part of the requests.Response interface the scrapers use, over an httpx response."""
+
+    def __init__(self, response, url):
+        self._response = response
+        self.url = url
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.reason = response.reason_phrase
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def content(self):
+        return self._response.read()
+
+    @property
+    def text(self):
+        self._response.read()
+        return self._response.text
+
+    def json(self):
+        self._response.read()
+        return self._response.json()
+
+    def iter_content(self, chunk_size=None):
+        return self._response.iter_bytes(chunk_size)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError(f"{self.status_code} {self.reason} for url: {self.url}", response=self)
+
+    def close(self):
+        self._response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class HttpxTransport:
+    """
+    HTTP/2 through httpx, with one multiplexed connection per host where the host supports it.
+
+    httpx errors are re-raised as the matching requests exceptions, so callers and the
+    concurrency controller handle both transports alike. The host's SessionPool defaults, and
+    the cookies and headers of a requests session passed in, are sent along with the request.
+    """
+
+    name = 'httpx'
+
+    def __init__(self, http2=True, max_connections=HTTPX_MAX_CONNECTIONS):
+        if not HTTPX_AVAILABLE:
+            raise ImportError("The httpx transport needs 'pip install httpx[http2]'.")
+        self.http2 = http2 and H2_AVAILABLE
+        if http2 and not H2_AVAILABLE:
+            logging.warning("h2 is not installed. The httpx transport falls back to HTTP/1.1.")
+        self.client = httpx.Client(http2=self.http2, limits=httpx.Limits(max_connections=max_connections),
+                                   headers={'Accept-Encoding': ACCEPT_ENCODING})
+
+    def request(self, method, url, session=None, **kwargs):
+        headers, cookies = sessions.defaults(url)
+        if session is not None:
+            headers.update(session.headers)
+            cookies.update(session.cookies.get_dict())
+        headers.update(kwargs.pop('headers', None) or {})
+        cookies.update(kwargs.pop('cookies', None) or {})
+        data = kwargs.pop('data', None)
+        stream = kwargs.pop('stream', False)
+        request = self.client.build_request(
+            method, url,
+            params=kwargs.pop('params', None),
+            headers=headers,
+            cookies=cookies,
+            json=kwargs.pop('json', None),
+            # requests sends a str or bytes 'data' as the raw body and a dict as a form
+            content=data if isinstance(data, (str, bytes)) else None,
+            data=data if isinstance(data, dict) else None,
+            timeout=kwargs.pop('timeout', None),
+        )
+        start = time.perf_counter()
+        try:
+            # send() returns once the headers are in, so this is the time to first byte
+            response = self.client.send(request, stream=True, follow_redirects=kwargs.pop('allow_redirects', True))
+        except httpx.TimeoutException as e:
+            raise requests.Timeout(str(e)) from e
+        except httpx.TransportError as e:
+            raise requests.ConnectionError(str(e)) from e
+        ttfb = time.perf_counter() - start
+
+        if not stream:
+            body = response.read()
+            response.close()
+            _record_transfer(urlparse(url).netloc, response.http_version, ttfb, response.num_bytes_downloaded, len(body))
+        else:
+            _record_transfer(urlparse(url).netloc, response.http_version, ttfb, None, None)
+        return HttpxResponse(response, url)
+
+    def close(self):
+        self.client.close()
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """Return the process's shared transport, created on first use from TRANSPORT."""
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = HttpxTransport() if TRANSPORT == 'httpx' else RequestsTransport()
+            logging.info(f"HTTP transport: {_transport.name}, Accept-Encoding: {ACCEPT_ENCODING}")
+        return _transport
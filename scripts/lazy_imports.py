@@ -0,0 +1,53 @@
+import importlib
+import threading
+
+
+class LazyModule:
+    """
+    Stands in for a module until one of its attributes is first used, then imports it.
+
+    Usage:
+        pd = lazy_import('pandas')
+        ...
+        frame = pd.DataFrame(rows)  # pandas is imported here, on first use
+
+    The import runs under a lock, so the scrapers' worker threads can hit the first use at
+    the same time. importlib.util.LazyLoader is not used because it is not thread-safe
+    before Python 3.12. Attributes are cached on the stand-in after their first lookup.
+    """
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+        self.__dict__['_lock'] = threading.Lock()
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            with self.__dict__['_lock']:
+                module = self.__dict__['_module']
+                if module is None:
+                    module = importlib.import_module(self.__dict__['_name'])
+                    self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        value = getattr(self._load(), attr)
+        self.__dict__[attr] = value
+        return value
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+        self.__dict__[attr] = value
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_module'] is not None else 'not loaded'
+        return f"<lazy module '{self.__dict__['_name']}' ({state})>"
+
+
+def lazy_import(name):
+    """Return a stand-in for a module that imports it on first attribute access."""
+    return LazyModule(name)
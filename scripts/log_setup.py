@@ -0,0 +1,160 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+
+LOG_FOLDER = "logs"
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Level per retailer logger, e.g. {'Woolworths': logging.WARNING} to keep only its warnings and errors
+RETAILER_LEVELS = {}
+# Seconds between progress lines on the console, per Progress
+PROGRESS_INTERVAL = 5.0
+# Pass as extra= to also show an INFO record on the console; warnings and errors always are
+CONSOLE = {'console': True}
+
+_listener = None
+_log_file = None
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line, with any progress counts as fields. A traceback is part of the message."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'progress', None):
+            entry.update(record.progress)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _to_console(record):
+    return record.levelno >= logging.WARNING or getattr(record, 'console', False)
+
+
+def console_handler():
+    """Return a stdout handler that passes warnings, errors and records logged with extra=CONSOLE."""
+    handler = logging.StreamHandler(sys.stdout)
+    handler.addFilter(_to_console)
+    return handler
+
+
+def setup_logging(name, json_lines=False, console=True):
+    """
+    Send this process's log records through a queue to a listener thread.
+
+    Logging calls only put the record on an unbounded queue, so scraper threads never wait on
+    the log file or the console. The listener thread writes every record to
+    'logs/<name>_<timestamp>.log', also as JSON lines to '.jsonl' if json_lines is set, and
+    prints warnings, errors and records logged with extra=CONSOLE to stdout. It drains the
+    queue when the process exits.
+
+    Only the first call in a process configures logging; later calls return the same file.
+
+    Args:
+        name (str): Log file prefix, e.g. 'checkers'.
+        json_lines (bool): Also write structured JSON lines.
+        console (bool): Print console records to stdout.
+
+    Returns:
+        str: The log file.
+    """
+    global _listener, _log_file
+    if _listener is not None:
+        return _log_file
+
+    os.makedirs(LOG_FOLDER, exist_ok=True)
+    _log_file = os.path.join(LOG_FOLDER, f"{name}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.log")
+    file_handler = logging.FileHandler(_log_file, encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+    handlers = [file_handler]
+    if json_lines:
+        json_handler = logging.FileHandler(f"{os.path.splitext(_log_file)[0]}.jsonl", encoding='utf-8')
+        json_handler.setFormatter(JsonLinesFormatter())
+        handlers.append(json_handler)
+    if console:
+        handlers.append(console_handler())
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(logging.INFO)
+    for retailer, level in RETAILER_LEVELS.items():
+        retailer_logger(retailer).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _log_file
+
+
+def stop_logging():
+    """Write out the queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def retailer_logger(retailer):
+    """Return a retailer's logger. Its level is set from RETAILER_LEVELS or a scraper's --log-level."""
+    return logging.getLogger(f"scraper.{retailer}")
+
+
+class Progress:
+    """
+    Counts a crawl's progress and logs it as one line at most every PROGRESS_INTERVAL seconds.
+
+    Replaces a print per page or request. Threads call add() for each unit of work; the line
+    goes to the log file and the console, and its counts are fields of the JSON lines.
+    """
+
+    def __init__(self, logger, interval=PROGRESS_INTERVAL):
+        self.logger = logger
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.started = self.last = time.monotonic()
+
+    def add(self, **counts):
+        """Add to the counts, e.g. add(pages=1, products=72), and log them if the interval has passed."""
+        now = time.monotonic()
+        with self.lock:
+            for key, value in counts.items():
+                self.counts[key] = self.counts.get(key, 0) + value
+            if now - self.last < self.interval:
+                return
+            self.last = now
+            snapshot = dict(self.counts)
+        self._log(snapshot, now)
+
+    def done(self):
+        """Log the final counts."""
+        with self.lock:
+            snapshot = dict(self.counts)
+        self._log(snapshot, time.monotonic(), final=True)
+
+    def _log(self, counts, now, final=False):
+        elapsed = now - self.started
+        rates = ', '.join(f"{count} {key}" for key, count in counts.items()) or 'nothing yet'
+        if counts and elapsed > 0:
+            key, count = next(iter(counts.items()))
+            rates += f" ({count / elapsed:.1f} {key}/s)"
+        retailer = self.logger.name.rpartition('.')[2]
+        self.logger.info(f"{retailer} {'done' if final else 'progress'}: {rates} in {elapsed:.0f}s.",
+                         extra=dict(CONSOLE, progress=dict(counts, elapsed_seconds=round(elapsed, 1))))
@@ -0,0 +1,243 @@
+import argparse
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from supabase_sync import retailer_slug
+
+METRICS_FOLDER = "metrics"
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_SECONDS = 'scraper_stage_seconds'
+STAGE_BYTES = 'scraper_stage_bytes_total'
+STAGE_ERRORS = 'scraper_stage_errors_total'
+
+_HELP = {
+    STAGE_SECONDS: 'Time spent in each scraper stage.',
+    STAGE_BYTES: 'Bytes received or sent by each scraper stage.',
+    STAGE_ERRORS: 'Exceptions raised out of each scraper stage.',
+    'scraper_pages_total': 'Listing pages by outcome.',
+    'scraper_products_total': 'Product rows written to the CSV output.',
+    'scraper_backoffs_total': 'Decreases of a host\'s in-flight request limit, by reason.',
+    'http_requests_total': 'Requests by host and HTTP version.',
+    'http_ttfb_seconds': 'Time to first byte of each request.',
+    'http_wire_bytes_total': 'Response body bytes as received, before decompression.',
+    'http_body_bytes_total': 'Response body bytes after decompression.',
+}
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus layout."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate a quantile by linear interpolation within its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for position, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[position - 1] if position else 0.0
+                upper = self.buckets[position] if position < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+
+class Metrics:
+    """
+    Counters and latency histograms for one scraper process, labelled by stage and retailer.
+
+    Usage:
+        with metrics.timer('fetch', 'Checkers'):
+            response = requests.get(url)
+        metrics.add_bytes('fetch', 'Checkers', len(response.content))
+
+    Safe to use from the scrapers' worker threads. Stages are the ones named in the README:
+    fetch, parse, heavy_attributes, image_download, image_upload, csv_write, dedup and upsert.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.started_at = time.time()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(self.buckets)
+            self.histograms[key].observe(value)
+
+    def add_bytes(self, stage, retailer, count):
+        self.inc(STAGE_BYTES, count, stage=stage, retailer=retailer)
+
+    @contextmanager
+    def timer(self, stage, retailer):
+        """Time a stage. Exceptions are counted and re-raised; the time is recorded either way."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc(STAGE_ERRORS, stage=stage, retailer=retailer)
+            raise
+        finally:
+            self.observe(STAGE_SECONDS, time.perf_counter() - start, stage=stage, retailer=retailer)
+
+    def to_prometheus(self):
+        """Render every metric in the Prometheus text exposition format."""
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: (list(h.counts), h.sum, h.count) for key, h in self.histograms.items()}
+
+        lines = []
+        for name in sorted({key[0] for key in counters}):
+            lines += [f"# HELP {name} {_HELP.get(name, name)}", f"# TYPE {name} counter"]
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        for name in sorted({key[0] for key in histograms}):
+            lines += [f"# HELP {name} {_HELP.get(name, name)}", f"# TYPE {name} histogram"]
+            for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(list(self.buckets) + ['+Inf'], counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """
+        Summarize the run per retailer and stage.
+
+        Returns:
+            dict: Run timing, counters and, per retailer and stage, the call count, total and
+            estimated p50/p95 seconds, bytes and errors. Stages are sorted by total time.
+        """
+        with self.lock:
+            stages = {}
+            for (name, labels), histogram in self.histograms.items():
+                if name != STAGE_SECONDS:
+                    continue
+                label_map = dict(labels)
+                stages[(label_map.get('retailer'), label_map.get('stage'))] = {
+                    'retailer': label_map.get('retailer'),
+                    'stage': label_map.get('stage'),
+                    'count': histogram.count,
+                    'total_seconds': round(histogram.sum, 3),
+                    'p50_seconds': round(histogram.quantile(0.5), 3),
+                    'p95_seconds': round(histogram.quantile(0.95), 3),
+                    'max_seconds': round(histogram.max, 3),
+                    'bytes': 0,
+                    'errors': 0,
+                }
+            counters = []
+            for (name, labels), value in self.counters.items():
+                label_map = dict(labels)
+                stage = stages.get((label_map.get('retailer'), label_map.get('stage')))
+                if name == STAGE_BYTES and stage:
+                    stage['bytes'] = int(value)
+                elif name == STAGE_ERRORS and stage:
+                    stage['errors'] = int(value)
+                else:
+                    counters.append({'name': name, **label_map, 'value': value})
+
+        return {
+            'started_at': datetime.fromtimestamp(self.started_at).isoformat(timespec='seconds'),
+            'wall_seconds': round(time.time() - self.started_at, 3),
+            'stages': sorted(stages.values(), key=lambda stage: stage['total_seconds'], reverse=True),
+            'counters': counters,
+        }
+
+    def write(self, name, folder=METRICS_FOLDER):
+        """
+        Write '<name>.prom' for a Prometheus textfile collector and a timestamped JSON run summary.
+
+        Args:
+            name (str): The retailer, or 'daily' for daily_scrape.py.
+            folder (str): The output folder (default: metrics).
+
+        Returns:
+            str: The path of the JSON run summary.
+        """
+        os.makedirs(folder, exist_ok=True)
+        slug = retailer_slug(name)
+        prom_path = os.path.join(folder, f"{slug}.prom")
+        tmp_path = f"{prom_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, prom_path)
+
+        summary_path = os.path.join(folder, f"{slug}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.json")
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=2)
+        logging.info(f"Metrics written to {prom_path} and {summary_path}.")
+        return summary_path
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_summary(summary):
+    """Render a run summary as a table of stages, slowest first."""
+    lines = [f"Run started {summary['started_at']}, {summary['wall_seconds']:.1f}s wall time.",
+             f"{'retailer':<12} {'stage':<17} {'calls':>7} {'total s':>9} {'p50 s':>7} {'p95 s':>7} {'MB':>8} {'errors':>6}"]
+    for stage in summary['stages']:
+        lines.append(f"{stage['retailer']:<12} {stage['stage']:<17} {stage['count']:>7} {stage['total_seconds']:>9.2f} "
+                     f"{stage['p50_seconds']:>7.2f} {stage['p95_seconds']:>7.2f} {stage['bytes'] / 1e6:>8.2f} {stage['errors']:>6}")
+    return "\n".join(lines)
+
+
+# Shared by every module of one scraper process
+metrics = Metrics()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show a scraper run summary written by metrics.py.")
+    parser.add_argument("summary", type=str, help="A metrics/<retailer>_<timestamp>.json file")
+    args = parser.parse_args()
+
+    with open(args.summary, encoding='utf-8') as f:
+        print(format_summary(json.load(f)))
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from log_setup import CONSOLE
+from supabase_sync import SNAPSHOT_FOLDER, retailer_slug
+
+# Re-process a page in full once its stored records are this old, so changes the listing does
+# not show (e.g. a new 'Valid until' date on an unchanged promotion) are still picked up
+FINGERPRINT_MAX_AGE_DAYS = 7
+
+
+def page_fingerprint(*parts):
+    """
+    Fingerprint a listing page from what its first-stage response says about its products.
+
+    Args:
+        *parts: JSON-serializable values, e.g. the product codes and prices on the page.
+
+    Returns:
+        str: A hex digest that changes whenever any part changes.
+    """
+    content = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class PageFingerprintStore:
+    """
+    The fingerprint and output records of every listing page from the previous run of a retailer.
+
+    Scrapers look a page up after its first request. When the fingerprint matches, the page's
+    downstream work (images, heavy attributes) is skipped and the stored records are reused.
+    Safe to use from the scrapers' worker threads.
+    """
+
+    def __init__(self, retailer, folder=SNAPSHOT_FOLDER, max_age_days=FINGERPRINT_MAX_AGE_DAYS):
+        self.retailer = retailer
+        self.path = os.path.join(folder, f"{retailer_slug(retailer)}_pages.json")
+        self.max_age = max_age_days * 86400
+        self.lock = threading.Lock()
+        self.pages = {}
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    self.pages = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Could not read page fingerprints from {self.path}: {e}. Crawling all pages.")
+
+    def unchanged(self, page_key, fingerprint):
+        """
+        Return the records stored for a page if its fingerprint is unchanged, otherwise None.
+
+        Args:
+            page_key: The page number, or any other identifier of the page within the retailer.
+            fingerprint (str): The page's fingerprint in this run.
+        """
+        with self.lock:
+            entry = self.pages.get(str(page_key))
+            if entry and entry['fingerprint'] == fingerprint and time.time() - entry['updated_at'] < self.max_age:
+                self.hits += 1
+                return [dict(record) for record in entry['records']]
+            self.misses += 1
+            return None
+
+    def record(self, page_key, fingerprint, records):
+        """Store a fully processed page's fingerprint and records."""
+        with self.lock:
+            self.pages[str(page_key)] = {'fingerprint': fingerprint, 'updated_at': time.time(), 'records': list(records)}
+
+    def save(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.pages, f, ensure_ascii=False, default=str)
+            os.replace(tmp_path, self.path)
+        logging.info(f"{self.retailer} pages: {self.hits} unchanged, {self.misses} processed.", extra=CONSOLE)
@@ -0,0 +1,164 @@
+import html
+import json
+import logging
+import math
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from lazy_imports import lazy_import
+from page_fingerprints import page_fingerprint
+
+bs4 = lazy_import('bs4')
+
+# Parser processes, leaving one core for the I/O threads; 0 (on a single core) parses on the calling thread
+PARSE_PROCESSES = (os.cpu_count() or 1) - 1
+
+
+def get_product_codes(json_data):
+    """
+    Read the product codes, in listing order, from a page's productListJSON.
+
+    Args:
+        json_data (str): The text of the page's '.productListJSON' element.
+
+    Returns:
+        list: The product code of each listed product, or None where there is none.
+    """
+    try:
+        data = json.loads(json_data)
+    except ValueError:
+        return []
+    if isinstance(data, dict):
+        data = next((value for value in data.values() if isinstance(value, list)), [])
+    return [(entry.get('code') or entry.get('productCode')) if isinstance(entry, dict) else None for entry in data]
+
+
+def parse_listing(page_html):
+    """
+    Parse a Checkers or Shoprite listing page into compact product records.
+
+    Args:
+        page_html (str): The listing page.
+
+    Returns:
+        dict: 'json_data', the text of the page's productListJSON, which the heavy attributes
+        request posts back; 'fingerprint' of the page; and 'products', with each product's
+        'code', 'name', 'price_old', 'price_current' and 'image' (its first usable image source).
+    """
+    soup = bs4.BeautifulSoup(page_html, "html.parser")
+    json_data = soup.select('.productListJSON')[0].text
+    items = soup.select('.item-product')  # CSS selector for product items
+    product_codes = get_product_codes(json_data)
+
+    products = []
+    for position, item in enumerate(items):
+        before = item.select_one('.before')
+        now = item.select_one('.now')
+        products.append({
+            'code': product_codes[position] if position < len(product_codes) else None,
+            'name': item.select_one('.item-product__name').get_text(strip=True),
+            'price_old': before.get_text(strip=True) if before else None,
+            'price_current': now.get_text(strip=True) if now else None,
+            'image': next(
+                (img.get('data-original-src') for img in item.select('img')
+                 if img.get('data-original-src') and "discovery-vitality" not in img.get('data-original-src')),
+                None
+            ),
+        })
+
+    # Product codes come from the page's JSON, names and prices from the listing itself
+    fingerprint = page_fingerprint(json_data, [
+        [tag.get_text(strip=True) for tag in item.select('.item-product__name, .before, .now')]
+        for item in items
+    ])
+    return {'json_data': json_data, 'fingerprint': fingerprint, 'products': products}
+
+
+def _present(value):
+    return bool(value) and not (isinstance(value, float) and math.isnan(value))
+
+
+def parse_promotions(response_text):
+    """
+    Parse a heavy attributes response into each product's promotion.
+
+    Args:
+        response_text (str): The JSON response of populateProductsWithHeavyAttributes.
+
+    Returns:
+        list: Per product, in listing order, 'promotion_price' ('No promo' if there is none) and
+        'promotion_valid', the 'Valid until ...' text, or None if the promotion has none.
+    """
+    promotions = []
+    for result in json.loads(response_text):
+        information = result.get('information', [{}])[0]
+        sale_price = information.get('salePrice')
+        bonus_buys = information.get('includedInBonusBuys', [])
+
+        # Get Valid Until information (if there is a promotion)
+        soup = bs4.BeautifulSoup(html.unescape(information.get('htmlBBs', '')), 'html.parser')
+        valid_until_tag = soup.find('span', class_='item-product__valid')
+        valid_until = valid_until_tag.get_text(strip=True).replace('\xa0', ' ') if valid_until_tag else None
+
+        # Determine promotion price with optional date tag
+        if _present(sale_price):
+            promotion_price = f"R{sale_price}".strip()
+        elif bonus_buys and _present(bonus_buys[0].get('name')):
+            promotion_price = f"{bonus_buys[0].get('name')}".strip()
+        else:
+            promotion_price = 'No promo'
+        promotions.append({'promotion_price': promotion_price, 'promotion_valid': valid_until})
+    return promotions
+
+
+class ParsePool:
+    """
+    Runs page parsing in a pool of processes, so parsing is not serialized by the GIL.
+
+    The scrapers' threads keep doing the network I/O and hand each response's text to run(),
+    which blocks the calling thread until a parser process returns the compact records.
+    Pages from all threads are parsed on up to PARSE_PROCESSES cores at once. The pool is
+    started on first use. If it can't be started or breaks, parsing continues on the
+    calling thread.
+    """
+
+    def __init__(self, processes=PARSE_PROCESSES):
+        self.processes = processes
+        self.lock = threading.Lock()
+        self.executor = None
+        self.broken = False
+
+    def _executor(self):
+        with self.lock:
+            if self.executor is None and not self.broken and self.processes > 0:
+                try:
+                    self.executor = ProcessPoolExecutor(max_workers=self.processes)
+                except (OSError, NotImplementedError) as e:
+                    logging.warning(f"Could not start the parser processes: {e}. Parsing on the scraper threads.")
+                    self.broken = True
+            return self.executor
+
+    def run(self, function, *args):
+        """Return function(*args), computed in a parser process."""
+        executor = self._executor()
+        if executor is not None:
+            try:
+                return executor.submit(function, *args).result()
+            except BrokenProcessPool as e:
+                logging.warning(f"The parser processes stopped: {e}. Parsing on the scraper threads.")
+                with self.lock:
+                    self.broken = True
+                    self.executor = None
+        return function(*args)
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+
+# Shared by all scraper threads of a process
+parse_pool = ParsePool()
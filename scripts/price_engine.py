@@ -0,0 +1,197 @@
+import re
+
+from lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Promotion types written to the 'promo_type' column
+PROMO_NONE = 'none'
+PROMO_FLAT = 'flat'
+PROMO_MULTIBUY = 'multibuy'
+PROMO_PERCENTAGE = 'percentage'
+PROMO_OTHER = 'other'
+
+# Columns added by annotate_prices
+PRICE_COLUMNS = ['price_cents', 'promo_cents', 'promo_type', 'promo_qty']
+
+# A rand amount such as 'R119.99', 'R 1 299,00', 'R1,299.99' or 'R1299.99'. The grouped form must
+# end the number, so an ungrouped 'R1299' is not read as its first three digits
+_AMOUNT = r'R\s?(\d{1,3}(?:[ ,]\d{3})*(?:[.,]\d{1,2})?(?!\d)|\d+(?:[.,]\d{1,2})?)'
+_PRICE_PATTERN = re.compile(_AMOUNT, re.IGNORECASE)
+_BARE_NUMBER_PATTERN = re.compile(r'^\s*(\d+(?:\.\d{1,2})?)\s*$')
+
+# 'Buy Any 2 For R50', '3 for R100', 'Any 2 for R40'
+_MULTIBUY_PATTERN = rf'(?:buy\s+)?(?:any\s+)?(\d+)\s*(?:x\s*)?for\s*{_AMOUNT}'
+# 'Buy 2 Get 1 Free', 'Buy 2 Get the 3rd Free'
+_GET_FREE_PATTERN = r'buy\s+(?:any\s+)?(\d+)\s*(?:and\s+)?get\s+(?:the\s+\d+\w*|(\d+))\s+free'
+# '20% off', 'Buy any 2 save 25%', '100% off'
+_PERCENT_PATTERN = r'(?:buy\s+(?:any\s+)?(\d+)\D*?)?(?<![\d.])(100(?:\.0+)?|\d{1,2}(?:\.\d+)?)\s*%'
+# 'Save R10'
+_SAVE_PATTERN = rf'save\s*{_AMOUNT}'
+
+
+def _amount_to_cents(amounts):
+    """Convert a Series of matched amount strings to nullable integer cents."""
+    amounts = amounts.astype('string')
+    # A trailing ',dd' is a decimal comma; any other separator groups thousands
+    amounts = amounts.str.replace(r',(\d{1,2})$', r'.\1', regex=True).str.replace(r'[ ,]', '', regex=True)
+    parts = amounts.str.split('.', n=1, expand=True).reindex(columns=[0, 1])
+    rands = pd.to_numeric(parts[0].astype('string'), errors='coerce')
+    cents = pd.to_numeric(parts[1].astype('string').str.ljust(2, '0'), errors='coerce').fillna(0)
+    return (rands * 100 + cents).round().astype('Int64').where(rands.notna())
+
+
+def _amount_string_to_cents(amount):
+    """Convert one matched amount string to integer cents, as _amount_to_cents does for a Series."""
+    amount = re.sub(r'[ ,]', '', re.sub(r',(\d{1,2})$', r'.\1', amount))
+    rands, _, cents = amount.partition('.')
+    return int(rands) * 100 + int(cents.ljust(2, '0'))
+
+
+def parse_price_cents(price):
+    """
+    Parse a single display price such as 'R119.99' into integer cents.
+
+    Args:
+        price (str): The display price.
+
+    Returns:
+        int or None: The price in cents, or None if the string holds no price.
+
+    Examples:
+        >>> [parse_price_cents(price) for price in ['R119.99', 'R1299.99', 'R1,299.99', 'R 1 299,00', 'R1299']]
+        [11999, 129999, 129999, 129900, 129900]
+        >>> [parse_price_cents(price) for price in ['R12345', 'R12,345', 'R12 345.50', 'R12345.5', 'Price not available']]
+        [1234500, 1234500, 1234550, 1234550, None]
+    """
+    if not isinstance(price, str) or not price:
+        return None
+    match = _PRICE_PATTERN.search(price) or _BARE_NUMBER_PATTERN.match(price)
+    if not match:
+        return None
+    return _amount_string_to_cents(match.group(1))
+
+
+def prices_to_cents(prices):
+    """
+    Vectorized parse of display prices into integer cents.
+
+    Args:
+        prices (pd.Series): Display prices such as 'R119.99' or 'Price not available'.
+
+    Returns:
+        pd.Series: Nullable Int64 cents, <NA> where no price could be parsed.
+    """
+    prices = prices.astype('string')
+    amounts = prices.str.extract(_AMOUNT, flags=re.IGNORECASE)[0]
+    amounts = amounts.fillna(prices.str.extract(_BARE_NUMBER_PATTERN.pattern)[0])
+    return _amount_to_cents(amounts)
+
+
+def parse_promotions(promotions, price_cents):
+    """
+    Vectorized parse of promotion strings.
+
+    Flat prices ('R99.99', 'Save R10'), multibuys ('Buy Any 2 For R50', 'Buy 2 Get 1 Free') and
+    percentages ('20% off', 'Buy any 2 save 25%') are recognised. For multibuys 'promo_cents'
+    is the price of the whole bundle of 'promo_qty' items; for everything else it is the
+    promotional price of a single item.
+
+    Args:
+        promotions (pd.Series): The 'promotion_price' column.
+        price_cents (pd.Series): The regular price of each row in cents.
+
+    Returns:
+        pd.DataFrame: 'promo_cents' (Int64), 'promo_type' (str) and 'promo_qty' (Int64) columns.
+    """
+    text = promotions.astype('string').fillna('').str.strip()
+    lowered = text.str.lower()
+    price = price_cents.astype('Float64')
+
+    multibuy = lowered.str.extract(_MULTIBUY_PATTERN, flags=re.IGNORECASE)
+    multibuy_qty = pd.to_numeric(multibuy[0], errors='coerce')
+    multibuy_cents = _amount_to_cents(multibuy[1]).astype('Float64')
+
+    get_free = lowered.str.extract(_GET_FREE_PATTERN, flags=re.IGNORECASE)
+    paid_qty = pd.to_numeric(get_free[0], errors='coerce')
+    free_qty = pd.to_numeric(get_free[1], errors='coerce').fillna(1)
+
+    percent = lowered.str.extract(_PERCENT_PATTERN, flags=re.IGNORECASE)
+    percent_qty = pd.to_numeric(percent[0], errors='coerce').fillna(1)
+    percent_off = pd.to_numeric(percent[1], errors='coerce')
+
+    saving = _amount_to_cents(lowered.str.extract(_SAVE_PATTERN, flags=re.IGNORECASE)[0]).astype('Float64')
+    flat = prices_to_cents(text).astype('Float64')
+
+    is_none = (text == '') | lowered.isin(['no promo', 'nan'])
+    is_multibuy = multibuy_qty.notna() & multibuy_cents.notna()
+    is_get_free = paid_qty.notna()
+    is_percent = percent_off.notna()
+    is_saving = saving.notna()
+    is_flat = flat.notna()
+
+    conditions = [
+        is_none.to_numpy(dtype=bool),
+        is_multibuy.to_numpy(dtype=bool),
+        is_get_free.to_numpy(dtype=bool),
+        is_percent.to_numpy(dtype=bool),
+        is_saving.to_numpy(dtype=bool),
+        is_flat.to_numpy(dtype=bool),
+    ]
+    promo_type = np.select(
+        conditions,
+        [PROMO_NONE, PROMO_MULTIBUY, PROMO_MULTIBUY, PROMO_PERCENTAGE, PROMO_FLAT, PROMO_FLAT],
+        default=PROMO_OTHER,
+    )
+    promo_qty = np.select(
+        conditions,
+        [np.nan, multibuy_qty, paid_qty + free_qty, percent_qty, 1, 1],
+        default=np.nan,
+    )
+    promo_cents = np.select(
+        conditions,
+        [
+            np.nan,
+            multibuy_cents.to_numpy(dtype=float, na_value=np.nan),
+            (price * paid_qty).to_numpy(dtype=float, na_value=np.nan),
+            (price * percent_qty * (100 - percent_off) / 100).to_numpy(dtype=float, na_value=np.nan),
+            (price - saving).to_numpy(dtype=float, na_value=np.nan),
+            flat.to_numpy(dtype=float, na_value=np.nan),
+        ],
+        default=np.nan,
+    )
+
+    return pd.DataFrame({
+        'promo_cents': pd.Series(promo_cents, index=promotions.index).round().astype('Int64'),
+        'promo_type': pd.Series(promo_type, index=promotions.index),
+        'promo_qty': pd.Series(promo_qty, index=promotions.index).astype('Int64'),
+    })
+
+
+def annotate_prices(df):
+    """
+    Add integer-cent price columns and the parsed promotion type to a retailer's output.
+
+    Args:
+        df (pd.DataFrame): Products with 'price' and 'promotion_price' columns.
+
+    Returns:
+        pd.DataFrame: The same DataFrame with PRICE_COLUMNS added or refreshed.
+    """
+    if df.empty:
+        for column in PRICE_COLUMNS:
+            df[column] = pd.Series(dtype='string' if column == 'promo_type' else 'Int64')
+        return df
+
+    # Catalogues repeat the same price and promotion strings many times, so only parse each pair once
+    pairs = df['price'].astype('string').fillna('') + '\x1f' + df['promotion_price'].astype('string').fillna('')
+    codes, uniques = pd.factorize(pairs)
+    first_rows = pd.Series(np.arange(len(codes))).groupby(codes).first().to_numpy()
+    unique_df = df.iloc[first_rows][['price', 'promotion_price']].reset_index(drop=True)
+
+    parsed = parse_promotions(unique_df['promotion_price'], prices_to_cents(unique_df['price']))
+    parsed.insert(0, 'price_cents', prices_to_cents(unique_df['price']))
+    for column in PRICE_COLUMNS:
+        df[column] = pd.Series(parsed[column].array.take(codes), index=df.index)
+    return df
@@ -0,0 +1,381 @@
+import argparse
+import glob
+import io
+import json
+import logging
+import os
+import re
+import time
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from log_setup import CONSOLE, setup_logging
+from price_engine import annotate_prices
+from snapshot_store import SnapshotStore
+from supabase_sync import row_keys
+
+PRODUCTS_FILE = "products.csv"
+BACKUP_FOLDER = "backup"
+HISTORY_FOLDER = "price_history"
+
+# One record per product per day on which its price or promotion changed, or on which it
+# dropped out of the snapshot. 'price' and 'promo' are deltas in cents against the product's
+# previous record; absent prices are stored as -1.
+RECORD_DTYPE = np.dtype([('day', '<i4'), ('pid', '<i4'), ('price', '<i4'), ('promo', '<i4')])
+MISSING = -1
+# Price and promotion of a product that is not listed in the snapshot
+GONE = -2
+_BACKUP_TIMESTAMP_PATTERN = re.compile(r'products_(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})\.csv$')
+
+
+def _to_day(value):
+    if isinstance(value, str):
+        value = datetime.strptime(value, '%Y-%m-%d').date()
+    if isinstance(value, datetime):
+        value = value.date()
+    return value.toordinal()
+
+
+def _from_day(day):
+    return date.fromordinal(int(day))
+
+
+class PriceHistory:
+    """
+    An append-only store of per-product price timelines built from daily snapshots.
+
+    Files in the history folder:
+        records.bin: RECORD_DTYPE records, appended one day at a time.
+        index.json: Product keys (a product's id is its position), and per day the first
+                    record and record count, for range queries.
+        last.npz: The latest absolute (price, promo) cents per product id, to delta-encode the next
+                  day, and the record count they were computed from.
+        by_product.npy: Record positions sorted by product id, for point lookups.
+
+    index.json is written last, so an ingest that stopped part-way is undone on the next load: the
+    records it appended are dropped, and last.npz and by_product.npy are rebuilt from the records
+    when their record count does not match the index.
+    """
+
+    def __init__(self, folder=HISTORY_FOLDER):
+        self.folder = folder
+        self.records_path = os.path.join(folder, 'records.bin')
+        self.index_path = os.path.join(folder, 'index.json')
+        self.last_path = os.path.join(folder, 'last.npz')
+        self.by_product_path = os.path.join(folder, 'by_product.npy')
+
+        self.keys = []
+        self.days = []
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding='utf-8') as f:
+                index = json.load(f)
+            self.keys = index['keys']
+            self.days = index['days']
+        self.pids = {key: pid for pid, key in enumerate(self.keys)}
+        self.record_count = self.days[-1][1] + self.days[-1][2] if self.days else 0
+
+        # Drop records appended by an ingest that did not finish writing its index
+        if os.path.exists(self.records_path) and os.path.getsize(self.records_path) > self.record_count * RECORD_DTYPE.itemsize:
+            with open(self.records_path, 'r+b') as f:
+                f.truncate(self.record_count * RECORD_DTYPE.itemsize)
+
+        self._records = None
+        self._by_product = None
+        self._product_starts = None
+        self.last = self._load_last()
+
+    def _load_last(self):
+        if os.path.exists(self.last_path):
+            with np.load(self.last_path) as saved:
+                if int(saved['record_count']) == self.record_count and len(saved['last']) == len(self.keys):
+                    return saved['last']
+        if not self.record_count:
+            return np.empty((0, 2), dtype=np.int32)
+        logging.warning(f"{self.last_path} does not match {self.index_path}. Rebuilding it from the records.")
+        # Each product's first record is its absolute value, so the sum of its deltas is its latest value
+        records = self.records()
+        last = np.zeros((len(self.keys), 2), dtype=np.int64)
+        np.add.at(last[:, 0], records['pid'], records['price'])
+        np.add.at(last[:, 1], records['pid'], records['promo'])
+        return last.astype(np.int32)
+
+    @property
+    def last_day(self):
+        return self.days[-1][0] if self.days else None
+
+    def _save_json(self, path, data):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _save_npy(self, path, array):
+        tmp_path = f"{path}.tmp.npy"
+        np.save(tmp_path, array)
+        os.replace(tmp_path, path)
+
+    def _save_npz(self, path, **arrays):
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    def ingest(self, df, day):
+        """
+        Append one day's snapshot.
+
+        Only products whose price or promotion changed, or that are new, produce a record. So does
+        every product that was listed before but is missing from the snapshot, which is recorded
+        as gone until it is listed again, so the snapshot must hold the whole catalogue.
+        Days must be ingested in increasing order; a day at or before the last ingested day is skipped.
+
+        Args:
+            df (pd.DataFrame): A snapshot with 'name', 'retailer', 'price' and 'promotion_price' columns.
+            day (date or str): The day the snapshot was taken.
+
+        Returns:
+            int: The number of records appended.
+        """
+        day = _to_day(day)
+        if self.last_day is not None and day <= self.last_day:
+            logging.info(f"Price history already holds {_from_day(day)}. Skipping.")
+            return 0
+
+        df = df[df['name'].notna() & df['retailer'].notna()]
+        if 'price_cents' not in df.columns or 'promo_cents' not in df.columns:
+            df = annotate_prices(df.copy())
+        keys = row_keys(df)
+        prices = np.column_stack([
+            df['price_cents'].astype('Float64').fillna(MISSING).to_numpy(dtype=np.int64),
+            df['promo_cents'].astype('Float64').fillna(MISSING).to_numpy(dtype=np.int64),
+        ]).astype(np.int32)
+
+        # Keep the last row of each product when a snapshot repeats a key
+        _, last_positions = np.unique(np.array(keys[::-1], dtype=object), return_index=True)
+        keep = np.sort(len(keys) - 1 - last_positions)
+        keys = [keys[i] for i in keep]
+        prices = prices[keep]
+
+        for key in keys:
+            if key not in self.pids:
+                self.pids[key] = len(self.keys)
+                self.keys.append(key)
+        pids = np.fromiter((self.pids[key] for key in keys), dtype=np.int32, count=len(keys))
+
+        known = len(self.last)
+        if len(self.keys) > known:
+            self.last = np.vstack([self.last, np.full((len(self.keys) - known, 2), MISSING, dtype=np.int32)])
+        is_new = pids >= known
+        previous = np.where(is_new[:, None], 0, self.last[pids])
+        changed = is_new | (prices != self.last[pids]).any(axis=1)
+        listed = np.zeros(known, dtype=bool)
+        listed[pids[~is_new]] = True
+        gone = np.flatnonzero(~listed & (self.last[:known, 0] != GONE)).astype(np.int32)
+
+        records = np.empty(int(changed.sum()) + len(gone), dtype=RECORD_DTYPE)
+        records['day'] = day
+        records['pid'] = np.concatenate([pids[changed], gone])
+        records['price'] = np.concatenate([prices[changed, 0] - previous[changed, 0], GONE - self.last[gone, 0]])
+        records['promo'] = np.concatenate([prices[changed, 1] - previous[changed, 1], GONE - self.last[gone, 1]])
+
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self.records_path, 'ab') as f:
+            f.write(records.tobytes())
+        self.last[pids] = prices
+        self.last[gone] = GONE
+        self.days.append([day, self.record_count, len(records)])
+        self.record_count += len(records)
+
+        self._records = None
+        all_pids = self.records()['pid']
+        self._save_npy(self.by_product_path, np.argsort(all_pids, kind='stable').astype(np.int64))
+        self._save_npz(self.last_path, last=self.last, record_count=np.int64(self.record_count))
+        # The index goes last: until it is replaced, a crash leaves the previous day's state
+        self._save_json(self.index_path, {'keys': self.keys, 'days': self.days})
+        self._by_product = None
+        return len(records)
+
+    def records(self):
+        """Memory-map all records."""
+        if self._records is None:
+            if self.record_count:
+                self._records = np.memmap(self.records_path, dtype=RECORD_DTYPE, mode='r', shape=(self.record_count,))
+            else:
+                self._records = np.empty(0, dtype=RECORD_DTYPE)
+        return self._records
+
+    def _product_records(self, pid):
+        if self._by_product is None:
+            self._by_product = np.load(self.by_product_path, mmap_mode='r') if self.record_count else np.empty(0, np.int64)
+            if len(self._by_product) != self.record_count:
+                # Written by an ingest that did not finish writing its index
+                self._by_product = np.argsort(self.records()['pid'], kind='stable')
+            self._product_starts = np.searchsorted(self.records()['pid'][self._by_product], np.arange(len(self.keys) + 1))
+        positions = self._by_product[self._product_starts[pid]:self._product_starts[pid + 1]]
+        return self.records()[np.sort(positions)]
+
+    def timeline(self, key, start=None, end=None):
+        """
+        Return a product's price timeline.
+
+        Args:
+            key (str): The product ID (see supabase_sync.row_key).
+            start (date or str): The first day to include. The value in effect on that day is included.
+            end (date or str): The last day to include.
+
+        Returns:
+            pd.DataFrame: 'date', 'price_cents', 'promo_cents' and 'listed' for every day the values
+                          changed. Missing prices, and prices on days the product was not listed, are <NA>.
+        """
+        pid = self.pids.get(key)
+        if pid is None:
+            return pd.DataFrame(columns=['date', 'price_cents', 'promo_cents', 'listed'])
+
+        records = self._product_records(pid)
+        days = records['day']
+        price = np.cumsum(records['price'], dtype=np.int64)
+        promo = np.cumsum(records['promo'], dtype=np.int64)
+
+        mask = np.ones(len(days), dtype=bool)
+        if start is not None:
+            start = _to_day(start)
+            # Keep the last change before the range as the value in effect when it starts
+            in_effect = np.searchsorted(days, start, side='right') - 1
+            mask &= np.arange(len(days)) >= max(in_effect, 0)
+        if end is not None:
+            mask &= days <= _to_day(end)
+
+        timeline = pd.DataFrame({
+            'date': [_from_day(day) for day in days[mask]],
+            'price_cents': pd.array(price[mask], dtype='Int64'),
+            'promo_cents': pd.array(promo[mask], dtype='Int64'),
+            'listed': price[mask] != GONE,
+        })
+        for column in ('price_cents', 'promo_cents'):
+            timeline.loc[timeline[column].isin([MISSING, GONE]), column] = pd.NA
+        return timeline
+
+    def price_on(self, key, day):
+        """
+        Return the (price_cents, promo_cents) in effect for a product on a day, or None if unknown
+        or if the product was not listed that day.
+        """
+        timeline = self.timeline(key, end=day)
+        if timeline.empty or not timeline['listed'].iloc[-1]:
+            return None
+        row = timeline.iloc[-1]
+        return (None if pd.isna(row['price_cents']) else int(row['price_cents']),
+                None if pd.isna(row['promo_cents']) else int(row['promo_cents']))
+
+    def changed_between(self, start, end):
+        """
+        Return the keys of products whose price or promotion changed, or that were delisted or
+        listed again, between two days (inclusive).
+        """
+        start, end = _to_day(start), _to_day(end)
+        days = [entry for entry in self.days if start <= entry[0] <= end]
+        if not days:
+            return []
+        records = self.records()[days[0][1]:days[-1][1] + days[-1][2]]
+        return [self.keys[pid] for pid in np.unique(records['pid'])]
+
+
+def resolve_key(retailer, name, products_file=PRODUCTS_FILE):
+    """Look up the history key of a product by retailer and name in the combined catalogue."""
+    df = pd.read_csv(products_file)
+    rows = df[(df['retailer'] == retailer) & (df['name'] == name)]
+    return row_keys(rows)[0] if not rows.empty else f"{retailer}|{name}"
+
+
+def ingest_file(csv_file=PRODUCTS_FILE, day=None, folder=HISTORY_FOLDER):
+    """
+    Ingest a combined products.csv into the price history.
+
+    Args:
+        csv_file (str): The snapshot to ingest.
+        day (date or str): The snapshot's day (default: today).
+        folder (str): The history folder.
+
+    Returns:
+        int: The number of records appended.
+    """
+    try:
+        df = pd.read_csv(csv_file, encoding='utf-8')
+    except UnicodeDecodeError:
+        df = pd.read_csv(csv_file, encoding='latin1')
+    history = PriceHistory(folder)
+    appended = history.ingest(df, day or date.today())
+    logging.info(f"Price history: appended {appended} records from {csv_file}.")
+    return appended
+
+
+def backfill(backup_folder=BACKUP_FOLDER, folder=HISTORY_FOLDER):
+    """
+    Import the backups, snapshots and plain products_<timestamp>.csv files alike, using the
+    last backup of each day.
+
+    Returns:
+        int: The number of days imported.
+    """
+    store = SnapshotStore(backup_folder)
+    # (timestamp, name, function returning something pd.read_csv reads)
+    backups = []
+    for path in glob.glob(os.path.join(backup_folder, 'products_*.csv')):
+        match = _BACKUP_TIMESTAMP_PATTERN.search(os.path.basename(path))
+        if match:
+            backups.append((match.group(1), path, lambda path=path: path))
+    for snapshot in store.snapshots:
+        timestamp = snapshot['timestamp']
+        backups.append((timestamp, f"snapshot {timestamp}", lambda timestamp=timestamp: io.BytesIO(store.read(timestamp))))
+    by_day = {timestamp[:10]: (name, source) for timestamp, name, source in sorted(backups, key=lambda backup: backup[0])}
+
+    history = PriceHistory(folder)
+    imported = 0
+    for day, (name, source) in sorted(by_day.items()):
+        if history.last_day is not None and _to_day(day) <= history.last_day:
+            continue
+        try:
+            df = pd.read_csv(source(), encoding='utf-8')
+        except UnicodeDecodeError:
+            df = pd.read_csv(source(), encoding='latin1')
+        appended = history.ingest(df, day)
+        imported += 1
+        logging.info(f"Price history: imported {name} as {day}: {appended} records.", extra=CONSOLE)
+    return imported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-product price history built from daily snapshots.")
+    parser.add_argument("--folder", type=str, default=HISTORY_FOLDER, help="History folder (default: price_history)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = commands.add_parser("ingest", help="Append a snapshot")
+    ingest_parser.add_argument("csv_file", nargs="?", default=PRODUCTS_FILE)
+    ingest_parser.add_argument("--date", type=str, help="Snapshot date as YYYY-MM-DD (default: today)")
+
+    backfill_parser = commands.add_parser("backfill", help="Import the timestamped backups")
+    backfill_parser.add_argument("--backup-folder", type=str, default=BACKUP_FOLDER)
+
+    query_parser = commands.add_parser("query", help="Show a product's price timeline")
+    query_parser.add_argument("product", type=str, help="A product ID, or a product name together with --retailer")
+    query_parser.add_argument("--retailer", type=str, help="Look the product name up in --products for this retailer")
+    query_parser.add_argument("--products", type=str, default=PRODUCTS_FILE, help="Combined catalogue (default: products.csv)")
+    query_parser.add_argument("--start", type=str, help="First date as YYYY-MM-DD")
+    query_parser.add_argument("--end", type=str, help="Last date as YYYY-MM-DD")
+
+    args = parser.parse_args()
+    if args.command in ("ingest", "backfill"):
+        setup_logging('price_history')
+    if args.command == "ingest":
+        print(f"Appended {ingest_file(args.csv_file, args.date, args.folder)} records.")
+    elif args.command == "backfill":
+        print(f"Imported {backfill(args.backup_folder, args.folder)} days.")
+    else:
+        key = resolve_key(args.retailer, args.product, args.products) if args.retailer else args.product
+        started = time.perf_counter()
+        history = PriceHistory(args.folder)
+        timeline = history.timeline(key, args.start, args.end)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        print(timeline.to_string(index=False) if not timeline.empty else "No history for this product.")
+        print(f"Query took {elapsed_ms:.2f} ms")
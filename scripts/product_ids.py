@@ -0,0 +1,102 @@
+import argparse
+import hashlib
+
+from lazy_imports import lazy_import
+from product_matching import normalize_name, normalize_names
+from supabase_sync import KEY_COLUMN, retailer_slug
+
+pd = lazy_import('pandas')
+
+
+def _name_id(slug, normalized_name):
+    digest = hashlib.sha1(normalized_name.encode('utf-8')).hexdigest()[:16]
+    return f"{slug}:n{digest}"
+
+
+def product_id(retailer, code=None, name=None):
+    """
+    Derive a deterministic product ID.
+
+    The ID is '<retailer slug>:<product code>' when the retailer gives a product code, otherwise
+    '<retailer slug>:n<hash>' of the normalized name, so the same product gets the same ID on
+    every page, thread and day.
+
+    Args:
+        retailer (str): The retailer name as written in the 'retailer' column.
+        code (str): The retailer's product code, if any.
+        name (str): The product name, used when there is no code.
+
+    Returns:
+        str: The product ID, or None if there is neither a code nor a name.
+    """
+    slug = retailer_slug(retailer)
+    code = '' if code is None or (isinstance(code, float) and code != code) else str(code).strip()
+    if code:
+        return f"{slug}:{code}"
+    if not isinstance(name, str) or not name.strip():
+        return None
+    return _name_id(slug, normalize_name(name))
+
+
+def ensure_product_ids(df):
+    """
+    Make 'product_id' the first column, deriving it from the retailer and name wherever it is missing.
+
+    Rows written before product IDs existed also lose their computed 'index' column.
+
+    Args:
+        df (pd.DataFrame): Products with 'retailer' and 'name' columns.
+
+    Returns:
+        pd.DataFrame: The DataFrame with a complete 'product_id' column.
+    """
+    df = df.drop(columns=['index'], errors='ignore')
+    if KEY_COLUMN not in df.columns:
+        df.insert(0, KEY_COLUMN, pd.Series(pd.NA, index=df.index, dtype='object'))
+
+    ids = df[KEY_COLUMN].astype('string').str.strip()
+    missing = (ids.isna() | (ids == '')) & df['name'].notna() & df['retailer'].notna()
+    if missing.any():
+        slugs = df.loc[missing, 'retailer'].map(lambda retailer: retailer_slug(str(retailer)))
+        names = normalize_names(df.loc[missing, 'name'].astype(str))
+        df[KEY_COLUMN] = df[KEY_COLUMN].astype(object)
+        df.loc[missing, KEY_COLUMN] = [_name_id(slug, name) for slug, name in zip(slugs, names)]
+
+    columns = [KEY_COLUMN] + [column for column in df.columns if column != KEY_COLUMN]
+    return df[columns]
+
+
+def _sql_text(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def backfill_sql(csv_file, batch_rows=1000):
+    """
+    Yield SQL statements that fill in 'product_id' on an existing Products table.
+
+    Rows are matched on retailer and name against a products.csv written with product IDs,
+    and only rows without a product ID yet are updated.
+
+    Args:
+        csv_file (str): A products.csv, e.g. the latest backup.
+        batch_rows (int): Rows per UPDATE statement.
+    """
+    try:
+        df = pd.read_csv(csv_file, encoding='utf-8')
+    except UnicodeDecodeError:
+        df = pd.read_csv(csv_file, encoding='latin1')
+    df = ensure_product_ids(df).dropna(subset=[KEY_COLUMN, 'retailer', 'name'])
+    rows = list(df[[KEY_COLUMN, 'retailer', 'name']].itertuples(index=False, name=None))
+    for start in range(0, len(rows), batch_rows):
+        values = ',\n  '.join(f"({', '.join(_sql_text(value) for value in row)})" for row in rows[start:start + batch_rows])
+        yield (f'update "Products" p set product_id = v.product_id\nfrom (values\n  {values}\n) as v(product_id, retailer, name)\n'
+               f'where p.retailer = v.retailer and p.name = v.name and p.product_id is null;\n')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the SQL that backfills product_id on the Products table from a products.csv.")
+    parser.add_argument("csv_file", help="A products.csv with product IDs, e.g. the latest backup")
+    args = parser.parse_args()
+
+    for statement in backfill_sql(args.csv_file):
+        print(statement)
@@ -0,0 +1,338 @@
+import argparse
+import functools
+import logging
+import os
+import re
+import time
+import unicodedata
+import zlib
+from datetime import datetime
+
+from lazy_imports import lazy_import
+from log_setup import CONSOLE, setup_logging
+from supabase_sync import row_keys
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+PRODUCTS_FILE = "products.csv"
+MATCHES_FILE = "product_matches.csv"
+SIGNATURES_FILE = "product_signatures.npz"
+
+# 128 MinHash permutations split into 32 bands of 4 rows: pairs above ~0.45 Jaccard
+# similarity share a band with high probability
+NUM_PERM = 128
+BANDS = 32
+ROWS_PER_BAND = NUM_PERM // BANDS
+MATCH_THRESHOLD = 0.5
+# Pack sizes within this relative difference are considered the same
+SIZE_TOLERANCE = 0.05
+
+# Multiplier to the base unit (g, ml or items) of each pack size unit
+UNITS = {
+    'kg': ('g', 1000), 'g': ('g', 1), 'gr': ('g', 1), 'mg': ('g', 0.001),
+    'l': ('ml', 1000), 'lt': ('ml', 1000), 'ltr': ('ml', 1000), 'litre': ('ml', 1000), 'ml': ('ml', 1), 'cl': ('ml', 10),
+    'pack': ('each', 1), 'pk': ('each', 1), 's': ('each', 1), 'ea': ('each', 1), 'each': ('each', 1),
+}
+_SIZE_PATTERN = (r'(?:(?P<count>\d+)\s*x\s*)?(?P<value>\d+(?:[.,]\d+)?)\s*'
+                 r'(?P<unit>kg|gr|g|mg|litre|ltr|lt|l|ml|cl|pack|pk|ea|each|s)\b')
+_PUNCTUATION = re.compile(r"[^a-z0-9.,x' ]+")
+_WHITESPACE = re.compile(r'\s+')
+_STOP_WORDS = {'and', 'with', 'the', 'of', 'in', 'for'}
+MATCH_COLUMNS = ['key_a', 'key_b', 'retailer_a', 'retailer_b', 'name_a', 'name_b', 'similarity', 'first_seen']
+
+
+@functools.lru_cache(maxsize=None)
+def _permutations():
+    """
+    Multiply-shift hashing: the high 32 bits of (a * h + b) mod 2**64, with odd a, simulate a permutation.
+
+    Built on first use, so importing this module does not import numpy.
+    """
+    rng = np.random.RandomState(1)
+    perm_a = rng.randint(0, 1 << 62, size=NUM_PERM, dtype=np.int64).astype(np.uint64) * np.uint64(2) + np.uint64(1)
+    perm_b = rng.randint(0, 1 << 62, size=NUM_PERM, dtype=np.int64).astype(np.uint64)
+    return perm_a, perm_b, np.uint64(32)
+
+
+def normalize_name(name):
+    """Normalize a single name the same way as normalize_names."""
+    name = unicodedata.normalize('NFKD', str(name)).encode('ascii', 'ignore').decode('ascii')
+    name = _PUNCTUATION.sub(' ', name.lower().replace('&', ' and ')).replace("'", '')
+    return _WHITESPACE.sub(' ', name).strip()
+
+
+def normalize_names(names):
+    """
+    Vectorized normalization of product names: lower case, ASCII, '&' spelt out and punctuation removed.
+
+    Args:
+        names (pd.Series): Product names.
+
+    Returns:
+        pd.Series: The normalized names.
+    """
+    names = names.astype('string').fillna('').map(
+        lambda name: unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii'))
+    names = names.str.lower().str.replace('&', ' and ', regex=False)
+    names = names.str.replace(_PUNCTUATION.pattern, ' ', regex=True).str.replace("'", '', regex=False)
+    return names.str.replace(_WHITESPACE.pattern, ' ', regex=True).str.strip()
+
+
+def parse_pack_sizes(normalized):
+    """
+    Vectorized parse of pack sizes such as '6 x 1l', '700g' or '6s' from normalized names.
+
+    Args:
+        normalized (pd.Series): Names returned by normalize_names.
+
+    Returns:
+        pd.DataFrame: 'size_unit' ('g', 'ml', 'each' or <NA>) and 'size_total', the total quantity
+                      in that unit (e.g. 6000 for '6 x 1l').
+    """
+    found = normalized.str.extract(_SIZE_PATTERN)
+    units = found['unit'].map(lambda unit: UNITS.get(unit, (None, None)) if isinstance(unit, str) else (None, None))
+    count = pd.to_numeric(found['count'], errors='coerce').fillna(1)
+    value = pd.to_numeric(found['value'].str.replace(',', '.', regex=False), errors='coerce')
+    multiplier = pd.to_numeric(units.map(lambda unit: unit[1]), errors='coerce')
+    return pd.DataFrame({
+        'size_unit': units.map(lambda unit: unit[0]).astype('string'),
+        'size_total': count * value * multiplier,
+    }, index=normalized.index)
+
+
+def tokenize(normalized):
+    """
+    Split normalized names into tokens with the pack size removed.
+
+    Returns:
+        pd.Series: A list of tokens per name.
+    """
+    without_size = normalized.str.replace(_SIZE_PATTERN, ' ', regex=True)
+    without_size = without_size.str.replace(r'[.,]', ' ', regex=True)
+    return without_size.str.split().map(lambda tokens: [token for token in tokens if token not in _STOP_WORDS])
+
+
+def _shingle_hashes(tokens):
+    """Hash the tokens and character trigrams of a name into stable 32-bit integers."""
+    text = ' '.join(tokens)
+    shingles = set(tokens)
+    shingles.update(text[i:i + 3] for i in range(max(len(text) - 2, 1)))
+    return [zlib.crc32(shingle.encode('utf-8')) for shingle in shingles if shingle]
+
+
+def minhash_signatures(token_lists, chunk_size=2000):
+    """
+    Compute MinHash signatures for lists of tokens.
+
+    Args:
+        token_lists (iterable): A token list per product.
+        chunk_size (int): Products hashed per vectorized step.
+
+    Returns:
+        np.ndarray: A (products, NUM_PERM) uint32 matrix.
+    """
+    hashed = [_shingle_hashes(tokens) or [0] for tokens in token_lists]
+    perm_a, perm_b, shift = _permutations()
+    signatures = np.empty((len(hashed), NUM_PERM), dtype=np.uint32)
+
+    for start in range(0, len(hashed), chunk_size):
+        chunk = hashed[start:start + chunk_size]
+        lengths = np.fromiter((len(h) for h in chunk), dtype=np.int64, count=len(chunk))
+        flat = np.fromiter((value for h in chunk for value in h), dtype=np.uint64, count=int(lengths.sum()))
+        permuted = ((flat[:, None] * perm_a + perm_b) >> shift).astype(np.uint32)
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        signatures[start:start + len(chunk)] = np.minimum.reduceat(permuted, offsets, axis=0)
+
+    return signatures
+
+
+def prepare_catalogue(df):
+    """
+    Add the matching features to a combined catalogue.
+
+    Args:
+        df (pd.DataFrame): Products with 'name' and 'retailer' columns.
+
+    Returns:
+        pd.DataFrame: The products with 'product_key', 'normalized', 'brand', 'size_unit',
+                      'size_total' and 'tokens' columns, deduplicated on 'product_key'.
+    """
+    df = df[df['name'].notna() & df['retailer'].notna()].copy()
+    df['product_key'] = row_keys(df)
+    df = df.drop_duplicates(subset=['product_key']).reset_index(drop=True)
+    df['normalized'] = normalize_names(df['name'])
+    df = pd.concat([df, parse_pack_sizes(df['normalized'])], axis=1)
+    df['tokens'] = tokenize(df['normalized'])
+    df['brand'] = df['tokens'].map(lambda tokens: tokens[0] if tokens else '')
+    return df
+
+
+def candidate_pairs(signatures, brands, retailers, query_mask):
+    """
+    Generate candidate pairs with brand blocking and MinHash LSH banding.
+
+    Only pairs across different retailers with at least one side in query_mask are returned.
+
+    Args:
+        signatures (np.ndarray): MinHash signatures, one row per product.
+        brands (np.ndarray): The brand (blocking key) of each product.
+        retailers (np.ndarray): The retailer of each product.
+        query_mask (np.ndarray): True for products that need new matches.
+
+    Returns:
+        set: (i, j) row pairs with i < j.
+    """
+    _, brand_ids = np.unique(brands, return_inverse=True)
+    _, retailer_ids = np.unique(retailers, return_inverse=True)
+    count = len(signatures)
+    found = []
+
+    for band in range(BANDS):
+        band_rows = np.ascontiguousarray(signatures[:, band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND])
+        band_keys = np.column_stack([brand_ids.astype(np.uint32), band_rows]).view(
+            np.dtype((np.void, 4 * (ROWS_PER_BAND + 1)))).ravel()
+        order = np.argsort(band_keys, kind='stable')
+        sorted_keys = band_keys[order]
+
+        # Buckets are runs of equal keys in the sorted order. Only buckets with more than one
+        # product and at least one product that needs new matches can yield pairs.
+        starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+        sizes = np.diff(np.append(starts, count))
+        queried = np.add.reduceat(query_mask[order].astype(np.int64), starts) > 0
+        keep = (sizes > 1) & queried
+
+        # Expand buckets of the same size together into all of their (i, j) pairs
+        for size in np.unique(sizes[keep]):
+            members = order[starts[keep & (sizes == size)][:, None] + np.arange(size)]
+            upper_i, upper_j = np.triu_indices(size, k=1)
+            left, right = members[:, upper_i].ravel(), members[:, upper_j].ravel()
+            valid = (retailer_ids[left] != retailer_ids[right]) & (query_mask[left] | query_mask[right])
+            left, right = left[valid], right[valid]
+            found.append(np.minimum(left, right).astype(np.int64) * count + np.maximum(left, right))
+
+    if not found:
+        return set()
+    encoded = np.unique(np.concatenate(found))
+    return set(zip((encoded // count).tolist(), (encoded % count).tolist()))
+
+
+def _sizes_compatible(unit_a, total_a, unit_b, total_b):
+    if pd.isna(unit_a) or pd.isna(unit_b):
+        return True
+    if unit_a != unit_b:
+        return False
+    return abs(total_a - total_b) <= SIZE_TOLERANCE * max(total_a, total_b)
+
+
+def load_signature_cache(path=SIGNATURES_FILE):
+    """Load cached signatures as a dict of product key to (normalized name, signature row)."""
+    if not os.path.exists(path):
+        return {}
+    cache = np.load(path, allow_pickle=False)
+    return {key: (name, signature) for key, name, signature in zip(cache['keys'], cache['names'], cache['signatures'])}
+
+
+def update_matches(products_file=PRODUCTS_FILE, matches_file=MATCHES_FILE, signatures_file=SIGNATURES_FILE,
+                   threshold=MATCH_THRESHOLD, rebuild=False):
+    """
+    Incrementally update the cross-retailer match table from a combined catalogue.
+
+    Signatures are cached per product, so only new or renamed products are hashed. Matches
+    between products that both existed in the previous run are kept. Matches involving
+    products that disappeared are dropped.
+
+    Args:
+        products_file (str): The combined catalogue written by daily_scrape.py.
+        matches_file (str): The persisted match table.
+        signatures_file (str): The persisted MinHash signature cache.
+        threshold (float): The minimum estimated Jaccard similarity of a match.
+        rebuild (bool): Ignore the persisted state and match the whole catalogue again.
+
+    Returns:
+        pd.DataFrame: The updated match table.
+    """
+    started = time.perf_counter()
+    df = prepare_catalogue(pd.read_csv(products_file))
+
+    cache = {} if rebuild else load_signature_cache(signatures_file)
+    cached = np.array([key in cache and cache[key][0] == name for key, name in zip(df['product_key'], df['normalized'])],
+                      dtype=bool)
+    signatures = np.empty((len(df), NUM_PERM), dtype=np.uint32)
+    if cached.any():
+        signatures[cached] = np.stack([cache[key][1] for key in df.loc[cached, 'product_key']])
+    if (~cached).any():
+        signatures[~cached] = minhash_signatures(df.loc[~cached, 'tokens'])
+
+    previous = pd.DataFrame(columns=MATCH_COLUMNS)
+    if not rebuild and os.path.exists(matches_file):
+        previous = pd.read_csv(matches_file)
+    unchanged_keys = set(df.loc[cached, 'product_key'])
+    kept = previous[previous['key_a'].isin(unchanged_keys) & previous['key_b'].isin(unchanged_keys)]
+
+    query_mask = ~cached
+    pairs = candidate_pairs(signatures, df['brand'].to_numpy(dtype=str), df['retailer'].to_numpy(dtype=str), query_mask)
+
+    today = datetime.now().strftime('%Y-%m-%d')
+    new_matches = []
+    if pairs:
+        left, right = np.array(sorted(pairs)).T
+        similarities = (signatures[left] == signatures[right]).mean(axis=1)
+        keys, names, retailers = df['product_key'].tolist(), df['name'].tolist(), df['retailer'].tolist()
+        units, totals = df['size_unit'].tolist(), df['size_total'].tolist()
+        for i, j, similarity in zip(left, right, similarities):
+            if similarity < threshold or not _sizes_compatible(units[i], totals[i], units[j], totals[j]):
+                continue
+            if keys[i] > keys[j]:
+                i, j = j, i
+            new_matches.append([keys[i], keys[j], retailers[i], retailers[j], names[i], names[j],
+                                round(float(similarity), 3), today])
+
+    matches = pd.concat([kept, pd.DataFrame(new_matches, columns=MATCH_COLUMNS)], ignore_index=True)
+    matches = matches.sort_values(by=['similarity'], ascending=False).drop_duplicates(subset=['key_a', 'key_b'])
+    matches.to_csv(matches_file, index=False)
+    np.savez(signatures_file, keys=df['product_key'].to_numpy(dtype=str), names=df['normalized'].to_numpy(dtype=str),
+             signatures=signatures)
+
+    elapsed = time.perf_counter() - started
+    logging.info(f"Product matching: {len(matches)} matches ({len(new_matches)} new, {len(kept)} kept) over {len(df)} products, "
+                 f"{int(query_mask.sum())} hashed, {len(pairs)} candidate pairs, in {elapsed:.2f}s.", extra=CONSOLE)
+    return matches
+
+
+def match_groups(matches):
+    """
+    Group matched products into clusters of the same physical product.
+
+    Args:
+        matches (pd.DataFrame): The match table.
+
+    Returns:
+        dict: Maps each matched product key to a group id (the smallest key in its group).
+    """
+    parent = {}
+
+    def find(key):
+        parent.setdefault(key, key)
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    for key_a, key_b in zip(matches['key_a'], matches['key_b']):
+        root_a, root_b = find(key_a), find(key_b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+    return {key: find(key) for key in parent}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Match the same product across retailers in the combined catalogue.")
+    parser.add_argument("products_file", nargs="?", default=PRODUCTS_FILE, help="Combined catalogue (default: products.csv)")
+    parser.add_argument("--matches", type=str, default=MATCHES_FILE, help="Match table to update (default: product_matches.csv)")
+    parser.add_argument("--threshold", type=float, default=MATCH_THRESHOLD, help="Minimum estimated Jaccard similarity")
+    parser.add_argument("--rebuild", action="store_true", help="Ignore the persisted state and rebuild all matches")
+    args = parser.parse_args()
+
+    setup_logging('product_matching')
+    update_matches(args.products_file, args.matches, threshold=args.threshold, rebuild=args.rebuild)
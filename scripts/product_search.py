@@ -0,0 +1,224 @@
+import argparse
+import bisect
+import hashlib
+import heapq
+import itertools
+import logging
+import os
+import pickle
+import time
+
+import pandas as pd
+
+from product_matching import normalize_name, normalize_names
+
+PRODUCTS_FILE = "products.csv"
+INDEX_FILE = "search_index.pkl"
+# Bump when the pickled layout changes so stale index files are rebuilt
+INDEX_VERSION = 1
+RESULT_COLUMNS = ['name', 'price', 'promotion_price', 'retailer', 'image_url']
+
+
+class SearchIndex:
+    """
+    An in-memory product search index over the combined catalogue.
+
+    Documents are tokenized product names, numbered in static rank order (fewer tokens, then
+    name), so every posting list is already sorted best first. An inverted index maps each
+    token to its posting list, and the sorted vocabulary serves as a compact prefix trie: all
+    tokens starting with a prefix are one contiguous slice found by binary search.
+    """
+
+    def __init__(self):
+        self.records_by_retailer = {}
+        self.retailer_hashes = {}
+        self.documents = []
+        self.postings = {}
+        self.posting_sets = {}
+        self.vocabulary = []
+
+    @staticmethod
+    def tokenize(text):
+        return normalize_name(text).replace('.', ' ').replace(',', ' ').split()
+
+    def update(self, df):
+        """
+        Incrementally update the index from a combined catalogue.
+
+        Only retailers whose rows changed since the last update are re-tokenized.
+
+        Args:
+            df (pd.DataFrame): Products with at least 'name' and 'retailer' columns.
+
+        Returns:
+            list: The retailers that were re-indexed.
+        """
+        df = df[df['name'].notna() & df['retailer'].notna()]
+        columns = [column for column in RESULT_COLUMNS if column in df.columns]
+        changed = []
+
+        for retailer in set(self.records_by_retailer) - set(df['retailer'].unique()):
+            del self.records_by_retailer[retailer]
+            del self.retailer_hashes[retailer]
+            changed.append(retailer)
+
+        for retailer, rows in df.groupby('retailer', sort=False):
+            rows = rows[columns]
+            digest = hashlib.sha1(pd.util.hash_pandas_object(rows, index=False).to_numpy().tobytes()).hexdigest()
+            if self.retailer_hashes.get(retailer) == digest:
+                continue
+
+            tokens = normalize_names(rows['name']).str.replace(r'[.,]', ' ', regex=True).str.split()
+            records = rows.fillna('').to_dict('records')
+            for record, record_tokens in zip(records, tokens):
+                record['tokens'] = record_tokens
+                record['has_promo'] = str(record.get('promotion_price', 'No promo')).strip() not in ('', 'No promo')
+            self.records_by_retailer[retailer] = records
+            self.retailer_hashes[retailer] = digest
+            changed.append(retailer)
+
+        if changed or not self.documents:
+            self._rebuild()
+        return changed
+
+    def _rebuild(self):
+        documents = [record for records in self.records_by_retailer.values() for record in records]
+        documents.sort(key=lambda record: (len(record['tokens']), record['name']))
+        postings = {}
+        for doc_id, record in enumerate(documents):
+            for token in dict.fromkeys(record['tokens']):
+                postings.setdefault(token, []).append(doc_id)
+        self.documents = documents
+        self.postings = postings
+        self.posting_sets = {token: set(doc_ids) for token, doc_ids in postings.items()}
+        self.vocabulary = sorted(postings)
+
+    def _prefix_matches(self, prefix):
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        end = bisect.bisect_left(self.vocabulary, prefix + '\uffff', lo=start)
+        return self.vocabulary[start:end]
+
+    def search(self, query, limit=10, retailer=None, promo_only=False):
+        """
+        Search product names.
+
+        Every query token must match a name token exactly, except the last one, which may
+        also match as a prefix (autocomplete). Results are ranked by how many letters the
+        completion of the last token adds (exact matches first), then by shorter names.
+
+        Args:
+            query (str): The search text.
+            limit (int): The most results to return.
+            retailer (str): Only return products from this retailer.
+            promo_only (bool): Only return products that are on promotion.
+
+        Returns:
+            list: Product dictionaries with a 'score', best first.
+        """
+        tokens = self.tokenize(query)
+        if not tokens:
+            return []
+        exact, last = tokens[:-1], tokens[-1]
+
+        base = None
+        for token in sorted(exact, key=lambda token: len(self.postings.get(token, ()))):
+            if token not in self.postings:
+                return []
+            base = self.posting_sets[token] if base is None else base & self.posting_sets[token]
+            if not base:
+                return []
+
+        def accept(doc_id):
+            record = self.documents[doc_id]
+            return (not retailer or record['retailer'] == retailer) and (not promo_only or record['has_promo'])
+
+        # Walk the completions of the last token from shortest to longest. Posting lists are in
+        # rank order, so each length group yields its best documents first.
+        hits = []
+        seen = set()
+        for length, group in itertools.groupby(sorted(self._prefix_matches(last), key=len), key=len):
+            if base is None:
+                docs = heapq.merge(*(self.postings[token] for token in group))
+            else:
+                docs = sorted(set().union(*(base & self.posting_sets[token] for token in group)))
+            for doc_id in docs:
+                if doc_id in seen:
+                    continue
+                seen.add(doc_id)
+                if accept(doc_id):
+                    hits.append((length, doc_id))
+                    if len(hits) >= limit:
+                        break
+            if len(hits) >= limit:
+                break
+
+        results = []
+        for length, doc_id in hits:
+            record = self.documents[doc_id]
+            score = len(tokens) * 10 - (length - len(last)) - len(record['tokens']) * 0.1
+            results.append(dict({key: value for key, value in record.items() if key != 'tokens'}, score=round(score, 2)))
+        return results
+
+
+def load_index(index_file=INDEX_FILE):
+    """Load a pickled SearchIndex, or return an empty one if it is missing or stale."""
+    if os.path.exists(index_file):
+        try:
+            with open(index_file, 'rb') as f:
+                version, index = pickle.load(f)
+            if version == INDEX_VERSION:
+                return index
+        except Exception as e:
+            logging.warning(f"Could not load search index {index_file}: {e}. Rebuilding.")
+    return SearchIndex()
+
+
+def save_index(index, index_file=INDEX_FILE):
+    tmp_path = f"{index_file}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump((INDEX_VERSION, index), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, index_file)
+
+
+def update_index(products_file=PRODUCTS_FILE, index_file=INDEX_FILE):
+    """
+    Incrementally rebuild the persisted search index from the combined catalogue.
+
+    Args:
+        products_file (str): The combined catalogue written by daily_scrape.py.
+        index_file (str): The pickled index to update.
+
+    Returns:
+        SearchIndex: The updated index.
+    """
+    started = time.perf_counter()
+    index = load_index(index_file)
+    changed = index.update(pd.read_csv(products_file))
+    if changed:
+        save_index(index, index_file)
+    logging.info(f"Search index: re-indexed {changed or 'no retailers'}; {len(index.documents)} products, "
+                 f"{len(index.vocabulary)} tokens in {time.perf_counter() - started:.2f}s.")
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search product names in the combined catalogue.")
+    parser.add_argument("query", type=str, nargs="?", help="Search text. The last word is matched as a prefix.")
+    parser.add_argument("--products", type=str, default=PRODUCTS_FILE, help="Combined catalogue (default: products.csv)")
+    parser.add_argument("--index", type=str, default=INDEX_FILE, help="Index file (default: search_index.pkl)")
+    parser.add_argument("--retailer", type=str, help="Only show products from this retailer")
+    parser.add_argument("--promo", action="store_true", help="Only show products on promotion")
+    parser.add_argument("--limit", type=int, default=10, help="Number of results (default: 10)")
+    parser.add_argument("--update", action="store_true", help="Update the index from --products before searching")
+    args = parser.parse_args()
+
+    index = update_index(args.products, args.index) if args.update or not os.path.exists(args.index) else load_index(args.index)
+
+    if args.query:
+        started = time.perf_counter()
+        results = index.search(args.query, limit=args.limit, retailer=args.retailer, promo_only=args.promo)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        for result in results:
+            print(f"{result['score']:>7}  {result['retailer']:<11} {result['price']:>10}  "
+                  f"{result['promotion_price']:<22} {result['name']}")
+        print(f"{len(results)} results in {elapsed_ms:.3f} ms")
@@ -0,0 +1,290 @@
+import argparse
+import logging
+import os
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+import runpy
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from log_setup import CONSOLE, setup_logging
+from supabase_sync import retailer_slug
+
+PROFILE_FOLDER = "profiles"
+# Seconds between samples; every thread is sampled at each tick
+SAMPLE_INTERVAL = 0.005
+# Allocation sites listed in a memory report
+MEMORY_REPORT_TOP = 15
+
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') and 'SC_CLK_TCK' in os.sysconf_names else 100
+# Without /proc, a thread whose innermost frame is one of these is counted as waiting rather than on CPU
+_WAITING_FUNCTIONS = {'wait', 'sleep', 'select', 'poll', 'recv', 'recv_into', 'readinto', 'read', 'accept',
+                      'connect', 'create_connection', 'acquire', 'join', '_wait_for_tstate_lock', 'result'}
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    if code.co_filename.startswith('<'):
+        # '<frozen importlib._bootstrap>', '<string>'
+        module = code.co_filename.strip('<>').split()[-1]
+    else:
+        module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{code.co_name}"
+
+
+def _thread_cpu_seconds(native_id):
+    """Return a thread's user plus system CPU time from /proc, or None where that is unavailable."""
+    try:
+        with open(f"/proc/self/task/{native_id}/stat", 'rb') as f:
+            fields = f.read().rsplit(b')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stack of every thread at a fixed interval.
+
+    Wall samples count every thread at every tick, so time spent waiting on HTTP shows up.
+    CPU samples are weighted by the CPU time each thread used since the previous tick, read
+    from /proc on Linux; elsewhere a tick counts as CPU unless the thread is in a blocking call.
+    Both are kept as collapsed stacks ('thread;module:function;... count') that flamegraph.pl,
+    speedscope and inferno read directly.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.wall = Counter()
+        self.cpu = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._cpu_seen = {}
+
+    def _stack(self, frame, thread_name):
+        labels = []
+        while frame is not None:
+            labels.append(_frame_label(frame))
+            frame = frame.f_back
+        labels.append(thread_name)
+        return ';'.join(reversed(labels))
+
+    def _sample(self):
+        threads = {thread.ident: thread for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == self._thread.ident:
+                continue
+            thread = threads.get(ident)
+            # Pool workers are named '<prefix>_<n>', so fold them into one root per pool
+            thread_name = thread.name.rsplit('_', 1)[0] if thread else 'thread'
+            stack = self._stack(frame, thread_name)
+            self.wall[stack] += 1
+
+            cpu_seconds = _thread_cpu_seconds(thread.native_id) if thread and thread.native_id else None
+            if cpu_seconds is None:
+                if frame.f_code.co_name not in _WAITING_FUNCTIONS:
+                    self.cpu[stack] += 1
+            else:
+                used = cpu_seconds - self._cpu_seen.get(ident, cpu_seconds)
+                self._cpu_seen[ident] = cpu_seconds
+                if used > 0:
+                    # In samples of the profiler interval, so wall and CPU totals are comparable
+                    self.cpu[stack] += max(1, round(used / self.interval))
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self
+
+    def write(self, name, folder=PROFILE_FOLDER):
+        """
+        Write '<name>_<timestamp>.wall.folded' and '.cpu.folded' collapsed stack files.
+
+        Returns:
+            tuple: The wall and CPU profile paths.
+        """
+        os.makedirs(folder, exist_ok=True)
+        prefix = os.path.join(folder, f"{retailer_slug(name)}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}")
+        paths = []
+        for kind, stacks in (('wall', self.wall), ('cpu', self.cpu)):
+            path = f"{prefix}.{kind}.folded"
+            write_folded(stacks, path)
+            paths.append(path)
+        logging.info(f"Profile of {self.samples} samples written to {paths[0]} and {paths[1]}.", extra=CONSOLE)
+        return tuple(paths)
+
+
+@contextmanager
+def profiled(name, enabled=True, interval=SAMPLE_INTERVAL, folder=PROFILE_FOLDER):
+    """
+    Profile the enclosed block when enabled, e.g. behind a scraper's --profile option.
+
+    Usage:
+        with profiled('Checkers', enabled=args.profile):
+            main()
+    """
+    if not enabled:
+        yield None
+        return
+    profiler = SamplingProfiler(interval).start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop().write(name, folder)
+
+
+def peak_rss_bytes():
+    """Return the process's peak resident set size, or None where the platform does not report it."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+@contextmanager
+def memory_report(name, enabled=True, top=MEMORY_REPORT_TOP, folder=PROFILE_FOLDER):
+    """
+    Trace allocations in the enclosed block with tracemalloc and report the top allocation sites.
+
+    The report, '<name>_<timestamp>.memory.txt', gives peak traced memory, peak RSS and the source
+    lines holding the most memory at the end of the block. Tracing roughly doubles allocation
+    cost, so it sits behind the scrapers' --memory-report option.
+    """
+    if not enabled:
+        yield
+        return
+    tracemalloc.start()
+    try:
+        yield
+    finally:
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        ])
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        rss = peak_rss_bytes()
+        lines = [f"{name} memory report",
+                 f"Traced: {current / 1e6:.1f} MB at exit, {peak / 1e6:.1f} MB peak",
+                 f"Peak RSS: {rss / 1e6:.1f} MB" if rss else "Peak RSS: unavailable",
+                 "",
+                 f"Top {top} allocation sites still held at exit:"]
+        for stat in snapshot.statistics('lineno')[:top]:
+            frame = stat.traceback[0]
+            lines.append(f"{stat.size / 1e6:>9.2f} MB {stat.count:>9} blocks  {frame.filename}:{frame.lineno}")
+
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{retailer_slug(name)}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.memory.txt")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        logging.info(f"{name} peak traced memory {peak / 1e6:.1f} MB. Memory report written to {path}.", extra=CONSOLE)
+
+
+def write_folded(stacks, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, count in sorted(stacks.items()):
+            f.write(f"{stack} {count}\n")
+
+
+def read_folded(path):
+    stacks = Counter()
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack:
+                stacks[stack] += int(count)
+    return stacks
+
+
+def function_shares(stacks):
+    """
+    Return each function's inclusive share of the samples.
+
+    A function counts once per stack, however often it recurses, so shares are comparable
+    between profiles with different sample totals.
+    """
+    total = sum(stacks.values()) or 1
+    shares = Counter()
+    for stack, count in stacks.items():
+        for label in set(stack.split(';')[1:]):
+            shares[label] += count
+    return {label: count / total for label, count in shares.items()}
+
+
+def diff_profiles(before_path, after_path, top=20):
+    """
+    Compare two profiles of the same kind by each function's inclusive share of samples.
+
+    Returns:
+        list: (function, share before, share after) for the functions whose share changed most.
+    """
+    before = function_shares(read_folded(before_path))
+    after = function_shares(read_folded(after_path))
+    changes = [(label, before.get(label, 0.0), after.get(label, 0.0)) for label in set(before) | set(after)]
+    changes.sort(key=lambda change: abs(change[2] - change[1]), reverse=True)
+    return changes[:top]
+
+
+def write_diff_folded(before_path, after_path, path):
+    """Write 'stack before after' lines for flamegraph's difffolded.pl, scaled to the same total."""
+    before, after = read_folded(before_path), read_folded(after_path)
+    scale = sum(after.values()) / (sum(before.values()) or 1)
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack in sorted(set(before) | set(after)):
+            f.write(f"{stack} {round(before.get(stack, 0) * scale)} {after.get(stack, 0)}\n")
+
+
+def run_script(script, script_args, name=None, interval=SAMPLE_INTERVAL, folder=PROFILE_FOLDER):
+    """Run a Python script as __main__ under the profiler, e.g. an offline benchmark."""
+    sys.argv = [script] + list(script_args)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    with profiled(name or os.path.splitext(os.path.basename(script))[0], interval=interval, folder=folder):
+        runpy.run_path(script, run_name='__main__')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sampling profiles of scraper runs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run a script under the profiler")
+    run_parser.add_argument("--interval", type=float, default=SAMPLE_INTERVAL, help="Seconds between samples (default: 0.005)")
+    run_parser.add_argument("--name", type=str, help="Profile file name (default: the script name)")
+    run_parser.add_argument("script", type=str, help="e.g. bench_supabase.py")
+    run_parser.add_argument("args", nargs=argparse.REMAINDER, help="Arguments passed to the script")
+
+    diff_parser = commands.add_parser("diff", help="Compare two .folded profiles of the same kind")
+    diff_parser.add_argument("before", type=str)
+    diff_parser.add_argument("after", type=str)
+    diff_parser.add_argument("--top", type=int, default=20, help="Functions to show (default: 20)")
+    diff_parser.add_argument("--output", type=str, help="Also write a differential .folded file for difffolded.pl")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        setup_logging('profiling')
+        run_script(args.script, args.args, args.name, args.interval)
+    else:
+        print(f"{'before':>8} {'after':>8} {'change':>8}  function")
+        for label, before_share, after_share in diff_profiles(args.before, args.after, args.top):
+            print(f"{before_share:>8.1%} {after_share:>8.1%} {after_share - before_share:>+8.1%}  {label}")
+        if args.output:
+            write_diff_folded(args.before, args.after, args.output)
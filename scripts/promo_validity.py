@@ -0,0 +1,278 @@
+import argparse
+import calendar
+import logging
+import os
+import re
+from datetime import date, datetime, timedelta
+
+from lazy_imports import lazy_import
+from price_engine import annotate_prices
+from supabase_sync import delta_upsert, row_keys, rows_to_publish
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+SUPABASE_URL = "<supabase_url>"
+SUPABASE_KEY = "<supabase_key>"
+
+PRODUCTS_FILE = "products.csv"
+EXPIRY_INDEX_FILE = "promo_expiry.csv"
+
+# Columns added by annotate_validity, as ISO dates
+VALIDITY_COLUMNS = ['promotion_start', 'promotion_end']
+EXPIRY_INDEX_COLUMNS = ['product_key', 'retailer', 'name', 'promotion_start', 'promotion_end']
+
+_MONTHS = {name[:3].lower(): number for number, name in enumerate(calendar.month_name) if name}
+# '12 March 2025', '3 Mar', '03 Sept. 2025'
+_DATE = r'(\d{1,2})\s+([A-Za-z]{3,9})\.?(?:,?\s+(\d{4}))?'
+# The start of a range may leave out the month and year it shares with the end: '3 - 16 Mar 2025'
+_START_DATE = r'\b(\d{1,2})(?:\s+([A-Za-z]{3,9})\.?(?:,?\s+(\d{4}))?)?'
+# Woolworths: 'Offer valid 3 Mar - 16 Mar 2025' or 'Offer valid 3 - 16 Mar 2025';
+# Checkers: 'Valid from 3 March to 16 March 2025'
+_RANGE_PATTERN = re.compile(rf'{_START_DATE}\s*(?:-|–|to|until|till)\s*{_DATE}', re.IGNORECASE)
+# Checkers and PnP: 'Valid until 16 March 2025'
+_END_PATTERN = re.compile(rf'(?:until|till|to|ends?|expires?)\s+{_DATE}', re.IGNORECASE)
+_ISO_PATTERN = re.compile(r'(\d{4})-(\d{2})-(\d{2})')
+
+
+def _make_date(day, month, year):
+    month = _MONTHS.get(month[:3].lower())
+    if not month:
+        return None
+    try:
+        return date(int(year), month, int(day))
+    except ValueError:
+        return None
+
+
+def _nearest_year(day, month, reference):
+    """Pick the year that puts a day and month closest to the reference date."""
+    candidates = [_make_date(day, month, reference.year + offset) for offset in (-1, 0, 1)]
+    candidates = [candidate for candidate in candidates if candidate]
+    return min(candidates, key=lambda candidate: abs(candidate - reference)).year if candidates else reference.year
+
+
+def parse_validity(text, reference=None):
+    """
+    Parse a promotion validity text into its start and end dates.
+
+    Handles the Checkers 'item-product__valid' span, the PnP 'Valid until 16 March 2025' text
+    and the Woolworths 'Offer valid 3 Mar - 16 Mar 2025' sentence. A date without a year takes
+    the year of the range's end date or, failing that, the year nearest the reference date, and
+    a range start without a month ('3 - 16 Mar 2025') takes the end date's month.
+
+    Args:
+        text (str): The 'promotion_valid' text.
+        reference (date): The day the text was scraped (default: today).
+
+    Returns:
+        tuple: (start, end) dates, either of which may be None.
+    """
+    if not isinstance(text, str) or not text.strip():
+        return None, None
+    reference = reference or date.today()
+    text = text.replace('\xa0', ' ')
+
+    match = _RANGE_PATTERN.search(text)
+    if match:
+        start_day, start_month, start_year, end_day, end_month, end_year = match.groups()
+        end_year = end_year or _nearest_year(end_day, end_month, reference)
+        end = _make_date(end_day, end_month, end_year)
+        if not start_month:
+            start = _make_date(start_day, end_month, end_year)
+            if start and end and start > end:
+                start = None
+        elif start_year:
+            start = _make_date(start_day, start_month, start_year)
+        else:
+            start = _make_date(start_day, start_month, end_year)
+            # 'Offer valid 28 Dec - 10 Jan 2026' starts in the previous year
+            if start and end and start > end:
+                start = _make_date(start_day, start_month, int(end_year) - 1)
+        if end:
+            return start, end
+
+    match = _END_PATTERN.search(text)
+    if match:
+        end_day, end_month, end_year = match.groups()
+        return None, _make_date(end_day, end_month, end_year or _nearest_year(end_day, end_month, reference))
+
+    match = _ISO_PATTERN.search(text)
+    if match:
+        try:
+            return None, date(*(int(part) for part in match.groups()))
+        except ValueError:
+            pass
+    return None, None
+
+
+def annotate_validity(df, reference=None):
+    """
+    Add ISO 'promotion_start' and 'promotion_end' columns parsed from 'promotion_valid'.
+
+    Args:
+        df (pd.DataFrame): Products with a 'promotion_valid' column.
+        reference (date): The day the products were scraped (default: today).
+
+    Returns:
+        pd.DataFrame: The same DataFrame with VALIDITY_COLUMNS added or refreshed.
+    """
+    if 'promotion_valid' not in df.columns or df.empty:
+        for column in VALIDITY_COLUMNS:
+            df[column] = pd.Series(pd.NA, index=df.index, dtype='string')
+        return df
+
+    # A catalogue only holds a handful of distinct validity texts, so parse each once
+    codes, uniques = pd.factorize(df['promotion_valid'].astype('string').fillna(''))
+    parsed = [parse_validity(text, reference) for text in uniques]
+    for position, column in enumerate(VALIDITY_COLUMNS):
+        values = pd.array([dates[position].isoformat() if dates[position] else pd.NA for dates in parsed] + [pd.NA],
+                          dtype='string')
+        # pd.factorize marks missing values with -1, which picks the trailing <NA>
+        df[column] = pd.Series(values.take(codes), index=df.index)
+    return df
+
+
+class ExpiryIndex:
+    """
+    Promotions ordered by end date.
+
+    Every lookup is a binary search on the sorted 'promotion_end' column, so expired promotions
+    and "what ends this week" are range scans rather than a pass over the whole catalogue.
+    """
+
+    def __init__(self, entries=None):
+        entries = entries if entries is not None else pd.DataFrame(columns=EXPIRY_INDEX_COLUMNS)
+        self.entries = entries.sort_values('promotion_end', kind='stable').reset_index(drop=True)
+        self._ends = self.entries['promotion_end'].to_numpy(dtype=str)
+
+    @classmethod
+    def from_products(cls, df):
+        """Build the index from a catalogue, annotating validity dates if they are missing."""
+        if 'promotion_end' not in df.columns:
+            df = annotate_validity(df.copy())
+        df = df[df['promotion_end'].notna() & df['name'].notna()]
+        entries = pd.DataFrame({
+            'product_key': row_keys(df),
+            'retailer': df['retailer'].to_numpy(),
+            'name': df['name'].to_numpy(),
+            'promotion_start': df['promotion_start'].to_numpy(),
+            'promotion_end': df['promotion_end'].astype(str).to_numpy(),
+        })
+        return cls(entries)
+
+    def _range(self, start, end):
+        lo = 0 if start is None else np.searchsorted(self._ends, start.isoformat(), side='left')
+        hi = len(self._ends) if end is None else np.searchsorted(self._ends, end.isoformat(), side='right')
+        return self.entries.iloc[lo:hi]
+
+    def ending_between(self, start, end):
+        """Return the promotions whose last valid day falls between two dates (inclusive)."""
+        return self._range(start, end)
+
+    def expired(self, today=None):
+        """Return the promotions whose last valid day is before today."""
+        return self._range(None, (today or date.today()) - timedelta(days=1))
+
+    def drop(self, product_keys):
+        return ExpiryIndex(self.entries[~self.entries['product_key'].isin(product_keys)])
+
+    def save(self, index_file=EXPIRY_INDEX_FILE):
+        tmp_path = f"{index_file}.tmp"
+        self.entries.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, index_file)
+
+
+def load_expiry_index(index_file=EXPIRY_INDEX_FILE):
+    if not os.path.exists(index_file):
+        return ExpiryIndex()
+    return ExpiryIndex(pd.read_csv(index_file, dtype=str, keep_default_na=False).replace('', pd.NA))
+
+
+def update_expiry_index(products_file=PRODUCTS_FILE, index_file=EXPIRY_INDEX_FILE):
+    """
+    Rebuild the expiry index from the combined catalogue.
+
+    Returns:
+        ExpiryIndex: The rebuilt index.
+    """
+    index = ExpiryIndex.from_products(pd.read_csv(products_file))
+    index.save(index_file)
+    logging.info(f"Expiry index: {len(index.entries)} promotions with an end date.")
+    return index
+
+
+def expire_promotions(products_file=PRODUCTS_FILE, index_file=EXPIRY_INDEX_FILE, today=None, publish=True):
+    """
+    Clear promotions that ended before today without re-scraping.
+
+    Expired rows in the combined catalogue get 'No promo' and an empty validity. With publish,
+    each affected retailer's catalogue goes through delta_upsert, so only the cleared rows are sent.
+
+    Args:
+        products_file (str): The combined catalogue written by daily_scrape.py.
+        index_file (str): The expiry index.
+        today (date): The first day on which the expired promotions are no longer valid (default: today).
+        publish (bool): Upsert the cleared rows to Supabase.
+
+    Returns:
+        int: The number of promotions cleared.
+    """
+    today = today or date.today()
+    index = load_expiry_index(index_file) if os.path.exists(index_file) else update_expiry_index(products_file, index_file)
+    expired = index.expired(today)
+    if expired.empty:
+        logging.info("No expired promotions.")
+        return 0
+
+    df = pd.read_csv(products_file)
+    if 'promotion_end' not in df.columns:
+        df = annotate_validity(df, reference=today)
+    keys = pd.Series(row_keys(df), index=df.index)
+    # A name can appear more than once per retailer, so check each row's own end date too
+    cleared = keys.isin(set(expired['product_key'])) & (df['promotion_end'].astype('string') < today.isoformat()).fillna(False)
+    df['promotion_price'] = df['promotion_price'].astype(object)
+    df['promotion_valid'] = df['promotion_valid'].astype(object)
+    df.loc[cleared, 'promotion_price'] = 'No promo'
+    df.loc[cleared, 'promotion_valid'] = ' '
+    df = annotate_prices(annotate_validity(df, reference=today))
+
+    tmp_path = f"{products_file}.tmp"
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, products_file)
+    index.drop(set(expired['product_key'])).save(index_file)
+    logging.info(f"Cleared {int(cleared.sum())} expired promotions from {products_file}.")
+
+    if publish:
+        from supabase import create_client
+        for retailer in df.loc[cleared, 'retailer'].unique():
+            # Read back as the scrapers publish it, so missing values are ' ' rather than NaN
+            delta_upsert(lambda: create_client(SUPABASE_URL, SUPABASE_KEY), rows_to_publish(products_file, retailer), retailer)
+    return int(cleared.sum())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Promotion expiry index over the combined catalogue.")
+    parser.add_argument("--products", type=str, default=PRODUCTS_FILE, help="Combined catalogue (default: products.csv)")
+    parser.add_argument("--index", type=str, default=EXPIRY_INDEX_FILE, help="Index file (default: promo_expiry.csv)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("build", help="Rebuild the expiry index from --products")
+
+    expire_parser = commands.add_parser("expire", help="Clear promotions that have ended")
+    expire_parser.add_argument("--date", type=str, help="Treat this YYYY-MM-DD as today")
+    expire_parser.add_argument("--no-publish", action="store_true", help="Only update --products, not Supabase")
+
+    ending_parser = commands.add_parser("ending", help="List promotions ending soon")
+    ending_parser.add_argument("--days", type=int, default=7, help="Days ahead, including today (default: 7)")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        update_expiry_index(args.products, args.index)
+    elif args.command == "expire":
+        today = datetime.strptime(args.date, '%Y-%m-%d').date() if args.date else None
+        print(f"Cleared {expire_promotions(args.products, args.index, today, publish=not args.no_publish)} promotions.")
+    else:
+        index = load_expiry_index(args.index) if os.path.exists(args.index) else update_expiry_index(args.products, args.index)
+        ending = index.ending_between(date.today(), date.today() + timedelta(days=args.days - 1))
+        print(ending[['promotion_end', 'retailer', 'name']].to_string(index=False) if not ending.empty else "No promotions ending.")
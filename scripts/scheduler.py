@@ -0,0 +1,397 @@
+import argparse
+import json
+import logging
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from log_setup import CONSOLE, console_handler
+from supabase_sync import retailer_slug
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+# Under the Windows service sys.executable is pythonservice.exe, which can't run scripts
+PYTHON = os.path.join(sys.exec_prefix, 'python.exe') if 'pythonservice' in os.path.basename(sys.executable).lower() \
+    else sys.executable
+STATE_FILE = "scheduler_state.json"
+LOCK_FILE = "scheduler.lock"
+LOG_FILE = "scheduler.log"
+
+# Cron schedule (minute hour day-of-month month day-of-week, in UTC) and catch-up window per retailer.
+# Retailers due at the same time are scraped by one daily_scrape.py run.
+SCHEDULES = {
+    'Checkers': {'cron': '0 6 * * *', 'catch_up_hours': 6},
+    'Shoprite': {'cron': '0 6 * * *', 'catch_up_hours': 6},
+    # Pick n Pay may only be crawled 04:00-08:45 UTC, so a later catch-up would find the window closed
+    'Pick n Pay': {'cron': '0 6 * * *', 'catch_up_hours': 2},
+    'Woolworths': {'cron': '0 6 * * *', 'catch_up_hours': 6},
+}
+# Each run starts up to this many seconds after its scheduled time, so requests don't land on the same second every day
+JITTER_SECONDS = 600
+# The longest sleep between checks; keeps the scheduler responsive to stop requests and clock changes
+MAX_SLEEP_SECONDS = 60
+
+_CRON_FIELDS = (('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 7))
+# Stop looking for a matching minute this far from the starting point, e.g. for '0 0 30 2 *'
+_CRON_SEARCH_DAYS = 366 * 5
+
+
+class InstanceLocked(RuntimeError):
+    """Another process holds the lock file."""
+
+
+@contextmanager
+def instance_lock(path):
+    """
+    Hold an exclusive lock on a file for the enclosed block, so only one process runs it at a time.
+
+    The lock is released by the operating system if the process dies, so a stale lock file
+    never blocks the next run.
+
+    Raises:
+        InstanceLocked: Another process holds the lock.
+    """
+    f = open(path, 'a+')
+    try:
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            raise InstanceLocked(f"{path} is held by process {_lock_holder(f)}.") from None
+        f.seek(0)
+        f.truncate()
+        f.write(str(os.getpid()))
+        f.flush()
+        yield
+    finally:
+        f.close()
+
+
+def _lock_holder(f):
+    try:
+        f.seek(0)
+        return f.read().strip() or 'unknown'
+    except OSError:  # Windows refuses reads of a locked region
+        return 'unknown'
+
+
+def _parse_cron_field(text, low, high):
+    values = set()
+    for part in text.split(','):
+        spec, _, step = part.partition('/')
+        if spec == '*':
+            start, end = low, high
+        elif '-' in spec:
+            start, end = (int(value) for value in spec.split('-'))
+        else:
+            start = end = int(spec)
+            if step:
+                end = high
+        if not low <= start <= end <= high:
+            raise ValueError(f"'{part}' is outside {low}-{high}")
+        values.update(range(start, end + 1, int(step) if step else 1))
+    return values
+
+
+class CronSchedule:
+    """
+    A five-field cron expression: minute, hour, day of month, month and day of week (0 or 7 is Sunday).
+
+    Fields take '*', numbers, ranges, lists and steps, e.g. '*/15 4-8 * * 1-5'. As in cron, a day
+    matches if either the day of month or the day of week matches when both are restricted.
+    """
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression '{expression}' needs 5 fields, got {len(fields)}.")
+        self.expression = expression
+        try:
+            parsed = [_parse_cron_field(text, low, high) for text, (_, low, high) in zip(fields, _CRON_FIELDS)]
+        except ValueError as e:
+            raise ValueError(f"Invalid cron expression '{expression}': {e}") from None
+        self.minutes, self.hours, self.days, self.months, weekdays = (sorted(values) for values in parsed)
+        self.weekdays = {day % 7 for day in weekdays}
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def _day_matches(self, day):
+        if day.month not in self.months:
+            return False
+        day_match = day.day in self.days
+        # isoweekday() is 1 (Monday) to 7 (Sunday); cron counts from 0 (Sunday)
+        weekday_match = day.isoweekday() % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day_match and weekday_match
+        return day_match or weekday_match
+
+    def next_after(self, moment):
+        """Return the first scheduled minute strictly after a datetime."""
+        start = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.replace(hour=0, minute=0)
+        for _ in range(_CRON_SEARCH_DAYS):
+            if self._day_matches(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        candidate = day.replace(hour=hour, minute=minute)
+                        if candidate >= start:
+                            return candidate
+            day += timedelta(days=1)
+        raise ValueError(f"Cron expression '{self.expression}' never matches.")
+
+    def latest_at_or_before(self, moment):
+        """Return the last scheduled minute at or before a datetime."""
+        end = moment.replace(second=0, microsecond=0)
+        day = end.replace(hour=0, minute=0)
+        for _ in range(_CRON_SEARCH_DAYS):
+            if self._day_matches(day):
+                for hour in reversed(self.hours):
+                    for minute in reversed(self.minutes):
+                        candidate = day.replace(hour=hour, minute=minute)
+                        if candidate <= end:
+                            return candidate
+            day -= timedelta(days=1)
+        raise ValueError(f"Cron expression '{self.expression}' never matches.")
+
+
+def jitter(slot, seconds=JITTER_SECONDS):
+    """Return the start delay of a scheduled slot. It is the same for every retailer due in that slot."""
+    return timedelta(seconds=random.Random(slot.isoformat()).uniform(0, seconds))
+
+
+class Scheduler:
+    """
+    Runs daily_scrape.py for each retailer as often as its cron schedule says, and no more.
+
+    State, i.e. the last slot handled and the outcome of the last run per retailer, is kept in
+    STATE_FILE so restarts neither repeat nor lose runs. Slots missed while the scheduler was
+    down or a previous run was still going are made up once if the latest of them is within the
+    retailer's catch-up window, and skipped otherwise. Runs never overlap.
+    """
+
+    def __init__(self, schedules=SCHEDULES, state_file=STATE_FILE, jitter_seconds=JITTER_SECONDS,
+                 command=None, workdir=SCRIPTS_DIR):
+        self.schedules = {retailer: CronSchedule(entry['cron']) for retailer, entry in schedules.items()}
+        self.catch_up = {retailer: timedelta(hours=entry['catch_up_hours']) for retailer, entry in schedules.items()}
+        self.state_file = os.path.join(workdir, state_file)
+        self.jitter_seconds = jitter_seconds
+        self.command = command or [PYTHON, "daily_scrape.py"]
+        self.workdir = workdir
+        self.state = self._load_state()
+        self.process = None
+        self._stop = threading.Event()
+
+    def _load_state(self):
+        if not os.path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not read scheduler state {self.state_file}: {e}. Starting fresh.")
+            return {}
+
+    def _save_state(self):
+        tmp_path = f"{self.state_file}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.state_file)
+
+    def _last_slot(self, retailer, now):
+        entry = self.state.get(retailer)
+        if entry is None:
+            # Nothing was missed before the first start; the first run is the next scheduled one
+            slot = self.schedules[retailer].latest_at_or_before(now)
+            self.state[retailer] = {'last_slot': slot.isoformat()}
+            return slot
+        return datetime.fromisoformat(entry['last_slot'])
+
+    def due(self, now):
+        """
+        Return the slots due now per retailer, marking slots missed beyond the catch-up window as skipped.
+
+        Returns:
+            dict: Maps each due retailer to the slot it runs for.
+        """
+        due = {}
+        changed = False
+        for retailer, schedule in self.schedules.items():
+            changed |= retailer not in self.state
+            slot = schedule.latest_at_or_before(now)
+            if slot <= self._last_slot(retailer, now) or now < slot + jitter(slot, self.jitter_seconds):
+                continue
+            if now - slot > self.catch_up[retailer]:
+                logging.warning(f"Skipping the {retailer} run scheduled for {slot:%Y-%m-%d %H:%M} UTC: "
+                                f"missed by more than {self.catch_up[retailer]}.")
+                self.state[retailer].update(last_slot=slot.isoformat(), last_status='skipped')
+                changed = True
+                continue
+            due[retailer] = slot
+        if changed:
+            self._save_state()
+        return due
+
+    def next_run(self, now):
+        """Return the time the next run can start, including its jitter."""
+        starts = []
+        for retailer, schedule in self.schedules.items():
+            slot = schedule.latest_at_or_before(now)
+            if slot <= self._last_slot(retailer, now):
+                slot = schedule.next_after(now)
+            starts.append(slot + jitter(slot, self.jitter_seconds))
+        return min(starts)
+
+    def run_due(self, due):
+        """Scrape the due retailers in one daily_scrape.py run and record the outcome."""
+        command = self.command + ["--retailers"] + [retailer_slug(retailer) for retailer in due]
+        started = datetime.now(timezone.utc)
+        logging.info(f"Starting scheduled run for {', '.join(due)}: {' '.join(command)}", extra=CONSOLE)
+        try:
+            # In its own process group, so stop() reaches the scrapers daily_scrape.py starts too
+            group = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP} if os.name == 'nt' else {'start_new_session': True}
+            self.process = subprocess.Popen(command, cwd=self.workdir, **group)
+            status = self.process.wait()
+        except OSError as e:
+            logging.error(f"Failed to start {command}: {e}")
+            status = None
+        finally:
+            self.process = None
+        finished = datetime.now(timezone.utc)
+
+        for retailer, slot in due.items():
+            self.state[retailer].update(last_slot=slot.isoformat(), last_started=started.isoformat(timespec='seconds'),
+                                        last_finished=finished.isoformat(timespec='seconds'), last_status=status)
+        self._save_state()
+        level = logging.INFO if status == 0 else logging.ERROR
+        logging.log(level, f"Scheduled run for {', '.join(due)} ended with status {status} after {finished - started}.")
+
+    def run(self):
+        """Run scheduled scrapes until stop() is called."""
+        logging.info("Scheduler started: " + ", ".join(f"{retailer} '{schedule.expression}'"
+                                                         for retailer, schedule in self.schedules.items()))
+        while not self._stop.is_set():
+            now = datetime.now(timezone.utc)
+            due = self.due(now)
+            if due:
+                self.run_due(due)
+                continue
+            wait = (self.next_run(now) - now).total_seconds()
+            self._stop.wait(min(max(wait, 1), MAX_SLEEP_SECONDS))
+        logging.info("Scheduler stopped.")
+
+    def stop(self):
+        """
+        Stop the scheduler, terminating a scrape in progress together with the scrapers it started.
+        Its crawls can continue with --resume.
+        """
+        self._stop.set()
+        process = self.process
+        if process is not None and process.poll() is None:
+            terminate_group(process)
+
+    def status(self, now=None):
+        """Return the last outcome and next scheduled run of every retailer."""
+        now = now or datetime.now(timezone.utc)
+        rows = []
+        for retailer, schedule in self.schedules.items():
+            entry = self.state.get(retailer, {})
+            slot = schedule.next_after(now)
+            rows.append({
+                'retailer': retailer,
+                'cron': schedule.expression,
+                'last_slot': entry.get('last_slot'),
+                'last_status': entry.get('last_status'),
+                'next_run': (slot + jitter(slot, self.jitter_seconds)).isoformat(timespec='seconds'),
+            })
+        return rows
+
+
+def terminate_group(process):
+    """Terminate a process started in its own process group, and every process in that group."""
+    try:
+        if os.name == 'nt':
+            # Without a console, e.g. under the service, CTRL_BREAK_EVENT can't be delivered
+            try:
+                process.send_signal(signal.CTRL_BREAK_EVENT)
+            except (OSError, ValueError):
+                subprocess.run(['taskkill', '/T', '/F', '/PID', str(process.pid)], capture_output=True)
+        else:
+            os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+
+
+def systemd_unit():
+    """Return a systemd service unit that runs the scheduler from this folder."""
+    return "\n".join([
+        "[Unit]",
+        "Description=Retailer scrape scheduler",
+        "After=network-online.target",
+        "Wants=network-online.target",
+        "",
+        "[Service]",
+        "Type=simple",
+        f"WorkingDirectory={SCRIPTS_DIR}",
+        f"ExecStart={sys.executable} {os.path.join(SCRIPTS_DIR, 'scheduler.py')} run",
+        "Restart=on-failure",
+        "RestartSec=60",
+        # Let a scrape in progress stop cleanly; its crawl continues with --resume
+        "KillMode=mixed",
+        "TimeoutStopSec=120",
+        "",
+        "[Install]",
+        "WantedBy=multi-user.target",
+        "",
+    ])
+
+
+def configure_logging():
+    """Log to LOG_FILE, and to stdout (the service's journal) the records log_setup.py sends to the console."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        handlers=[logging.FileHandler(os.path.join(SCRIPTS_DIR, LOG_FILE), encoding='utf-8'), console_handler()],
+    )
+
+
+def main():
+    configure_logging()
+    scheduler = Scheduler()
+    # systemd stops the service with SIGTERM
+    signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stop())
+    try:
+        with instance_lock(os.path.join(SCRIPTS_DIR, LOCK_FILE)):
+            try:
+                scheduler.run()
+            except KeyboardInterrupt:
+                scheduler.stop()
+    except InstanceLocked as e:
+        logging.error(f"Scheduler is already running: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the scrapers on their cron schedules.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("run", help="Run the scheduler in the foreground, e.g. under systemd")
+    commands.add_parser("status", help="Show the last and next run of every retailer")
+    commands.add_parser("systemd-unit", help="Print a systemd service unit for this folder")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        main()
+    elif args.command == "status":
+        for row in Scheduler().status():
+            print(f"{row['retailer']:<12} '{row['cron']}'  last slot {row['last_slot'] or '-'} "
+                  f"(status {row['last_status']}), next run {row['next_run']}")
+    else:
+        print(systemd_unit(), end="")
@@ -1,44 +1,49 @@
-from bs4 import BeautifulSoup
-import html
+import argparse
 import random
 import time
-import math
-import psutil
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from contextlib import nullcontext
 import os
 import re
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from supabase import create_client
-import pandas as pd
-import requests
-from datetime import datetime
+from lazy_imports import lazy_import
 import unicodedata
 import mimetypes
-import json
-import logging
+from supabase_sync import delta_upsert, rows_to_publish
+from price_engine import PROMO_NONE, annotate_prices, parse_price_cents
+from promo_validity import annotate_validity
+from product_ids import ensure_product_ids, product_id
+from page_fingerprints import PageFingerprintStore
+from page_parsing import parse_listing, parse_pool, parse_promotions
+from crawl_checkpoint import CrawlCheckpoint
+from data_quality import quality_gate
+from metrics import metrics
+from profiling import memory_report, profiled
+from adaptive_concurrency import controller
+from log_setup import CONSOLE, Progress, retailer_logger, setup_logging, stop_logging
+
+pd = lazy_import('pandas')
 
 # Constants
 SUPABASE_URL = "<supabase_url>"
 SUPABASE_KEY = "<supabase_key>"
+# Mark products that disappeared since the previous run as inactive in Supabase
+SOFT_DELETE_MISSING = False
+# Reuse the previous run's records for listing pages whose products and prices are unchanged
+INCREMENTAL_CRAWL = True
+# The product listing and its last page number
+BASE_URL = "https://products.checkers.co.za/c-2413/All-Departments/Food?q=%3Arelevance"
+LAST_PAGE = 375
+# Pages submitted to the thread pool ahead of the workers, per thread; caps memory held by queued work
+PENDING_PAGES_PER_THREAD = 2
+# Image bodies are written to disk in chunks of this many bytes rather than held whole
+IMAGE_CHUNK_BYTES = 64 * 1024
 LOCAL_FOLDER_PATH = os.path.join('.', 'checkers_images')
 BUCKET_NAME = 'product_images'
 REMOTE_FOLDER_PATH = 'checkers/'
 PLACEHOLDER_IMAGE_URL = 'https://sfnavipqilqgzmtedfuh.supabase.co/storage/v1/object/public/product_images/checkers/checkers_image_placeholder.png'
 
-# Setup logging directory
-log_dir = "logs"
-os.makedirs(log_dir, exist_ok=True)
-
-# Generate log filename with timestamp
-log_filename = os.path.join(log_dir, f"checkers_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.log")
-
-# Configure logging
-logging.basicConfig(
-    filename=log_filename,
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S"
-)
+# Configured by setup_logging() when run as a script
+log = retailer_logger('Checkers')
 
 def get_random_user_agent():
     user_agents = [
@@ -64,44 +69,44 @@ def download_image(url, save_path):
         headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36"
         }
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
+        with controller.request('GET', url, headers=headers, stream=True) as response:
+            response.raise_for_status()
+
+            content_type = response.headers.get("Content-Type", "")
+            extension = mimetypes.guess_extension(content_type)
+            is_svg = content_type == "image/svg+xml" or extension == ".svg"
+            svg_path = save_path.replace(".jpg", ".svg")
 
-        content_type = response.headers.get("Content-Type", "")
-        extension = mimetypes.guess_extension(content_type)
+            # Stream the body to disk so only one chunk is held at a time
+            with open(svg_path if is_svg else save_path, "wb") as file:
+                for chunk in response.iter_content(chunk_size=IMAGE_CHUNK_BYTES):
+                    file.write(chunk)
+                    metrics.add_bytes('image_download', 'Checkers', len(chunk))
 
-        if content_type == "image/svg+xml" or extension == ".svg":
+        if is_svg:
             # Handle SVG
-            print(f"Detected SVG content: {url}")
-            svg_path = save_path.replace(".jpg", ".svg")
+            log.info(f"Detected SVG content: {url}")
             png_path = save_path.replace(".jpg", ".png")
 
-            # Save original SVG
-            with open(svg_path, "wb") as file:
-                file.write(response.content)
-
             # Convert SVG to PNG using urllib and Pillow
             try:
                 import svglib.svglib
                 from reportlab.graphics import renderPM
                 svg_drawing = svglib.svglib.svg2rlg(svg_path)
                 renderPM.drawToFile(svg_drawing, png_path, fmt='PNG')
-                print(f"Converted SVG to PNG: {png_path}")
+                log.info(f"Converted SVG to PNG: {png_path}")
             except ImportError:
-                print("svglib or reportlab not installed. Skipping SVG to PNG conversion.")
+                log.warning("svglib or reportlab not installed. Skipping SVG to PNG conversion.")
 
-            return True
-        else:
-            # Save as regular image (JPEG, PNG, etc.)
-            with open(save_path, "wb") as file:
-                file.write(response.content)
-            return True
+        # Regular images (JPEG, PNG, etc.) are saved as they are
+        return True
 
     except Exception as e:
-        print(f"Failed to download or process {url}: {e}")
+        log.warning(f"Failed to download or process {url}: {e}")
         return False
 
 def verify_file_in_supabase(bucket_name, remote_path):
+    from supabase import create_client
     supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
     try:
         files = supabase.storage.from_(bucket_name).list(
@@ -113,10 +118,11 @@ def verify_file_in_supabase(bucket_name, remote_path):
                 return True
         return False
     except Exception as e:
-        print(f"Verification error for {remote_path}: {e}")
+        log.warning(f"Verification error for {remote_path}: {e}")
         return False
 
 def upload_file_to_supabase(local_path, bucket_name, remote_path, retries=5, backoff_factor=2):
+    from supabase import create_client
     supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
     attempt = 0
 
@@ -125,101 +131,48 @@ def upload_file_to_supabase(local_path, bucket_name, remote_path, retries=5, bac
             with open(local_path, 'rb') as f:
                 # First check if file is in supabase
                 if verify_file_in_supabase(bucket_name, remote_path):
-                    print(f"File {remote_path} already exists, skipping upload ...")
+                    log.info(f"File {remote_path} already exists, skipping upload ...")
                     return supabase.storage.from_(bucket_name).get_public_url(remote_path)
                 else:
                     response = supabase.storage.from_(bucket_name).upload(remote_path, f)
-                    print(f"Supabase upload response: {response}")
+                    log.info(f"Supabase upload response: {response}")
 
             if verify_file_in_supabase(bucket_name, remote_path):
-                print(f"Upload and verification successful for {remote_path}")
+                log.info(f"Upload and verification successful for {remote_path}")
                 return supabase.storage.from_(bucket_name).get_public_url(remote_path)
             else:
-                print(f"Verification failed for {remote_path}. Retrying...")
+                log.warning(f"Verification failed for {remote_path}. Retrying...")
 
         except Exception as e:
             try:
                 # Attempt to parse the error message as a dictionary
                 error_content = eval(str(e))
                 if isinstance(error_content, dict) and error_content.get('message') == 'The resource already exists':
-                    print(f"Resource already exists. Using existing URL for {remote_path}")
+                    log.info(f"Resource already exists. Using existing URL for {remote_path}")
                     return supabase.storage.from_(bucket_name).get_public_url(remote_path)
             except (SyntaxError, ValueError):
                 # Handle cases where the error content is not a valid dictionary
                 pass
-                print(f"Upload error: {e}")
+                log.warning(f"Upload error: {e}")
 
         attempt += 1
         if attempt < retries:
             sleep_time = backoff_factor ** attempt
-            print(f"Retrying upload in {sleep_time} seconds...")
+            log.info(f"Retrying upload in {sleep_time} seconds...")
             time.sleep(sleep_time)
 
-    print(f"Failed to upload {local_path} after {retries} attempts.")
+    log.error(f"Failed to upload {local_path} after {retries} attempts.")
     return None
 
-def get_last_index(csv_file):
-    try:
-        df = pd.read_csv(csv_file)
-        if 'index' in df.columns and not df['index'].isnull().all():
-            last_index = df['index'].max()
-            return int(last_index) + 1 if pd.notna(last_index) else 0
-        else:
-            return 0
-    except FileNotFoundError:
-        return 0
-
-def get_last_index_from_scraped_data(scraped_data):
-    """
-    Get the last index from scraped data, which is a list of dictionaries.
-
-    Args:
-        scraped_data (list): List of dictionaries containing product data.
-
-    Returns:
-        int: The next index to use based on the last index in the scraped data.
-    """
-    if not scraped_data:
-        return 0  # If the list is empty, start from 0
-
-    # Extract the 'index' values and find the maximum
-    indices = [item.get('index', -1) for item in scraped_data]
-    max_index = max(indices, default=-1)  # Use -1 as the default for empty lists or missing 'index'
-    return max_index + 1
-
 def get_price(price_old, price_current):
-    def extract_numeric_price(price_str):
-        # If price is None or empty, return None
-        if not price_str:
-            return None
-
-        # Try to convert to float while preserving prefix/suffix
-        try:
-            # Find the first set of numeric characters (including decimal)
-            numeric_part = ''.join(char for char in price_str if char.isdigit() or char == '.')
-            float_value = float(numeric_part)
-
-            # Preserve the original string if a valid float is found
-            return {
-                'value': float_value,
-                'original': price_str
-            }
-        except ValueError:
-            return None
-
-    # Process both prices
-    processed_old = extract_numeric_price(price_old)
-    processed_current = extract_numeric_price(price_current)
-
-    # Prioritize old price, then current price
-    if processed_old is not None:
-        return processed_old['original']
-    elif processed_current is not None:
-        return processed_current['original']
-    else:
-        return "no price available"
-
-def scrape_page(base_url, page, existing_data, current_index, save_filename='products_checkers.csv', max_retries=3):
+    # Prioritize old price, then current price, keeping the display string of the first that parses
+    for price in (price_old, price_current):
+        if parse_price_cents(price) is not None:
+            return price
+    return "no price available"
+
+def scrape_page(base_url, page, existing_data, save_filename='products_checkers.csv', max_retries=3, fingerprints=None, checkpoint=None,
+                raise_errors=False):
     """
     Scrape a specific page and retry if an error occurs.
 
@@ -227,40 +180,51 @@ def scrape_page(base_url, page, existing_data, current_index, save_filename='pro
         base_url (str): The base URL for scraping.
         page (int): The page number to scrape.
         existing_data (dict): Existing data to check for duplicates.
-        current_index (int): The current index for products.
         save_filename (str): The file to save scraped data.
         max_retries (int): Maximum number of retry attempts.
+        fingerprints (PageFingerprintStore): Skip pages that are unchanged since the previous run.
+        checkpoint (CrawlCheckpoint): Record the page as complete once its rows are saved.
+        raise_errors (bool): Raise the last error once the retries are used up, instead of returning no products.
 
     Returns:
-        tuple: (scraped data as a list, updated current index)
+        list: The scraped products.
     """
     retries = 0
     while retries <= max_retries:
         try:
             url = f"{base_url}&page={page}"
             headers = {"User-Agent": get_random_user_agent()}
-            response = requests.get(url, headers=headers)
+            with metrics.timer('fetch', 'Checkers'):
+                response = controller.request('GET', url, headers=headers)
+            metrics.add_bytes('fetch', 'Checkers', len(response.content))
             if response.status_code != 200:
-                logging.error(f"Failed request to {url} with status {response.status_code}.")
+                log.error(f"Failed request to {url} with status {response.status_code}.")
             response.raise_for_status()  # Raise an HTTPError for bad responses
 
-            soup = BeautifulSoup(response.text, "html.parser")
-
-            json_data = soup.select('.productListJSON')
-            json_data = json_data[0].text
-
-            products = soup.select('.item-product')  # CSS selector for product items
+            with metrics.timer('parse', 'Checkers'):
+                listing = parse_pool.run(parse_listing, response.text)
+            json_data, fingerprint, products = listing['json_data'], listing['fingerprint'], listing['products']
 
             scraped_data = []
-            logging.info(f"Scraping page {page} of Checkers")
-            print(f"Scraping page {page} of Checkers")
+            log.info(f"Scraping page {page} of Checkers")
+
+            if fingerprints is not None:
+                previous_data = fingerprints.unchanged(page, fingerprint)
+                if previous_data is not None:
+                    log.info(f"Page {page} of Checkers is unchanged. Reusing {len(previous_data)} products.")
+                    with checkpoint.page(page) if checkpoint is not None else nullcontext():
+                        with metrics.timer('csv_write', 'Checkers'):
+                            save_to_csv(previous_data, filename=save_filename)
+                    metrics.inc('scraper_pages_total', retailer='Checkers', status='unchanged')
+                    metrics.inc('scraper_products_total', len(previous_data), retailer='Checkers')
+                    return previous_data
+
             time.sleep(5)  # Adjust delay if necessary
 
             for item in products:
-                current_index += 1
-                product_name = item.select_one('.item-product__name').get_text(strip=True)
-                price_old = item.select_one('.before').get_text(strip=True) if item.select_one('.before') else None
-                price_current = item.select_one('.now').get_text(strip=True) if item.select_one('.now') else None
+                product_name = item['name']
+                price_old = item['price_old']
+                price_current = item['price_current']
 
                 # Extract product image URL
                 parse_image_data = True
@@ -271,36 +235,40 @@ def scrape_page(base_url, page, existing_data, current_index, save_filename='pro
                         parse_image_data = False
 
                 if parse_image_data:
-                    images = item.select('img')
-                    product_image = next(
-                        (img.get('data-original-src') for img in images if img.get('data-original-src') and "discovery-vitality" not in img.get('data-original-src')),
-                        None
-                    )
+                    product_image = item['image']
 
                     if not product_image.startswith('https://www.checkers.co.za'):
                         product_image = 'https://www.checkers.co.za' + product_image  # Append the prefix if it's missing
 
-                    product_image_url = None
                     normalized = unicodedata.normalize('NFKD', product_name.replace(" ", "_")).encode('ascii', 'ignore').decode('ascii')
                     sanitized = re.sub(r'[^\w\.-]', '_', normalized)
                     file_name = f"checkers_image_{sanitized}.jpg"
                     save_path = os.path.join(LOCAL_FOLDER_PATH, file_name)
                     remote_path = f"{REMOTE_FOLDER_PATH}{file_name}"
-                    if product_image:
+                    # Images uploaded earlier in a resumed run are not fetched again
+                    product_image_url = checkpoint.uploaded_image(remote_path) if checkpoint is not None else None
+                    if product_image and product_image_url is None:
                         os.makedirs(LOCAL_FOLDER_PATH, exist_ok=True)
-                        if download_image(product_image, save_path):
-                            product_image_url = upload_file_to_supabase(save_path, BUCKET_NAME, remote_path)
+                        if checkpoint is not None:
+                            checkpoint.image_started(remote_path, product_image, save_path)
+                        with metrics.timer('image_download', 'Checkers'):
+                            downloaded = download_image(product_image, save_path)
+                        if downloaded:
+                            with metrics.timer('image_upload', 'Checkers'):
+                                product_image_url = upload_file_to_supabase(save_path, BUCKET_NAME, remote_path)
+                        if checkpoint is not None:
+                            checkpoint.image_finished(remote_path, product_image_url)
 
                     if product_image_url is None:
                         if verify_file_in_supabase(BUCKET_NAME, remote_path):
-                            print(f"File Exists: {remote_path}")
+                            log.info(f"File Exists: {remote_path}")
                             product_image_url = upload_file_to_supabase(save_path, BUCKET_NAME, remote_path)
                         else:
-                            print(f"Unable to identify image URL for {product_name}, using placeholder image.")
+                            log.warning(f"Unable to identify image URL for {product_name}, using placeholder image.")
                             product_image_url = PLACEHOLDER_IMAGE_URL
 
                 scraped_data.append({
-                    'index': str((page * 20) - 1 + current_index),
+                    'product_id': product_id('Checkers', item['code'], product_name),
                     'name': product_name,
                     'price': get_price(price_old, price_current),
                     'promotion_price': price_current if price_old else "No promo",
@@ -309,6 +277,8 @@ def scrape_page(base_url, page, existing_data, current_index, save_filename='pro
                     'promotion_valid': " ",
                 })
 
+            # One heavy attributes request covers every product on the page
+            if scraped_data:
                 # Use API to get Promotion information
                 cookies = {
                     '_ga_SY8LS918MZ': 'GS1.3.1723260153.2.1.1723260928.27.0.0',
@@ -344,99 +314,98 @@ def scrape_page(base_url, page, existing_data, current_index, save_filename='pro
 
 
                 # response = requests.post('https://www.checkers.co.za/populateProductsWithHeavyAttributes', cookies=cookies, headers=headers, data=json_data)
-                session = requests.Session()
-                session.cookies.update(cookies)
 
-                response = session.post('https://products.checkers.co.za/populateProductsWithHeavyAttributes', headers=headers, data=json_data)
+                with metrics.timer('heavy_attributes', 'Checkers'):
+                    response = controller.request('POST', 'https://products.checkers.co.za/populateProductsWithHeavyAttributes', cookies=cookies, headers=headers, data=json_data)
+                metrics.add_bytes('heavy_attributes', 'Checkers', len(response.content))
 
                 if response.status_code != 200:
-                    logging.error(f"API request failed with status {response.status_code}. Headers/cookies may need updating.")
-
-                response = json.loads(response.text)
-
-                for scraped_item, result in zip(scraped_data, response):
-                    sale_price = result.get('information', [{}])[0].get('salePrice')
-                    bonus_buys = result.get('information', [{}])[0].get('includedInBonusBuys', [])
-
-                    # Get Valid Until information (if there is a promotion)
-                    html_bbs = result.get('information', [{}])[0].get('htmlBBs', '')
-                    html_bbs_unescaped = html.unescape(html_bbs)
-                    soup = BeautifulSoup(html_bbs_unescaped, 'html.parser')
-
-                    # Extract the "Valid until..." span
-                    valid_until_tag = soup.find('span', class_='item-product__valid')
-                    if valid_until_tag:
-                        valid_until_text = valid_until_tag.get_text(strip=True).replace('\xa0', ' ')
-                        scraped_item['promotion_valid'] = valid_until_text
-
-                    # Determine promotion price with optional date tag
-                    if sale_price and not (isinstance(sale_price, float) and math.isnan(sale_price)):
-                        scraped_item['promotion_price'] = f"R{sale_price}".strip()
-                    elif bonus_buys:
-                        bundle_price = bonus_buys[0].get('name')
-                        if bundle_price and not (isinstance(bundle_price, float) and math.isnan(bundle_price)):
-                            scraped_item['promotion_price'] = f"{bundle_price}".strip()
-                        else:
-                            scraped_item['promotion_price'] = 'No promo'
-                    else:
-                        scraped_item['promotion_price'] = 'No promo'
+                    log.error(f"API request failed with status {response.status_code}. Headers/cookies may need updating.")
+
+                with metrics.timer('parse', 'Checkers'):
+                    promotions = parse_pool.run(parse_promotions, response.text)
+                for scraped_item, promotion in zip(scraped_data, promotions):
+                    scraped_item['promotion_price'] = promotion['promotion_price']
+                    if promotion['promotion_valid']:
+                        scraped_item['promotion_valid'] = promotion['promotion_valid']
 
             # Save data incrementally
-            save_to_csv(scraped_data, filename=save_filename)
-            return scraped_data, current_index
+            with checkpoint.page(page) if checkpoint is not None else nullcontext():
+                with metrics.timer('csv_write', 'Checkers'):
+                    save_to_csv(scraped_data, filename=save_filename)
+            metrics.inc('scraper_pages_total', retailer='Checkers', status='scraped')
+            metrics.inc('scraper_products_total', len(scraped_data), retailer='Checkers')
+            if fingerprints is not None:
+                fingerprints.record(page, fingerprint, scraped_data)
+            return scraped_data
 
 
         except Exception as e:
             retries += 1
-            logging.error(f"Error scraping page {page}: {e}")
+            log.error(f"Error scraping page {page}: {e}")
             if retries <= max_retries:
-                logging.info(f"Retrying... Attempt {retries} of {max_retries}")
+                log.info(f"Retrying... Attempt {retries} of {max_retries}")
                 time.sleep(2 ** retries)  # Exponential backoff
             else:
-                logging.error(f"Failed to scrape page {page} after {max_retries} retries.")
-                return [], current_index
+                log.error(f"Failed to scrape page {page} after {max_retries} retries.")
+                metrics.inc('scraper_pages_total', retailer='Checkers', status='failed')
+                if raise_errors:
+                    raise
+                return []
 
-def get_optimal_threads():
-    # Get the number of logical processors
-    cpu_count = os.cpu_count()
+def scrape_checkers_concurrently(base_url, start_page, end_page, existing_data, checkpoint=None):
+    """
+    Scrape a range of pages on a thread pool.
 
-    # For I/O-bound tasks, using 2x-4x the CPU count is often optimal
-    optimal_threads = cpu_count  # Adjust as needed
+    Each page's records are saved by scrape_page, so only a count is kept here, and at most
+    PENDING_PAGES_PER_THREAD pages per thread are queued at a time. The pool is sized to the
+    concurrency controller's ceiling; the controller decides how many requests are in flight.
 
-    # Limit based on system memory (1GB per thread as an example threshold)
-    total_memory = psutil.virtual_memory().total // (1024 * 1024 * 1024)  # in GB
-    memory_limited_threads = total_memory * 2  # Adjust memory scaling as needed
+    Returns:
+        int: The number of products scraped.
+    """
+    optimal_threads = controller.ceiling
+    log.info(f"Using {optimal_threads} threads; in-flight requests per host adapt up to that.", extra=CONSOLE)
 
-    # Use the minimum of CPU-based and memory-based limits
-    return min(optimal_threads, memory_limited_threads)
+    visited_pages = set()
+    scraped_count = 0
+    fingerprints = PageFingerprintStore('Checkers') if INCREMENTAL_CRAWL else None
 
-def scrape_checkers_concurrently(base_url, start_page, end_page, existing_data, starting_index):
-    optimal_threads = get_optimal_threads()
-    print(f"Using {optimal_threads} threads based on system specs.")
+    progress = Progress(log)
 
-    visited_pages = set()
-    all_results = []
-    current_index = starting_index
+    def collect(done):
+        count = 0
+        for future in done:
+            try:
+                products = len(future.result())
+                count += products
+                progress.add(pages=1, products=products)
+            except Exception as e:
+                log.error(f"Error scraping page: {e}")
+        return count
 
     with ThreadPoolExecutor(optimal_threads) as executor:
-        futures = {}
+        pending = set()
         for page in range(start_page, end_page + 1):
             if page in visited_pages:
-                print(f"Skipping already visited page {page}")
+                log.info(f"Skipping already visited page {page}")
+                continue
+            if checkpoint is not None and checkpoint.is_complete(page):
                 continue
             visited_pages.add(page)
-            futures[executor.submit(scrape_page, base_url, page, existing_data, current_index)] = page
+            if len(pending) >= optimal_threads * PENDING_PAGES_PER_THREAD:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                scraped_count += collect(done)
+            pending.add(executor.submit(scrape_page, base_url, page, existing_data, fingerprints=fingerprints, checkpoint=checkpoint))
 
-        for future in as_completed(futures):
-            try:
-                result, current_index = future.result()
-                # Debugging the type of current_index
-                if not isinstance(current_index, (int, float)):
-                    print(f"Error: current_index is not a real number (type: {type(current_index)})")
-                all_results.extend(result)
-            except Exception as e:
-                print(f"Error scraping page: {e}")
-    return all_results
+        scraped_count += collect(as_completed(pending))
+    progress.done()
+
+    parse_pool.shutdown()
+    if fingerprints is not None:
+        fingerprints.save()
+    controller.log_summary()
+    return scraped_count
 
 def load_existing_data(csv_file):
     try:
@@ -444,54 +413,41 @@ def load_existing_data(csv_file):
         df = pd.read_csv(csv_file, encoding='utf-8')
     except UnicodeDecodeError:
         # If UTF-8 fails, try an alternative encoding (e.g., 'latin1')
-        logging.info(f"Warning: Failed to read {csv_file} with UTF-8 encoding. Trying 'latin1'.")
+        log.info(f"Warning: Failed to read {csv_file} with UTF-8 encoding. Trying 'latin1'.")
         df = pd.read_csv(csv_file, encoding='latin1')
     except FileNotFoundError:
-        logging.info(f"Error: File {csv_file} not found.")
+        log.info(f"Error: File {csv_file} not found.")
         return {}
 
-    # Check for rows with NaN values and log them
-    rows_with_nan = df[df.isna().any(axis=1)]
-    if not rows_with_nan.empty:
-        logging.info(f"Warning: Found rows with NaN values:\n{rows_with_nan}")
+    # Count rows with NaN values; the quality gate lists the bad rows themselves
+    nan_rows = int(df.isna().any(axis=1).sum())
+    if nan_rows:
+        log.info(f"Warning: Found {nan_rows} rows with NaN values in {csv_file}.")
         # Replace NaN values with a single space ' '
-        df.fillna(' ', inplace=True)
+        df = df.fillna(' ')
 
     # Convert the DataFrame to a dictionary
     return {
         row['name']: row.to_dict() for _, row in df.iterrows()
     }
 
-def upsert_to_supabase(data, batch_size=500):
+def upsert_to_supabase(data, batch_size=500, retailer='Checkers', soft_delete_missing=SOFT_DELETE_MISSING):
     """
-    Upserts data to Supabase in batches.
+    Upserts the rows that are new or changed since the previous snapshot to Supabase in batches.
 
     Args:
-        data (list): A list of dictionaries containing the rows to be upserted.
-        batch_size (int): The number of rows to upsert in each batch (default: 500).
+        data (list): A list of dictionaries containing the scraped rows.
+        batch_size (int): The most rows in each concurrently sent batch (default: 500).
+        retailer (str): The retailer whose previous snapshot the rows are compared against.
+        soft_delete_missing (bool): Mark products that disappeared since the previous snapshot as inactive.
 
     Returns:
-        None
+        dict: The row counts per change classification and the rows that failed permanently.
     """
     from supabase import create_client
 
-    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-    try:
-        total_rows = len(data)
-        print(f"Total rows to upsert: {total_rows}")
-
-        for start in range(0, total_rows, batch_size):
-            end = start + batch_size
-            batch = data[start:end]
-            print(f"Upserting batch: {start + 1} to {end}")
-
-            response = supabase.table('Products').upsert(batch).execute()
-            print(f"Batch upsert response: {response}")
-
-    except Exception as e:
-        logging.error(f"Error upserting to Supabase: {e}")
-        print(f"Error upserting to Supabase: {e}")
+    log.info(f"Total rows scraped: {len(data)}", extra=CONSOLE)
+    return delta_upsert(lambda: create_client(SUPABASE_URL, SUPABASE_KEY), data, retailer, batch_size=batch_size, soft_delete_missing=soft_delete_missing)
 
 
 def save_to_csv(product_list, filename='products_checkers.csv'):
@@ -503,109 +459,100 @@ def save_to_csv(product_list, filename='products_checkers.csv'):
     filename (str): The name of the CSV file (default: 'products_checkers.csv').
     """
     if not product_list:
-        print("No data to save.")
+        log.info("No data to save.")
         return
 
     # Convert the list of dictionaries to a DataFrame
     df = pd.DataFrame(product_list)
 
-    if 'index' in df.columns:
-        df['index'] = pd.to_numeric(df['index'], errors='coerce')  # Convert to numeric, coerce errors to NaN
-        df.set_index('index', inplace=True)
-    else:
-        df.index = range(0, len(df))
-        df.index.name = 'index'
+    # Write the product ID as the first column
+    df = ensure_product_ids(df).set_index('product_id')
 
     # Check if the file already exists to determine header inclusion
     if not os.path.exists(filename):
         # Save data to CSV with header if the file does not exist
         df.to_csv(filename, mode='w', header=True)
-        print(f"Data has been saved to {filename}.")
+        log.info(f"Data has been saved to {filename}.")
     else:
         # Append data to CSV without header if the file exists
         df.to_csv(filename, mode='a', header=False)
-        print(f"Data has been appended to {filename}.")
+        log.info(f"Data has been appended to {filename}.")
 
 
 def load_and_fix_duplicates(csv_file):
     """
-    Loads data from a CSV file, drops duplicate rows based on the 'name' and 'price' columns,
-    prioritizing rows with a valid 'promotion_price'. Additionally, if the first column ('index')
-    has duplicates, it removes them, recalculates their index, and reinserts them at the end.
+    Loads data from a CSV file and keeps one row per 'product_id', prioritizing rows with a
+    valid 'promotion_price'.
 
     Args:
         csv_file (str): The path to the CSV file.
 
     Returns:
-        pd.DataFrame: A DataFrame containing the cleaned and reindexed data.
+        pd.DataFrame: A DataFrame containing the cleaned data.
     """
     try:
         # Load the CSV file
         df = pd.read_csv(csv_file)
         original_count = len(df)
-        logging.info(f"Loaded {original_count} rows from {csv_file}.")
-
-        # Ensure the first column is named 'index' (if it's unnamed, rename it)
-        if df.columns[0] != 'index':
-            df.rename(columns={df.columns[0]: 'index'}, inplace=True)
+        log.info(f"Loaded {original_count} rows from {csv_file}.")
 
-        # Step 1: Check for duplicate indexes
-        duplicate_indexes = df[df.duplicated(subset=['index'], keep=False)]
-        num_duplicates = len(duplicate_indexes)
+        # Step 1: Fill in product IDs for rows written without one
+        df = ensure_product_ids(df)
 
-        if num_duplicates > 0:
-            logging.info(f"Found {num_duplicates} duplicate index values.")
+        # Step 2: Parse prices to cents and validity texts to dates, and keep one row per product ID, prioritizing valid promotions
+        df = annotate_validity(annotate_prices(df))
+        df['promo_priority'] = (df['promo_type'] == PROMO_NONE).astype(int)
+        df = df.sort_values(by=['product_id', 'promo_priority', 'price_cents'])
+        df = df.drop_duplicates(subset=['product_id'], keep='first').drop(columns=['promo_priority'])
 
-            # Step 2: Save duplicates in a list and remove them from the original DataFrame
-            duplicate_rows = duplicate_indexes.copy()
-            df = df.drop(duplicate_indexes.index)
-
-            # Step 3: Determine the new starting index dynamically
-            latest_index = df['index'].max() if not df['index'].empty else -1  # Get the highest existing index
-            new_indexes = list(range(latest_index + 1, latest_index + 1 + num_duplicates))
-
-            # Step 4: Assign new indexes to duplicate rows
-            duplicate_rows['index'] = new_indexes
-
-            # Step 5: Append the fixed duplicates back into the DataFrame
-            df = pd.concat([df, duplicate_rows], ignore_index=True)
-            logging.info(f"Reinserted {num_duplicates} rows with new indexes starting from {latest_index + 1}.")
-
-        # Step 6: Remove duplicates based on 'name' and 'price', prioritizing valid promotion prices
-        df['promo_priority'] = df['promotion_price'].apply(lambda x: 0 if x != 'No promo' else 1)
-        df = df.sort_values(by=['name', 'price', 'promo_priority'])
-        df = df.drop_duplicates(subset=['name', 'price'], keep='first').drop(columns=['promo_priority'])
-
-        # Step 7: Save the cleaned DataFrame
+        # Step 3: Save the cleaned DataFrame
         df.to_csv(csv_file, index=False)
-        logging.info(f"Overwritten {csv_file} with cleaned data. Final row count: {len(df)}")
+        log.info(f"Overwritten {csv_file} with cleaned data. Final row count: {len(df)}")
 
         return df
 
     except Exception as e:
-        logging.error(f"Error processing data from {csv_file}: {e}")
+        log.error(f"Error processing data from {csv_file}: {e}")
         return pd.DataFrame()
 
 
 if __name__ == "__main__":
-    base_url = "https://products.checkers.co.za/c-2413/All-Departments/Food?q=%3Arelevance"
-    existing_data = load_existing_data('products_old.csv')
-    # starting_index = get_last_index('products_checkers.csv')
-    logging.info("Script started.")
-    scraped_data = scrape_checkers_concurrently(base_url, start_page=0, end_page=375,
-                                                existing_data=existing_data, starting_index=0)
-
-    if scraped_data:
-        load_and_fix_duplicates('products_checkers.csv')
-        new_data = load_existing_data('products_checkers.csv')
-        # Filter new_data to include only rows where 'retailer' == 'Checkers'
-        filtered_data = {name: details for name, details in new_data.items() if details.get('retailer') == 'Checkers'}
-        upsert_to_supabase(list(filtered_data.values()))
-        logging.info("Data saved and updated.")
+    parser = argparse.ArgumentParser(description="Scrape product information from the Checkers website.")
+    parser.add_argument("--resume", action="store_true", help="Continue the last interrupted crawl from its checkpoint")
+    parser.add_argument("--profile", action="store_true", help="Write a sampling profile of the run to profiles/")
+    parser.add_argument("--memory-report", action="store_true", help="Trace allocations and write the top allocation sites to profiles/")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="Level of the Checkers log (default: INFO)")
+    parser.add_argument("--log-json", action="store_true", help="Also write the log as JSON lines to logs/")
+    args = parser.parse_args()
+
+    setup_logging('checkers', json_lines=args.log_json)
+    if args.log_level:
+        log.setLevel(args.log_level)
+
+    with profiled('Checkers', enabled=args.profile), memory_report('Checkers', enabled=args.memory_report):
+        existing_data = load_existing_data('products_old.csv')
+        log.info("Script started.")
+        checkpoint = CrawlCheckpoint('Checkers', 'products_checkers.csv')
+        resumed = checkpoint.begin(resume=args.resume)
+        scraped_count = scrape_checkers_concurrently(BASE_URL, start_page=0, end_page=LAST_PAGE, existing_data=existing_data,
+                                                    checkpoint=checkpoint)
+        checkpoint.finish()
+
+        if scraped_count or resumed:
+            with metrics.timer('dedup', 'Checkers'):
+                load_and_fix_duplicates('products_checkers.csv')
+            # Nothing is published if the output fails the quality gate
+            if quality_gate('Checkers', 'products_checkers.csv').passed:
+                # One row per product ID, so products that share a name are all published
+                rows = rows_to_publish('products_checkers.csv', 'Checkers')
+                with metrics.timer('upsert', 'Checkers'):
+                    upsert_to_supabase(rows)
+                log.info("Data saved and updated.")
 
-    else:
-        logging.info("No new data scraped.")
-    logging.info("Script completed.")
-    logging.shutdown()
+        else:
+            log.info("No new data scraped.")
+        metrics.write('Checkers')
+    log.info("Script completed.")
+    stop_logging()
 
 # Take a look at save_to_csv - # Convert to numeric, coerce errors to NaN!
@@ -1,33 +1,41 @@
 import argparse
-import requests
 import json
-import pandas as pd
-from datetime import datetime, time
-import pytz
-from time import sleep
+from lazy_imports import lazy_import
+from datetime import datetime, time, timezone
+from time import perf_counter, sleep
 from urllib.parse import urlparse
-import os
-import logging
+from supabase_sync import delta_upsert, rows_to_publish
+from price_engine import PROMO_NONE, annotate_prices
+from promo_validity import annotate_validity
+from product_ids import ensure_product_ids, product_id
+from page_fingerprints import PageFingerprintStore, page_fingerprint
+from crawl_checkpoint import CrawlCheckpoint
+from data_quality import quality_gate
+from crawl_planner import CrawlPlanner, CrawlWindow
+from metrics import metrics
+from profiling import memory_report, profiled
+from adaptive_concurrency import controller
+from http_transport import sessions
+from log_setup import CONSOLE, Progress, retailer_logger, setup_logging
+
+pd = lazy_import('pandas')
 
 
 SUPABASE_URL = "<supabase_url>"
 SUPABASE_KEY = "<supabase_key>"
+# Mark products that disappeared since the previous run as inactive in Supabase
+SOFT_DELETE_MISSING = False
+# Reuse the previous run's records for pages whose products, prices and promotions are unchanged
+INCREMENTAL_CRAWL = True
+# robots.txt allows visits between these times (UTC) only
+ALLOWED_START = time(4, 0)
+ALLOWED_END = time(8, 45)
+# Pages planned for before the listing has reported its page count
+EXPECTED_PAGES = 138
 
 
-# Setup logging directory
-log_dir = "logs"
-os.makedirs(log_dir, exist_ok=True)
-
-# Generate log filename with timestamp
-log_filename = os.path.join(log_dir, f"pnp_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.log")
-
-# Configure logging
-logging.basicConfig(
-    filename=log_filename,
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S"
-)
+# Configured by setup_logging() when run as a script
+log = retailer_logger('Pick n Pay')
 
 
 class Scraper:
@@ -45,8 +53,8 @@ class Scraper:
         """
         self.timeout = max(timeout, 10)  # Ensure we respect the 10-second crawl delay
         self.referer_url = referer_url
-        self.session = requests.Session()
-        self.session.headers.update({
+        # Every request to the host, through the shared keep-alive session, identifies the bot
+        sessions.configure('https://www.pnp.co.za', headers={
             'User-Agent': 'CustomBot/1.0 (+http://www.example.com/bot.html)'
         })
 
@@ -57,10 +65,8 @@ class Scraper:
         Returns:
         bool: True if current time is within allowed visit time, False otherwise.
         """
-        utc_now = datetime.now(pytz.UTC).time()
-        start_time = time(4, 0)
-        end_time = time(8, 45)
-        return start_time <= utc_now <= end_time
+        utc_now = datetime.now(timezone.utc).time()
+        return ALLOWED_START <= utc_now <= ALLOWED_END
 
     def request(self, page_number, max_retries=3):
         """
@@ -73,7 +79,7 @@ class Scraper:
         dict: The JSON response from the server.
         """
         if not self.is_allowed_time():
-            print("Current time is outside the allowed visit time (04:00-08:45 UTC). Exiting.")
+            log.warning("Current time is outside the allowed visit time (04:00-08:45 UTC). Exiting.")
             return None
 
         headers = {
@@ -124,31 +130,32 @@ class Scraper:
             'curr': 'ZAR'
         }
 
-        logging.info(f"Requesting page {page_number} of Pnp")
-        print(f"Requesting page {page_number} of Pnp")
+        log.info(f"Requesting page {page_number} of Pnp")
         retry_count = 0
 
         while retry_count < max_retries:
             try:
-                response = self.session.post(base_url, params=params, headers=headers)
+                with metrics.timer('fetch', 'Pick n Pay'):
+                    response = controller.request('POST', base_url, params=params, headers=headers)
+                metrics.add_bytes('fetch', 'Pick n Pay', len(response.content))
 
                 if response.ok:
-                    logging.info(f"Response received. Status code: {response.status_code}")
+                    log.info(f"Response received. Status code: {response.status_code}")
                     return json.loads(response.text)
                 else:
-                    logging.warning(f"Request failed. Status code: {response.status_code}")
+                    log.warning(f"Request failed. Status code: {response.status_code}")
                     return None
 
             except Exception as e:
                 retry_count += 1
-                logging.warning(f"An error occurred: {str(e)}. Retry {retry_count}/{max_retries}")
+                log.warning(f"An error occurred: {str(e)}. Retry {retry_count}/{max_retries}")
 
                 if retry_count >= max_retries:
-                    logging.error("Max retries reached. Request failed.")
+                    log.error("Max retries reached. Request failed.")
                     return None
 
             finally:
-                logging.info(f"Waiting for {self.timeout} seconds before the next attempt...")
+                log.info(f"Waiting for {self.timeout} seconds before the next attempt...")
                 sleep(self.timeout)
 
 
@@ -172,6 +179,7 @@ class Scraper:
         for result in results:
             promo, valid_until = self.get_promotion_message(result.get('potentialPromotions', []))
             prod_dict = {
+                'product_id': product_id('Pick n Pay', result.get('code'), result.get('name')),
                 'name': result.get('name'),
                 'price': result.get('price', {}).get('formattedValue') or 'Price not available',
                 'promotion_price': promo,
@@ -184,6 +192,22 @@ class Scraper:
 
         return pd.DataFrame(prod_lst)
 
+    def fingerprint_page(self, response):
+        """
+        Fingerprint a page from the product codes, prices and promotions in its response.
+
+        Args:
+            response (dict): The JSON response from the server.
+
+        Returns:
+            str: The page's fingerprint.
+        """
+        return page_fingerprint([
+            (result.get('code'), result.get('name'), result.get('price', {}).get('formattedValue'),
+             result.get('potentialPromotions'))
+            for result in response.get('products', [])
+        ])
+
     def get_promotion_message(self, promotions):
         """
         Extract and format the promotion message from the promotions data.
@@ -211,258 +235,229 @@ class Scraper:
         if end_date_str:
             try:
                 end_date = datetime.strptime(end_date_str, '%Y-%m-%dT%H:%M:%S%z')
-                formatted_date = f"Valid until {end_date.strftime('%#d %B %Y')}"  # Use %-d for Unix, %#d for Windows
+                formatted_date = f"Valid until {end_date.day} {end_date.strftime('%B %Y')}"
             except Exception as e:
-                print(f"Date parsing error: {e}")
+                log.warning(f"Date parsing error: {e}")
                 formatted_date = ' '
 
         return message or 'No promo', formatted_date
 
 
-    def load_existing_data(self, csv_file):
-        """
-        Load existing product data from a CSV file and return it as a dictionary.
-
-        This function attempts to read the specified CSV file using UTF-8 encoding.
-        If UTF-8 fails, it falls back to 'latin1' encoding.
-        It logs warnings for any rows with missing (NaN) values in the file and
-        skips them in the returned data.
-
-        Args:
-            csv_file (str): The path to the CSV file to load.
-
-        Returns:
-            dict: A dictionary where keys are product names and values are dictionaries of
-                  product details.
-                Returns an empty dictionary if the file is not found or unreadable.
+    def upsert_to_supabase(self, data, batch_size=500, retailer='Pick n Pay', soft_delete_missing=SOFT_DELETE_MISSING):
         """
-        try:
-            # Try reading the CSV file with UTF-8 encoding first
-            df = pd.read_csv(csv_file, encoding='utf-8')
-        except UnicodeDecodeError:
-            # If UTF-8 fails, try an alternative encoding (e.g., 'latin1')
-            logging.info(f"Warning: Failed to read {csv_file} with UTF-8 encoding. Trying 'latin1'.")
-            df = pd.read_csv(csv_file, encoding='latin1')
-        except FileNotFoundError:
-            logging.info(f"Error: File {csv_file} not found.")
-            return {}
-
-        # Check for rows with NaN values and log them
-        rows_with_nan = df[df.isna().any(axis=1)]
-        if not rows_with_nan.empty:
-            logging.info(f"Warning: Found rows with NaN values:\n{rows_with_nan}")
-            # Replace NaN values with a single space ' '
-            df.fillna(' ', inplace=True)
-
-        # Convert the DataFrame to a dictionary
-        return {
-            row['name']: row.to_dict() for _, row in df.iterrows()
-        }
-
-
-    def upsert_to_supabase(self, data, batch_size=500):
-        """
-        Upserts data to Supabase in batches.
+        Upserts the rows that are new or changed since the previous snapshot to Supabase in batches.
 
         Args:
-            data (list): A list of dictionaries containing the rows to be upserted.
-            batch_size (int): The number of rows to upsert in each batch (default: 500).
+            data (list): A list of dictionaries containing the scraped rows.
+            batch_size (int): The most rows in each concurrently sent batch (default: 500).
+            retailer (str): The retailer whose previous snapshot the rows are compared against.
+            soft_delete_missing (bool): Mark products that disappeared since the previous snapshot as inactive.
 
         Returns:
-            None
+            dict: The row counts per change classification and the rows that failed permanently.
         """
         from supabase import create_client
 
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-        try:
-            total_rows = len(data)
-            print(f"Total rows to upsert: {total_rows}")
-
-            for start in range(0, total_rows, batch_size):
-                end = start + batch_size
-                batch = data[start:end]
-                print(f"Upserting batch: {start + 1} to {end}")
-
-                response = supabase.table('Products').upsert(batch).execute()
-                print(f"Batch upsert response: {response}")
-
-        except Exception as e:
-            logging.error(f"Error upserting to Supabase: {e}")
-            print(f"Error upserting to Supabase: {e}")
+        log.info(f"Total rows scraped: {len(data)}", extra=CONSOLE)
+        return delta_upsert(lambda: create_client(SUPABASE_URL, SUPABASE_KEY), data, retailer, batch_size=batch_size, soft_delete_missing=soft_delete_missing)
 
 
     def load_and_fix_duplicates(self, csv_file):
         """
-        Loads data from a CSV file, drops duplicate rows based on the 'name' and 'price' columns,
-        prioritizing rows with a valid 'promotion_price'. Additionally, if the first column ('index')
-        has duplicates, it removes them, recalculates their index, and reinserts them at the end.
+        Loads data from a CSV file and keeps one row per 'product_id', prioritizing rows with a
+        valid 'promotion_price'.
 
         Args:
             csv_file (str): The path to the CSV file.
 
         Returns:
-            pd.DataFrame: A DataFrame containing the cleaned and reindexed data.
+            pd.DataFrame: A DataFrame containing the cleaned data.
         """
         try:
             # Load the CSV file
             df = pd.read_csv(csv_file)
             original_count = len(df)
-            logging.info(f"Loaded {original_count} rows from {csv_file}.")
-
-            # Ensure the first column is named 'index' (if it's unnamed, rename it)
-            if df.columns[0] != 'index':
-                df.rename(columns={df.columns[0]: 'index'}, inplace=True)
-
-            # Step 1: Check for duplicate indexes
-            duplicate_indexes = df[df.duplicated(subset=['index'], keep=False)]
-            num_duplicates = len(duplicate_indexes)
+            log.info(f"Loaded {original_count} rows from {csv_file}.")
 
-            if num_duplicates > 0:
-                logging.info(f"Found {num_duplicates} duplicate index values.")
+            # Step 1: Fill in product IDs for rows written without one
+            df = ensure_product_ids(df)
 
-                # Step 2: Save duplicates in a list and remove them from the original DataFrame
-                duplicate_rows = duplicate_indexes.copy()
-                df = df.drop(duplicate_indexes.index)
+            # Step 2: Parse prices to cents and validity texts to dates, and keep one row per product ID, prioritizing valid promotions
+            df = annotate_validity(annotate_prices(df))
+            df['promo_priority'] = (df['promo_type'] == PROMO_NONE).astype(int)
+            df = df.sort_values(by=['product_id', 'promo_priority', 'price_cents'])
+            df = df.drop_duplicates(subset=['product_id'], keep='first').drop(columns=['promo_priority'])
 
-                # Step 3: Determine the new starting index
-                latest_index = max(df['index'].max() if not df['index'].empty else float('-inf'), 7499)
-                new_indexes = list(range(latest_index + 1, latest_index + 1 + num_duplicates))
-
-                # Step 4: Assign new indexes to duplicate rows
-                duplicate_rows['index'] = new_indexes
-
-                # Step 5: Append the fixed duplicates back into the DataFrame
-                df = pd.concat([df, duplicate_rows], ignore_index=True)
-                logging.info(f"Reinserted {num_duplicates} rows with new indexes starting from {latest_index + 1}.")
-
-            # Step 6: Remove duplicates based on 'name' and 'price', prioritizing valid promotion prices
-            df['promo_priority'] = df['promotion_price'].apply(lambda x: 0 if x != 'No promo' else 1)
-            df = df.sort_values(by=['name', 'price', 'promo_priority'])
-            df = df.drop_duplicates(subset=['name', 'price'], keep='first').drop(columns=['promo_priority'])
-
-            # Step 7: Save the cleaned DataFrame
+            # Step 3: Save the cleaned DataFrame
             df.to_csv(csv_file, index=False)
-            logging.info(f"Overwritten {csv_file} with cleaned data. Final row count: {len(df)}")
+            log.info(f"Overwritten {csv_file} with cleaned data. Final row count: {len(df)}")
 
             return df
 
         except Exception as e:
-            logging.error(f"Error processing data from {csv_file}: {e}")
+            log.error(f"Error processing data from {csv_file}: {e}")
             return pd.DataFrame()
 
 
-    def run(self, filename='products_pnp.csv'):
+    def run(self, filename='products_pnp.csv', resume=False):
         """
         Run the scraping process, collecting data from multiple pages.
 
+        Pages are crawled in the planner's priority order, and only while they can finish within
+        the allowed visit time. If the window closes first, the next run resumes the crawl.
+
         Args:
         filename (str): The name of the CSV file to save the results to.
+        resume (bool): Continue the last interrupted crawl from its checkpoint.
         """
-        page_number = 0
-
-        # Load existing file or initialize from scratch
-        try:
-            existing_df = pd.read_csv(filename, index_col=0, encoding='utf-8')
-            next_index = max(7500, existing_df.index.max() + 1)  # Start from 7500 if file exists
-        except FileNotFoundError:
-            print(f"Warning: File {filename} not found. Starting a new file.")
-            next_index = 7500
-        except UnicodeDecodeError:
-            print(f"Warning: Failed to read {filename} with UTF-8 encoding. Trying 'latin1'.")
-            try:
-                existing_df = pd.read_csv(filename, index_col=0, encoding='latin1')
-                next_index = max(7500, existing_df.index.max() + 1)
-            except Exception as e:
-                print(f"Error: Unable to read {filename} with fallback encoding. {e}")
-                next_index = 7500
-
-        while True:
+        planner = CrawlPlanner('Pick n Pay', CrawlWindow(ALLOWED_START, ALLOWED_END), self.timeout, EXPECTED_PAGES)
+        if not resume and planner.carried_over_run():
+            log.info(f"Resuming run {planner.carried_over_run()}, which the previous crawl window closed on.")
+            resume = True
+        if not planner.wait_for_window():
+            metrics.write('Pick n Pay')
+            return
+        checkpoint = CrawlCheckpoint('Pick n Pay', filename)
+        checkpoint.begin(resume=resume)
+        fingerprints = PageFingerprintStore('Pick n Pay') if INCREMENTAL_CRAWL else None
+
+        pending = planner.order(page for page in range(planner.page_count) if not checkpoint.is_complete(page))
+        planner.plan(len(pending))
+        progress = Progress(log)
+        failed = False
+        while pending:
+            if not planner.can_start_page():
+                planner.carry_over(checkpoint.run_id)
+                break
+            page_number = pending.pop(0)
+            started = perf_counter()
             response = self.request(page_number)
             if not response:
+                pending.insert(0, page_number)
+                failed = True
                 break
 
-            response_df = self.process(response)
+            # The listing reports its page count; pages past the end are dropped, new ones queued last
+            page_count = response.get('pagination', {}).get('totalPages')
+            if page_count:
+                pending = [page for page in pending if page < page_count]
+                pending += [page for page in range(planner.page_count, page_count) if not checkpoint.is_complete(page)]
+                planner.set_page_count(page_count)
+
+            fingerprint = self.fingerprint_page(response)
+            previous_records = fingerprints.unchanged(page_number, fingerprint) if fingerprints is not None else None
+            if previous_records is not None:
+                log.info(f"Page {page_number} of Pnp is unchanged. Reusing {len(previous_records)} products.")
+                response_df = pd.DataFrame(previous_records)
+            else:
+                with metrics.timer('parse', 'Pick n Pay'):
+                    response_df = self.process(response)
             if response_df.empty:
-                break
+                # Past the end of the listing
+                with checkpoint.page(page_number):
+                    pass
+                continue
 
-            # Set the index for the new data
-            response_df.index = range(next_index, next_index + len(response_df))
-            response_df.index.name = 'index'
+            # Write the product ID as the first column
+            response_df = ensure_product_ids(response_df).set_index('product_id')
 
             # Save the processed data to the CSV file
-            try:
-                response_df.to_csv(
-                    filename,
-                    mode='a',
-                    header=not pd.io.common.file_exists(filename),
-                    encoding='utf-8'
-                )
-                print(f"Page {page_number} data successfully saved to {filename}.")
-            except UnicodeEncodeError:
-                print(f"Warning: Failed to save {filename} with UTF-8 encoding. Trying 'latin1'.")
-                response_df.to_csv(
-                    filename,
-                    mode='a',
-                    header=not pd.io.common.file_exists(filename),
-                    encoding='latin1'
-                )
-
-            next_index += len(response_df)
-            page_number += 1
-
-            if page_number == 138:
-                break
+            with checkpoint.page(page_number), metrics.timer('csv_write', 'Pick n Pay'):
+                try:
+                    response_df.to_csv(
+                        filename,
+                        mode='a',
+                        header=not pd.io.common.file_exists(filename),
+                        encoding='utf-8'
+                    )
+                    log.info(f"Page {page_number} data successfully saved to {filename}.")
+                except UnicodeEncodeError:
+                    log.warning(f"Failed to save {filename} with UTF-8 encoding. Trying 'latin1'.")
+                    response_df.to_csv(
+                        filename,
+                        mode='a',
+                        header=not pd.io.common.file_exists(filename),
+                        encoding='latin1'
+                    )
+
+            if fingerprints is not None and previous_records is None:
+                fingerprints.record(page_number, fingerprint, response_df.reset_index().to_dict('records'))
+            planner.page_done(page_number, perf_counter() - started, changed=previous_records is None,
+                              promotions=int((response_df['promotion_price'] != 'No promo').sum()))
+            metrics.inc('scraper_pages_total', retailer='Pick n Pay', status='scraped' if previous_records is None else 'unchanged')
+            metrics.inc('scraper_products_total', len(response_df), retailer='Pick n Pay')
+            progress.add(pages=1, products=len(response_df))
 
             # Uncomment the following block for production use
             # if page_number > 1:
             #     if response_df.equals(dfs[-2]):
             #         break
 
-        # --- Deduplicate the CSV file ---
-        try:
-            # Attempt to load the CSV using UTF-8 encoding first
-            df = pd.read_csv(filename, index_col=0, encoding='utf-8')
-        except UnicodeDecodeError:
-            print(f"Warning: Failed to load {filename} with UTF-8. Trying 'latin1'.")
-            df = pd.read_csv(filename, index_col=0, encoding='latin1')
-        original_count = len(df)
-        df.drop_duplicates(subset=['name', 'price'], keep='first', inplace=True)
-        deduped_count = len(df)
-        logging.info(f"Dropped {original_count - deduped_count} duplicate rows. {deduped_count} rows remain.")
-        df.to_csv(filename, encoding='utf-8')
-        # --- End deduplication ---
-
-        # Load data from the updated CSV
-        self.load_and_fix_duplicates('products_pnp.csv')
-        new_data = self.load_existing_data('products_pnp.csv')
+        progress.done()
+        finished = not pending and not failed
+        planner.save(finished=finished)
+        if fingerprints is not None:
+            fingerprints.save()
+
+        if not finished:
+            # A run the window closed on is resumed by the next run; after a failed request, run again with --resume
+            metrics.inc('scraper_pages_total', len(pending), retailer='Pick n Pay', status='deferred')
+            if failed:
+                message = f"Pnp crawl stopped at page {page_number} with {len(pending)} pages left. Run again with --resume to continue."
+            else:
+                message = f"Pnp crawl window is closing with {len(pending)} pages left. The next run continues from here."
+            log.info(message, extra=CONSOLE)
+            metrics.write('Pick n Pay')
+            return
+        checkpoint.finish()
+
+        # Deduplicate on product ID and load data from the updated CSV
+        with metrics.timer('dedup', 'Pick n Pay'):
+            self.load_and_fix_duplicates('products_pnp.csv')
+        # Nothing is published if the output fails the quality gate
+        if not quality_gate('Pick n Pay', 'products_pnp.csv').passed:
+            metrics.write('Pick n Pay')
+            return
+        # One row per product ID, so products that share a name are all published
+        rows = rows_to_publish('products_pnp.csv', 'Pick n Pay')
 
         # Upsert the data to Supabase
         try:
-            # Filter new_data to include only rows where 'retailer' == 'Pick n Pay'
-            filtered_data = {name: details for name, details in new_data.items() if details.get('retailer') == 'Pick n Pay'}
-            self.upsert_to_supabase(list(filtered_data.values()))
-            print(f"Scraping complete. {len(filtered_data.values())} products scraped and saved to '{filename}'.")
+            with metrics.timer('upsert', 'Pick n Pay'):
+                self.upsert_to_supabase(rows)
+            log.info(f"Scraping complete. {len(rows)} products scraped and saved to '{filename}'.", extra=CONSOLE)
         except Exception as e:
-            print(f"Error during Supabase upsert: {e}")
-        logging.info("Scraping process complete.")
+            log.error(f"Error during Supabase upsert: {e}")
+        metrics.write('Pick n Pay')
+        log.info("Scraping process complete.")
 
 
-def main(timeout, referer_url):
+def main(timeout, referer_url, resume=False):
     """
     Main function to create a Scraper instance and run the scraping process.
 
     Args:
     timeout (int): The timeout value to be passed to the Scraper.
     referer_url (str): The referer URL to use in the request headers.
+    resume (bool): Continue the last interrupted crawl from its checkpoint.
     """
     scraper = Scraper(timeout, referer_url)
-    scraper.run()
+    scraper.run(resume=resume)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Scrape product information from PnP website.")
     parser.add_argument("--timeout", type=int, default=10, help="Timeout between requests in seconds (default: 10 seconds)")
     parser.add_argument("--url", type=str, required=True, help="Referer URL to use in the request headers")
+    parser.add_argument("--resume", action="store_true", help="Continue the last interrupted crawl from its checkpoint")
+    parser.add_argument("--profile", action="store_true", help="Write a sampling profile of the run to profiles/")
+    parser.add_argument("--memory-report", action="store_true", help="Trace allocations and write the top allocation sites to profiles/")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="Level of the Pick n Pay log (default: INFO)")
+    parser.add_argument("--log-json", action="store_true", help="Also write the log as JSON lines to logs/")
     args = parser.parse_args()
 
-    main(args.timeout, args.url)
+    setup_logging('pnp', json_lines=args.log_json)
+    if args.log_level:
+        log.setLevel(args.log_level)
+
+    with profiled('Pick n Pay', enabled=args.profile), memory_report('Pick n Pay', enabled=args.memory_report):
+        main(args.timeout, args.url, resume=args.resume)
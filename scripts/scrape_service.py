@@ -1,33 +1,34 @@
 import win32serviceutil
 import win32service
-import win32event
-import subprocess
+import logging
 import os
+import sys
+
+# The service starts in the Windows system folder; the scheduler and scrapers live next to this file
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from scheduler import LOCK_FILE, SCRIPTS_DIR, InstanceLocked, Scheduler, configure_logging, instance_lock  # noqa: E402
 
 class ScrapeService(win32serviceutil.ServiceFramework):
     _svc_name_ = "DailyScrapeService"
     _svc_display_name_ = "Daily Scrape Service"
-    _svc_description_ = "Runs scrape_checkers, scrape_shoprite and scrape_pnp daily at 6 AM with backups."
+    _svc_description_ = "Runs the retailer scrapers on the schedules in scheduler.py (daily at 6 AM UTC by default) with backups."
 
     def __init__(self, args):
         win32serviceutil.ServiceFramework.__init__(self, args)
-        self.stop_event = win32event.CreateEvent(None, 0, 0, None)
-        self.process = None
+        self.scheduler = Scheduler()
 
     def SvcStop(self):
         self.ReportServiceStatus(win32service.SERVICE_STOP_PENDING)
-        win32event.SetEvent(self.stop_event)
-        if self.process:
-            self.process.terminate()
-        self.ReportServiceStatus(win32service.SERVICE_STOPPED)
+        # Ends the scheduler loop in SvcDoRun and terminates a scrape in progress
+        self.scheduler.stop()
 
     def SvcDoRun(self):
-        # Path to the daily_scrape.py script
-        script_path = os.path.abspath("daily_scrape.py")
-        while True:
-            # Run the script
-            self.process = subprocess.Popen(["python", script_path], shell=False)
-            self.process.wait()
+        configure_logging()
+        try:
+            with instance_lock(os.path.join(SCRIPTS_DIR, LOCK_FILE)):
+                self.scheduler.run()
+        except InstanceLocked as e:
+            logging.error(f"Scheduler is already running: {e}")
 
 if __name__ == "__main__":
     win32serviceutil.HandleCommandLine(ScrapeService)
@@ -1,44 +1,49 @@
-import requests
+import argparse
 import re
 import html
 import json
-import pandas as pd
-from datetime import datetime
+from lazy_imports import lazy_import
+from contextlib import nullcontext
 from time import sleep as sleep
 import os
-from supabase import create_client
-import logging
+from supabase_sync import delta_upsert, rows_to_publish
+from price_engine import PROMO_NONE, annotate_prices
+from promo_validity import annotate_validity
+from product_ids import ensure_product_ids, product_id
+from page_fingerprints import PageFingerprintStore, page_fingerprint
+from crawl_checkpoint import CrawlCheckpoint
+from data_quality import quality_gate
+from metrics import metrics
+from profiling import memory_report, profiled
+from adaptive_concurrency import controller
+from log_setup import CONSOLE, Progress, retailer_logger, setup_logging
+
+pd = lazy_import('pandas')
 
 
 SUPABASE_URL = "<supabase_url>"
 SUPABASE_KEY = "<supabase_key>"
+# Mark products that disappeared since the previous run as inactive in Supabase
+SOFT_DELETE_MISSING = False
+# Reuse the previous run's records for category pages whose products, prices and promotions are unchanged
+INCREMENTAL_CRAWL = True
 
 
-# Setup logging directory
-log_dir = "logs"
-os.makedirs(log_dir, exist_ok=True)
-
-# Generate log filename with timestamp
-log_filename = os.path.join(log_dir, f"woolies_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.log")
-
-# Configure logging
-logging.basicConfig(
-    filename=log_filename,
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S"
-)
+# Configured by setup_logging() when run as a script
+log = retailer_logger('Woolworths')
 
 
 # Create a scraper class
 class Scraper:
 
     # Define the initialization function
-    def __init__(self, params, category, code, last_index=0):
+    def __init__(self, params, category, code, fingerprints=None, checkpoint=None, progress=None):
         self.timeout = params.get('timeout')
         self.category = category
         self.code = code
-        self.last_index = last_index
+        self.fingerprints = fingerprints
+        self.checkpoint = checkpoint
+        self.progress = progress
 
     # Request data from a page number
     def request(self, page_number):
@@ -50,7 +55,7 @@ class Scraper:
             'Accept': 'application/json, text/plain, */*',
             'Accept-Language': 'en-US,en;q=0.9',
             'Connection': 'keep-alive',
-            'Referer': f'https://www.woolworths.co.za/cat/Food/{category}/_/N-{code}?No=48&Nrpp=24',
+            'Referer': f'https://www.woolworths.co.za/cat/Food/{self.category}/_/N-{self.code}?No=48&Nrpp=24',
             'Sec-Fetch-Dest': 'empty',
             'Sec-Fetch-Mode': 'cors',
             'Sec-Fetch-Site': 'same-origin',
@@ -62,33 +67,30 @@ class Scraper:
             'sec-ch-ua-mobile': '?0',
             'sec-ch-ua-platform': '"Windows"',
             'x-dtpc': '9$201666412_28h16vVREQKDMKAHRSFAUHGCWIVNVFSJFRSVNG-0e0',
-            'x-dtreferer': f'https://www.woolworths.co.za/cat/Food/{category}/_/N-{code}?No=24&Nrpp=24',
+            'x-dtreferer': f'https://www.woolworths.co.za/cat/Food/{self.category}/_/N-{self.code}?No=24&Nrpp=24',
         }
 
         params = {
-            'pageURL': f'/cat/Food/{category}/_/N-{code}',
+            'pageURL': f'/cat/Food/{self.category}/_/N-{self.code}',
             'No': f'{page_number * 24}',
             'Nrpp': '24',
         }
 
-        # Keep the user updated with terminal window print outs
-        print_update = lambda x: print(f'>>>> Time {datetime.now().strftime("%Y-%m-%d %H:%M:%S")} - Response Code: {x}', end='\r')
-        logging.info(f"Requesting page {page_number} of Woolies")
-        print(f"Requesting page {page_number} of Woolies")
+        # Progress is printed per interval by run(); each request is only logged
+        log.info(f"Requesting page {page_number} of {self.category}")
 
         # Add a while True loop that will break on a successful response
         while True:
 
             # Use a try except block to catch any exceptions
             try:
-                response = requests.get('https://www.woolworths.co.za/server/searchCategory', params=params, headers=headers)
+                with metrics.timer('fetch', 'Woolworths'):
+                    response = controller.request('GET', 'https://www.woolworths.co.za/server/searchCategory', params=params, headers=headers)
+                metrics.add_bytes('fetch', 'Woolworths', len(response.content))
 
                 # Response.ok is set to true if the response code is 200
                 if response.ok:
 
-                    # Print the response code to the terminal
-                    print_update(response.status_code)
-
                     # Convert the response text to python dictionary
                     response = json.loads(response.text)
 
@@ -97,15 +99,15 @@ class Scraper:
 
                 else:
 
-                    # Print the response code to the terminal
-                    print_update(response.status_code)
+                    # Log the response code
+                    log.warning(f"Page {page_number} of {self.category} returned {response.status_code}. Retrying in {self.timeout} seconds.")
 
                     # Issue a sleep command for x seconds, settings in params
                     sleep(self.timeout)
-            except:
+            except Exception as e:
 
-                # Print the response code to the terminal
-                print_update("ERROR")
+                # Log the error
+                log.warning(f"Page {page_number} of {self.category} failed: {e}. Retrying in {self.timeout} seconds.")
 
                 # Issue a sleep command for x seconds, settings in params
                 sleep(self.timeout)
@@ -113,14 +115,10 @@ class Scraper:
     # Process the response data from the server
     def process(self, response, offer_valid_sentence):
 
-        results = response.get('contents')[0].get('mainContent')[0].get('contents')[0].get('records')
-
-        count = response.get('contents')[0].get("secondaryContent")[0].get("categoryDimensions")[0].get("count")
+        results = self.get_records(response)
 
         # Get the number of pages to scrape
-        page_end = count // 24
-        if count % 24 == 0:
-            page_end -= 1
+        page_end = self.get_page_end(response)
 
         products = []
 
@@ -129,6 +127,8 @@ class Scraper:
 
             # Extract the product details
             product = {
+                'product_id': product_id('Woolworths', result.get('attributes', {}).get('p_productid'),
+                                         result.get('attributes').get('p_displayName')),
                 'name': result.get('attributes').get('p_displayName'),
                 'price': f'R{result.get('startingPrice').get('p_pl10')}',
                 'promotion_price': result.get('attributes', {}).get('PROMOTION', 'No promo'),
@@ -149,6 +149,26 @@ class Scraper:
 
         return df, page_end
 
+    # Get the product records of a page
+    def get_records(self, response):
+        return response.get('contents')[0].get('mainContent')[0].get('contents')[0].get('records')
+
+    # Get the last page number of the category
+    def get_page_end(self, response):
+        count = response.get('contents')[0].get("secondaryContent")[0].get("categoryDimensions")[0].get("count")
+        page_end = count // 24
+        if count % 24 == 0:
+            page_end -= 1
+        return page_end
+
+    # Fingerprint a page from its product ids, prices and promotions
+    def fingerprint_page(self, response, offer_valid_sentence):
+        return page_fingerprint(offer_valid_sentence, [
+            (result.get('attributes', {}).get('p_displayName'), result.get('startingPrice'),
+             result.get('attributes', {}).get('PROMOTION'), result.get('attributes', {}).get('p_externalImageReference'))
+            for result in self.get_records(response)
+        ])
+
     # Request promotion information from Woolies' DailyDifference
     def request_offer_valid(self):
 
@@ -176,14 +196,13 @@ class Scraper:
 
         # Use a try except block to catch any exceptions
         try:
-            response = requests.get('https://www.woolworths.co.za/server/searchCategory', params=params, headers=headers)
+            with metrics.timer('fetch', 'Woolworths'):
+                response = controller.request('GET', 'https://www.woolworths.co.za/server/searchCategory', params=params, headers=headers)
+            metrics.add_bytes('fetch', 'Woolworths', len(response.content))
 
             # Response.ok is set to true if the response code is 200
             if response.ok:
 
-                # Print the response code to the terminal
-                print(response.status_code)
-
                 # Convert the response text to python dictionary
                 response = json.loads(response.text)
 
@@ -192,15 +211,15 @@ class Scraper:
 
             else:
 
-                # Print the response code to the terminal
-                print(response.status_code)
+                # Log the response code
+                log.warning(f"The offer valid request returned {response.status_code}.")
 
                 # Issue a sleep command for x seconds, settings in params
                 sleep(self.timeout)
-        except:
+        except Exception as e:
 
-            # Print the response code to the terminal
-            print("ERROR")
+            # Log the error
+            log.warning(f"The offer valid request failed: {e}")
 
             # Issue a sleep command for x seconds, settings in params
             sleep(self.timeout)
@@ -226,137 +245,60 @@ class Scraper:
 
         return results
 
-    def load_existing_data(self, csv_file):
-        """
-        Load existing product data from a CSV file and return it as a dictionary.
-
-        This function attempts to read the specified CSV file using UTF-8 encoding.
-        If UTF-8 fails, it falls back to 'latin1' encoding.
-        It logs warnings for any rows with missing (NaN) values in the file and
-        skips them in the returned data.
-
-        Args:
-            csv_file (str): The path to the CSV file to load.
-
-        Returns:
-            dict: A dictionary where keys are product names and values are dictionaries of
-                  product details.
-                Returns an empty dictionary if the file is not found or unreadable.
-        """
-        try:
-            # Try reading the CSV file with UTF-8 encoding first
-            df = pd.read_csv(csv_file, encoding='utf-8')
-        except UnicodeDecodeError:
-            # If UTF-8 fails, try an alternative encoding (e.g., 'latin1')
-            logging.info(f"Warning: Failed to read {csv_file} with UTF-8 encoding. Trying 'latin1'.")
-            df = pd.read_csv(csv_file, encoding='latin1')
-        except FileNotFoundError:
-            logging.info(f"Error: File {csv_file} not found.")
-            return {}
-
-        # Check for rows with NaN values and log them
-        rows_with_nan = df[df.isna().any(axis=1)]
-        if not rows_with_nan.empty:
-            logging.info(f"Warning: Found rows with NaN values:\n{rows_with_nan}")
-            # Replace NaN values with a single space ' '
-            df.fillna(' ', inplace=True)
-
-        # Convert the DataFrame to a dictionary
-        return {
-            row['name']: row.to_dict() for _, row in df.iterrows()
-        }
-
-
     def load_and_fix_duplicates(self, csv_file):
         """
-        Loads data from a CSV file, drops duplicate rows based on the 'name' and 'price' columns,
-        prioritizing rows with a valid 'promotion_price'. Additionally, if the first column ('index')
-        has duplicates, it removes them, recalculates their index, and reinserts them at the end.
+        Loads data from a CSV file and keeps one row per 'product_id', prioritizing rows with a
+        valid 'promotion_price'.
 
         Args:
             csv_file (str): The path to the CSV file.
 
         Returns:
-            pd.DataFrame: A DataFrame containing the cleaned and reindexed data.
+            pd.DataFrame: A DataFrame containing the cleaned data.
         """
         try:
             # Load the CSV file
             df = pd.read_csv(csv_file)
             original_count = len(df)
-            logging.info(f"Loaded {original_count} rows from {csv_file}.")
-
-            # Ensure the first column is named 'index' (if it's unnamed, rename it)
-            if df.columns[0] != 'index':
-                df.rename(columns={df.columns[0]: 'index'}, inplace=True)
-
-            # Step 1: Check for duplicate indexes
-            duplicate_indexes = df[df.duplicated(subset=['index'], keep=False)]
-            num_duplicates = len(duplicate_indexes)
+            log.info(f"Loaded {original_count} rows from {csv_file}.")
 
-            if num_duplicates > 0:
-                logging.info(f"Found {num_duplicates} duplicate index values.")
+            # Step 1: Fill in product IDs for rows written without one
+            df = ensure_product_ids(df)
 
-                # Step 2: Save duplicates in a list and remove them from the original DataFrame
-                duplicate_rows = duplicate_indexes.copy()
-                df = df.drop(duplicate_indexes.index)
+            # Step 2: Parse prices to cents and validity texts to dates, and keep one row per product ID, prioritizing valid promotions
+            df = annotate_validity(annotate_prices(df))
+            df['promo_priority'] = (df['promo_type'] == PROMO_NONE).astype(int)
+            df = df.sort_values(by=['product_id', 'promo_priority', 'price_cents'])
+            df = df.drop_duplicates(subset=['product_id'], keep='first').drop(columns=['promo_priority'])
 
-                # Step 3: Determine the new starting index
-                latest_index = max(df['index'].max() if not df['index'].empty else float('-inf'), 28999)
-                new_indexes = list(range(latest_index + 1, latest_index + 1 + num_duplicates))
-
-                # Step 4: Assign new indexes to duplicate rows
-                duplicate_rows['index'] = new_indexes
-
-                # Step 5: Append the fixed duplicates back into the DataFrame
-                df = pd.concat([df, duplicate_rows], ignore_index=True)
-                logging.info(f"Reinserted {num_duplicates} rows with new indexes starting from {latest_index + 1}.")
-
-            # Step 6: Remove duplicates based on 'name' and 'price', prioritizing valid promotion prices
-            df['promo_priority'] = df['promotion_price'].apply(lambda x: 0 if x != 'No promo' else 1)
-            df = df.sort_values(by=['name', 'price', 'promo_priority'])
-            df = df.drop_duplicates(subset=['name', 'price'], keep='first').drop(columns=['promo_priority'])
-
-            # Step 7: Save the cleaned DataFrame
+            # Step 3: Save the cleaned DataFrame
             df.to_csv(csv_file, index=False)
-            logging.info(f"Overwritten {csv_file} with cleaned data. Final row count: {len(df)}")
+            log.info(f"Overwritten {csv_file} with cleaned data. Final row count: {len(df)}")
 
             return df
 
         except Exception as e:
-            logging.error(f"Error processing data from {csv_file}: {e}")
+            log.error(f"Error processing data from {csv_file}: {e}")
             return pd.DataFrame()
 
 
-    def upsert_to_supabase(self, data, batch_size=500):
+    def upsert_to_supabase(self, data, batch_size=500, retailer='Woolworths', soft_delete_missing=SOFT_DELETE_MISSING):
         """
-        Upserts data to Supabase in batches.
+        Upserts the rows that are new or changed since the previous snapshot to Supabase in batches.
 
         Args:
-            data (list): A list of dictionaries containing the rows to be upserted.
-            batch_size (int): The number of rows to upsert in each batch (default: 500).
+            data (list): A list of dictionaries containing the scraped rows.
+            batch_size (int): The most rows in each concurrently sent batch (default: 500).
+            retailer (str): The retailer whose previous snapshot the rows are compared against.
+            soft_delete_missing (bool): Mark products that disappeared since the previous snapshot as inactive.
 
         Returns:
-            None
+            dict: The row counts per change classification and the rows that failed permanently.
         """
         from supabase import create_client
 
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-        try:
-            total_rows = len(data)
-            print(f"Total rows to upsert: {total_rows}")
-
-            for start in range(0, total_rows, batch_size):
-                end = start + batch_size
-                batch = data[start:end]
-                print(f"Upserting batch: {start + 1} to {end}")
-
-                response = supabase.table('Products').upsert(batch).execute()
-                print(f"Batch upsert response: {response}")
-
-        except Exception as e:
-            logging.error(f"Error upserting to Supabase: {e}")
-            print(f"Error upserting to Supabase: {e}")
+        log.info(f"Total rows scraped: {len(data)}", extra=CONSOLE)
+        return delta_upsert(lambda: create_client(SUPABASE_URL, SUPABASE_KEY), data, retailer, batch_size=batch_size, soft_delete_missing=soft_delete_missing)
 
 
     # Run function loops page numbers and calls request and process functions
@@ -365,71 +307,79 @@ class Scraper:
         # Set the starting page number
         page_number = 0
 
-        # Create an empty list to store the data
-        dfs = []
-
         # Get offer valid information
         try:
             offer_data = self.request_offer_valid()
             offer_valid_sentences = self.extract_offer_valid_sentences(offer_data)
-            print(f"Offer valid sentences: {offer_valid_sentences[0] if offer_valid_sentences else " "}")
+            log.info(f"Offer valid sentences: {offer_valid_sentences[0] if offer_valid_sentences else " "}", extra=CONSOLE)
         except Exception as e:
-            print(f"Error extracting offer valid sentences: {e}")
+            log.error(f"Error extracting offer valid sentences: {e}")
             offer_valid_sentences = " "
+        offer_valid_sentence = offer_valid_sentences[0] if offer_valid_sentences else " "
 
         # Increment through all the pages
         while True:
 
+            # Skip pages saved before the crawl was interrupted
+            page_key = f"{self.category}:{page_number}"
+            if self.checkpoint is not None and self.checkpoint.is_complete(page_key):
+                page_end = self.checkpoint.page_info(page_key)['page_end']
+                page_number += 1
+                if page_number > page_end:
+                    break
+                continue
+
             # Get response from the server
             response = self.request(page_number)
 
-            # Process the response and determine the total number of pages
-            current_df, page_end = self.process(response, offer_valid_sentences[0] if offer_valid_sentences else " ")
-
-            # Append the current page's DataFrame to the list of all pages
-            dfs.append(current_df)
-
-            # Concatenate all pages' data into a single DataFrame
-            df = pd.concat(dfs, ignore_index=True)
-
-            # Set the starting index to 29000 for the concatenated DataFrame
-            self.last_index = self.last_index if self.last_index else 29000
-            df.index = df.index + self.last_index
-            df.index.name = 'index'
-
-            # Apply the same index logic to the current DataFrame (`current_df`)
-            # Calculate its starting index based on the overall last index
-            current_start_index = self.last_index
-            current_df.index = range(current_start_index, current_start_index + len(current_df))
-            current_df.index.name = 'index'
-
-            # Remove rows with NaN values - This can be removed once error handling logic is added
-            current_df.dropna(inplace=True)
-
-            # Check if the file exists
-            file_exists = os.path.isfile('products_woolies.csv')
-
-            # Save the current page's DataFrame (with the correct index) to the CSV file
-            try:
-                current_df.to_csv(
-                    'products_woolies.csv',
-                    mode='a' if file_exists else 'w',
-                    header=not file_exists,  # Write header only if the file doesn't exist
-                    encoding='utf-8'
-                )
-                print(f"Page {page_number} data successfully saved to products_woolies.csv.")
-            except UnicodeEncodeError:
-                print("UTF-8 encoding failed. Retrying with 'latin1'.")
-                current_df.to_csv(
-                    'products_woolies.csv',
-                    mode='a' if file_exists else 'w',
-                    header=not file_exists,
-                    encoding='latin1'
-                )
+            # Reuse the previous run's records if the page is unchanged
+            fingerprint = self.fingerprint_page(response, offer_valid_sentence)
+            previous_records = self.fingerprints.unchanged(page_key, fingerprint) if self.fingerprints is not None else None
+            if previous_records is not None:
+                log.info(f"Page {page_number} of {self.category} is unchanged. Reusing {len(previous_records)} products.")
+                current_df, page_end = pd.DataFrame(previous_records), self.get_page_end(response)
+            else:
+                # Process the response and determine the total number of pages
+                with metrics.timer('parse', 'Woolworths'):
+                    current_df, page_end = self.process(response, offer_valid_sentence)
+
+            # Write the product ID as the first column
+            if not current_df.empty:
+                current_df = ensure_product_ids(current_df).set_index('product_id')
+
+            # Save the page and mark it complete in the checkpoint
+            with self.checkpoint.page(page_key, page_end=int(page_end)) if self.checkpoint is not None else nullcontext(), \
+                    metrics.timer('csv_write', 'Woolworths'):
+
+                # Check if the file exists
+                file_exists = os.path.isfile('products_woolies.csv')
+
+                # Save the current page's DataFrame to the CSV file
+                try:
+                    current_df.to_csv(
+                        'products_woolies.csv',
+                        mode='a' if file_exists else 'w',
+                        header=not file_exists,  # Write header only if the file doesn't exist
+                        encoding='utf-8'
+                    )
+                    log.info(f"Page {page_number} of {self.category} data successfully saved to products_woolies.csv.")
+                except UnicodeEncodeError:
+                    log.warning("UTF-8 encoding failed. Retrying with 'latin1'.")
+                    current_df.to_csv(
+                        'products_woolies.csv',
+                        mode='a' if file_exists else 'w',
+                        header=not file_exists,
+                        encoding='latin1'
+                    )
+
+            if self.fingerprints is not None and previous_records is None:
+                self.fingerprints.record(page_key, fingerprint, current_df.reset_index().to_dict('records'))
+            metrics.inc('scraper_pages_total', retailer='Woolworths', status='scraped' if previous_records is None else 'unchanged')
+            metrics.inc('scraper_products_total', len(current_df), retailer='Woolworths')
+            if self.progress is not None:
+                self.progress.add(pages=1, products=len(current_df))
 
             # Increment the page number
-            # Update the last index for the next run
-            self.last_index += len(current_df)
             page_number += 1
             sleep(5)  # Optional: Add delay to avoid rate-limiting
 
@@ -437,34 +387,52 @@ class Scraper:
             if page_number > page_end:
                 break
 
-        # --- Deduplicate the CSV file before upsert ---
-        try:
-            dedup_df = pd.read_csv('products_woolies.csv', index_col=0, encoding='utf-8')
-        except UnicodeDecodeError:
-            print("Warning: UTF-8 encoding failed during deduplication, trying 'latin1'.")
-            dedup_df = pd.read_csv('products_woolies.csv', index_col=0, encoding='latin1')
-        original_count = len(dedup_df)
-        # Drop duplicates based on 'name' and 'price' columns, keeping the first occurrence
-        dedup_df.drop_duplicates(subset=['name', 'price'], keep='first', inplace=True)
-        deduped_count = len(dedup_df)
-        logging.info(f"Dropped {original_count - deduped_count} duplicate rows. {deduped_count} rows remain in products_woolies.csv.")
-        dedup_df.to_csv('products_woolies.csv', encoding='utf-8')
-        # --- End deduplication ---
-
-        # Load data from the updated CSV
-        self.load_and_fix_duplicates('products_woolies.csv')
-        new_data = self.load_existing_data('products_woolies.csv')
-
-        # Filter new_data to include only rows where 'retailer' == 'Woolworths'
-        filtered_data = {name: details for name, details in new_data.items() if details.get('retailer') == 'Woolworths'}
+    # Publish function cleans the combined CSV of all categories and upserts it once
+    def publish(self):
+
+        # Deduplicate on product ID and load data from the updated CSV
+        with metrics.timer('dedup', 'Woolworths'):
+            self.load_and_fix_duplicates('products_woolies.csv')
+
+        # Nothing is published if the output fails the quality gate
+        if not quality_gate('Woolworths', 'products_woolies.csv').passed:
+            return
+        # One row per product ID, so products that share a name are all published
+        rows = rows_to_publish('products_woolies.csv', 'Woolworths')
 
         # Upsert the data to Supabase
         try:
-            self.upsert_to_supabase(list(filtered_data.values()))
-            print(f"Scraping complete. {len(filtered_data.values())} products scraped and saved to products_woolies.csv.")
+            with metrics.timer('upsert', 'Woolworths'):
+                self.upsert_to_supabase(rows)
+            log.info(f"Scraping complete. {len(rows)} products scraped and saved to products_woolies.csv.", extra=CONSOLE)
         except Exception as e:
-            print(f"Error during Supabase upsert: {e}")
-        logging.info("Scraping process complete.")
+            log.error(f"Error during Supabase upsert: {e}")
+        log.info("Scraping process complete.")
+
+
+def main(resume=False):
+    """
+    Scrape every category into products_woolies.csv, then deduplicate and upsert the whole file once.
+
+    Args:
+    resume (bool): Continue the last interrupted crawl from its checkpoint.
+    """
+    checkpoint = CrawlCheckpoint('Woolworths', 'products_woolies.csv')
+    checkpoint.begin(resume=resume)
+    fingerprints = PageFingerprintStore('Woolworths') if INCREMENTAL_CRAWL else None
+    progress = Progress(log)
+
+    for category, code in categories.items():
+        # Create a new instance of the Scraper class and call the run function
+        scraper = Scraper(params, category, code, fingerprints, checkpoint, progress)
+        scraper.run()
+    progress.done()
+
+    if fingerprints is not None:
+        fingerprints.save()
+    checkpoint.finish()
+    scraper.publish()
+    metrics.write('Woolworths')
 
 
 # Define a parameters dictionary to be passed to the class on construction
@@ -492,13 +460,20 @@ categories = {
     'Pets': 'l1demz',
 }
 
-# Create a new instance of the Scraper class
-last_index = 0
-for category, code in categories.items():
-    scraper = Scraper(params, category, code, last_index)
-
-    # Call the run function
-    scraper.run()
-    last_index = scraper.last_index
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape product information from the Woolworths website.")
+    parser.add_argument("--resume", action="store_true", help="Continue the last interrupted crawl from its checkpoint")
+    parser.add_argument("--profile", action="store_true", help="Write a sampling profile of the run to profiles/")
+    parser.add_argument("--memory-report", action="store_true", help="Trace allocations and write the top allocation sites to profiles/")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="Level of the Woolworths log (default: INFO)")
+    parser.add_argument("--log-json", action="store_true", help="Also write the log as JSON lines to logs/")
+    args = parser.parse_args()
+
+    setup_logging('woolies', json_lines=args.log_json)
+    if args.log_level:
+        log.setLevel(args.log_level)
+
+    with profiled('Woolworths', enabled=args.profile), memory_report('Woolworths', enabled=args.memory_report):
+        main(resume=args.resume)
 
 # Woolies doesn't display offer valid dates - only shown in the picture!
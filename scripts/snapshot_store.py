@@ -0,0 +1,296 @@
+import argparse
+import glob
+import hashlib
+import importlib.util
+import io
+import json
+import logging
+import os
+import re
+import zlib
+from datetime import datetime
+
+ZSTD_AVAILABLE = importlib.util.find_spec('zstandard') is not None
+
+BACKUP_FOLDER = "backup"
+INDEX_FILE = "snapshots.json"
+# The newest snapshot, kept uncompressed as the base of the next diff and for readers of the latest backup
+HEAD_FILE = "latest.csv"
+# Every this many snapshots is stored in full, so a restore applies at most this many minus one diffs
+KEYFRAME_INTERVAL = 7
+# A diff that changes more than this share of the lines is stored as a keyframe instead
+MAX_CHANGED_SHARE = 0.5
+# zstd level 19 compresses a catalogue about a fifth better than zlib level 9
+ZSTD_LEVEL = 19
+ZLIB_LEVEL = 9
+
+_TIMESTAMP_FORMAT = '%Y-%m-%d_%H-%M-%S'
+_LEGACY_PATTERN = re.compile(r'products_(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})\.csv$')
+
+
+def _compress(data):
+    """Compress with zstd if the zstandard package is installed, zlib otherwise. Returns (codec, bytes)."""
+    if ZSTD_AVAILABLE:
+        import zstandard
+        return 'zstd', zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return 'zlib', zlib.compress(data, ZLIB_LEVEL)
+
+
+def _decompress(codec, data):
+    if codec == 'zstd':
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError("This snapshot is zstd-compressed. Install zstandard to read it: pip install zstandard")
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def _lines(data):
+    # Splitting on '\n' is lossless whatever the CSV quoting, so joining restores the exact bytes
+    return data.decode('utf-8', 'surrogateescape').split('\n')
+
+
+def _join(lines):
+    return '\n'.join(lines).encode('utf-8', 'surrogateescape')
+
+
+def diff_lines(old_lines, new_lines):
+    """
+    Encode new_lines against old_lines.
+
+    Returns:
+        tuple: The ops, where [start, count] copies count old lines from start and a string is a
+        new line, and the number of new lines that are not in old_lines.
+    """
+    positions = {}
+    for index, line in enumerate(old_lines):
+        positions.setdefault(line, index)
+    ops, added = [], 0
+    for line in new_lines:
+        position = positions.get(line)
+        if position is None:
+            ops.append(line)
+            added += 1
+        elif ops and isinstance(ops[-1], list) and sum(ops[-1]) == position:
+            ops[-1][1] += 1
+        else:
+            ops.append([position, 1])
+    return ops, added
+
+
+def apply_diff(old_lines, ops):
+    lines = []
+    for op in ops:
+        if isinstance(op, str):
+            lines.append(op)
+        else:
+            lines.extend(old_lines[op[0]:op[0] + op[1]])
+    return lines
+
+
+class SnapshotStore:
+    """
+    Daily copies of products.csv, each stored as a compressed diff against the previous one.
+
+    Consecutive snapshots share almost all of their rows. A diff lists the runs of lines it
+    copies from the previous snapshot and the lines that are new, so an unchanged catalogue
+    costs a few bytes per run of rows. Every KEYFRAME_INTERVAL-th snapshot, and any snapshot
+    that changed more than MAX_CHANGED_SHARE of its lines, is a keyframe: the whole file,
+    compressed. A restore starts at the nearest keyframe and applies the diffs after it, then
+    checks the result against the snapshot's SHA-1.
+
+    The index of snapshots is kept in 'snapshots.json', and the newest snapshot is also kept
+    uncompressed as 'latest.csv'.
+    """
+
+    def __init__(self, folder=BACKUP_FOLDER):
+        self.folder = folder
+        self.index_path = os.path.join(folder, INDEX_FILE)
+        self.head_path = os.path.join(folder, HEAD_FILE)
+        self.snapshots = []
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding='utf-8') as f:
+                self.snapshots = json.load(f)['snapshots']
+
+    def _save_index(self):
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'snapshots': self.snapshots}, f, indent=1)
+        os.replace(tmp_path, self.index_path)
+
+    def _write(self, path, data):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _read_entry(self, entry):
+        with open(os.path.join(self.folder, entry['file']), 'rb') as f:
+            return _decompress(entry['codec'], f.read())
+
+    def _head_lines(self):
+        """Return the lines of the newest snapshot, from latest.csv if it is intact."""
+        entry = self.snapshots[-1]
+        if os.path.exists(self.head_path):
+            with open(self.head_path, 'rb') as f:
+                data = f.read()
+            if hashlib.sha1(data).hexdigest() == entry['sha1']:
+                return _lines(data)
+            logging.warning(f"{self.head_path} does not match snapshot {entry['timestamp']}. Rebuilding it.")
+        return _lines(self.read(entry['timestamp']))
+
+    def add(self, csv_file, timestamp=None):
+        """
+        Store a copy of csv_file as the newest snapshot.
+
+        Args:
+            csv_file (str): The file to back up.
+            timestamp (str): The snapshot's timestamp, YYYY-MM-DD_HH-MM-SS (default: now).
+
+        Returns:
+            dict: The snapshot's index entry.
+        """
+        timestamp = timestamp or datetime.now().strftime(_TIMESTAMP_FORMAT)
+        if self.snapshots and timestamp <= self.snapshots[-1]['timestamp']:
+            raise ValueError(f"Snapshot {timestamp} is not newer than the latest snapshot {self.snapshots[-1]['timestamp']}.")
+        with open(csv_file, 'rb') as f:
+            data = f.read()
+        lines = _lines(data)
+
+        kind, payload = 'key', data
+        since_keyframe = next((position for position, entry in enumerate(reversed(self.snapshots)) if entry['kind'] == 'key'), None)
+        if since_keyframe is not None and since_keyframe + 1 < KEYFRAME_INTERVAL:
+            ops, added = diff_lines(self._head_lines(), lines)
+            if added <= MAX_CHANGED_SHARE * len(lines):
+                kind, payload = 'diff', json.dumps(ops, ensure_ascii=False, separators=(',', ':')).encode('utf-8', 'surrogateescape')
+
+        codec, compressed = _compress(payload)
+        entry = {
+            'timestamp': timestamp,
+            'kind': kind,
+            'file': f"products_{timestamp}.{kind}.{codec}",
+            'codec': codec,
+            'sha1': hashlib.sha1(data).hexdigest(),
+            'rows': max(len(lines) - 2, 0) if data.endswith(b'\n') else max(len(lines) - 1, 0),
+            'raw_bytes': len(data),
+            'stored_bytes': len(compressed),
+        }
+        os.makedirs(self.folder, exist_ok=True)
+        self._write(os.path.join(self.folder, entry['file']), compressed)
+        self._write(self.head_path, data)
+        self.snapshots.append(entry)
+        self._save_index()
+        logging.info(f"Snapshot {timestamp} stored as a {kind}: {len(data)} bytes in {len(compressed)} ({codec}).")
+        return entry
+
+    def find(self, timestamp):
+        """Return the newest snapshot whose timestamp starts with the given one, e.g. '2026-10-18'."""
+        matches = [entry for entry in self.snapshots if entry['timestamp'].startswith(timestamp)]
+        if not matches:
+            raise KeyError(f"No snapshot matches {timestamp}.")
+        return matches[-1]
+
+    def read(self, timestamp):
+        """Return the exact bytes of a snapshot."""
+        entry = self.find(timestamp)
+        position = self.snapshots.index(entry)
+        start = max(index for index in range(position + 1) if self.snapshots[index]['kind'] == 'key')
+        lines = _lines(self._read_entry(self.snapshots[start]))
+        for diff in self.snapshots[start + 1:position + 1]:
+            lines = apply_diff(lines, json.loads(self._read_entry(diff).decode('utf-8', 'surrogateescape')))
+        data = _join(lines)
+        if hashlib.sha1(data).hexdigest() != entry['sha1']:
+            raise ValueError(f"Snapshot {entry['timestamp']} failed its checksum.")
+        return data
+
+    def read_csv(self, timestamp):
+        """Return a snapshot as a DataFrame."""
+        import pandas as pd
+        return pd.read_csv(io.BytesIO(self.read(timestamp)), encoding='utf-8')
+
+    def restore(self, timestamp, output_file):
+        """Write a snapshot to output_file. Returns the snapshot's index entry."""
+        entry = self.find(timestamp)
+        self._write(output_file, self.read(entry['timestamp']))
+        logging.info(f"Restored snapshot {entry['timestamp']} to {output_file}.")
+        return entry
+
+    def latest(self):
+        """Return the path and timestamp of the newest snapshot as a CSV file, or (None, None)."""
+        if not self.snapshots:
+            return None, None
+        entry = self.snapshots[-1]
+        if not os.path.exists(self.head_path):
+            self._write(self.head_path, self.read(entry['timestamp']))
+        return self.head_path, entry['timestamp']
+
+    def import_legacy(self, remove=True):
+        """
+        Add the plain products_<timestamp>.csv backups to the store, oldest first.
+
+        Backups older than the newest snapshot are left as they are.
+
+        Returns:
+            int: The number of backups imported.
+        """
+        imported = 0
+        for path in sorted(glob.glob(os.path.join(self.folder, 'products_*.csv'))):
+            match = _LEGACY_PATTERN.search(os.path.basename(path))
+            if not match or (self.snapshots and match.group(1) <= self.snapshots[-1]['timestamp']):
+                continue
+            self.add(path, match.group(1))
+            if remove:
+                os.remove(path)
+            imported += 1
+        return imported
+
+
+def latest_backup(folder=BACKUP_FOLDER):
+    """
+    Return the newest backup of products.csv as a CSV path, or None.
+
+    This is the store's newest snapshot, or a plain products_<timestamp>.csv from before the
+    store if that is newer.
+    """
+    path, timestamp = SnapshotStore(folder).latest()
+    legacy = sorted(glob.glob(os.path.join(folder, 'products_*.csv')))
+    if legacy:
+        match = _LEGACY_PATTERN.search(os.path.basename(legacy[-1]))
+        if path is None or (match and match.group(1) > timestamp):
+            return legacy[-1]
+    return path
+
+
+def _size(count):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if count < 1024 or unit == 'GB':
+            return f"{count:.0f} {unit}" if unit == 'B' else f"{count:.1f} {unit}"
+        count /= 1024
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compressed, deduplicated backups of products.csv.")
+    parser.add_argument("--folder", default=BACKUP_FOLDER, help=f"Backup folder (default: {BACKUP_FOLDER})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="List the snapshots and the space they take")
+    restore_parser = commands.add_parser("restore", help="Restore a snapshot")
+    restore_parser.add_argument("timestamp", help="Timestamp or its prefix, e.g. 2026-10-18 for that day's last snapshot")
+    restore_parser.add_argument("--output", default="products_restored.csv", help="File to write (default: products_restored.csv)")
+    import_parser = commands.add_parser("import", help="Move plain products_<timestamp>.csv backups into the store")
+    import_parser.add_argument("--keep", action="store_true", help="Keep the plain backups after importing them")
+    args = parser.parse_args()
+
+    store = SnapshotStore(args.folder)
+    if args.command == "list":
+        for snapshot in store.snapshots:
+            print(f"{snapshot['timestamp']}  {snapshot['kind']:<4}  {snapshot['rows']:>8} rows  "
+                  f"{_size(snapshot['raw_bytes']):>9} -> {_size(snapshot['stored_bytes']):>9}")
+        raw = sum(snapshot['raw_bytes'] for snapshot in store.snapshots)
+        stored = sum(snapshot['stored_bytes'] for snapshot in store.snapshots)
+        if stored:
+            print(f"{len(store.snapshots)} snapshots: {_size(raw)} stored in {_size(stored)} ({raw / stored:.0f}x)")
+    elif args.command == "restore":
+        restored = store.restore(args.timestamp, args.output)
+        print(f"Restored snapshot {restored['timestamp']} ({restored['rows']} rows) to {args.output}.")
+    else:
+        print(f"Imported {store.import_legacy(remove=not args.keep)} backups.")
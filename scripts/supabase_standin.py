@@ -0,0 +1,259 @@
+import argparse
+import email.parser
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+# Any non-empty key is accepted by the stand-in
+STANDIN_KEY = "standin-service-role-key"
+
+
+class StandinState:
+    """
+    In-memory storage buckets, PostgREST tables and request statistics shared by all handler threads.
+    """
+
+    def __init__(self, latency_ms=0, jitter_ms=0, failure_rate=0.0, failure_status=503, primary_key='product_id'):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.primary_key = primary_key
+        self.lock = threading.RLock()
+        self.objects = {}
+        self.tables = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {'requests': 0, 'bytes_received': 0, 'bytes_sent': 0, 'failures_injected': 0, 'routes': {}}
+
+    def record(self, route, received, sent):
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['bytes_received'] += received
+            self.stats['bytes_sent'] += sent
+            self.stats['routes'][route] = self.stats['routes'].get(route, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return json.loads(json.dumps(self.stats))
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """
+    Implements the subset of the Supabase storage and PostgREST APIs used by the scrapers.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send(self, route, received, status, body=b'', content_type='application/json'):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+        self.state.record(route, received, len(body))
+
+    def _inject(self, route, received):
+        """Apply the configured latency and return True if this request should fail."""
+        state = self.state
+        delay = state.latency_ms + (random.uniform(0, state.jitter_ms) if state.jitter_ms else 0)
+        if delay:
+            time.sleep(delay / 1000)
+        if state.failure_rate and random.random() < state.failure_rate:
+            with state.lock:
+                state.stats['failures_injected'] += 1
+            self._send(route, received, state.failure_status,
+                       {'statusCode': str(state.failure_status), 'error': 'Injected', 'message': 'Injected failure'})
+            return True
+        return False
+
+    def _dispatch(self):
+        body = self._read_body()
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+        query = parse_qsl(url.query, keep_blank_values=True)
+
+        if parts[:1] == ['__stats']:
+            return self._send('stats', len(body), 200, self.state.snapshot())
+        if parts[:1] == ['__reset']:
+            self.state.reset_stats()
+            return self._send('stats', len(body), 200, {})
+
+        if parts[:3] == ['storage', 'v1', 'object'] and len(parts) > 3:
+            if parts[3] == 'list' and self.command == 'POST':
+                route = 'storage.list'
+                if not self._inject(route, len(body)):
+                    self._storage_list(route, body, parts[4])
+                return
+            if parts[3] == 'public' and self.command in ('GET', 'HEAD'):
+                route = 'storage.public'
+                if not self._inject(route, len(body)):
+                    self._storage_get(route, body, parts[4], '/'.join(parts[5:]))
+                return
+            if self.command in ('POST', 'PUT'):
+                route = 'storage.upload'
+                if not self._inject(route, len(body)):
+                    self._storage_upload(route, body, parts[3], '/'.join(parts[4:]))
+                return
+
+        if parts[:2] == ['rest', 'v1'] and len(parts) == 3:
+            route = f"rest.{self.command.lower()}"
+            if not self._inject(route, len(body)):
+                self._rest(route, body, parts[2], query)
+            return
+
+        self._send('unknown', len(body), 404, {'message': f"No stand-in route for {self.command} {url.path}"})
+
+    do_GET = do_HEAD = do_POST = do_PUT = do_PATCH = _dispatch
+
+    def _storage_list(self, route, body, bucket):
+        options = json.loads(body or b'{}')
+        prefix = options.get('prefix', '').strip('/')
+        prefix = f"{prefix}/" if prefix else ''
+        limit = int(options.get('limit', 100))
+        offset = int(options.get('offset', 0))
+        descending = options.get('sortBy', {}).get('order') == 'desc'
+
+        with self.state.lock:
+            names = [path[len(prefix):] for (b, path) in self.state.objects
+                     if b == bucket and path.startswith(prefix) and '/' not in path[len(prefix):]]
+        names.sort(reverse=descending)
+        files = [{'name': name, 'id': f"{bucket}/{prefix}{name}", 'metadata': {}} for name in names[offset:offset + limit]]
+        self._send(route, len(body), 200, files)
+
+    def _storage_get(self, route, body, bucket, path):
+        with self.state.lock:
+            content = self.state.objects.get((bucket, path))
+        if content is None:
+            return self._send(route, len(body), 400, {'statusCode': '404', 'error': 'not_found', 'message': 'Object not found'})
+        self._send(route, len(body), 200, content, content_type='application/octet-stream')
+
+    def _storage_upload(self, route, body, bucket, path):
+        content = body
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('multipart/form-data'):
+            message = email.parser.BytesParser().parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode('utf-8') + body)
+            for part in message.get_payload() if message.is_multipart() else []:
+                if part.get_param('name', header='content-disposition') == 'file':
+                    content = part.get_payload(decode=True)
+
+        upsert = self.command == 'PUT' or self.headers.get('x-upsert', '').lower() == 'true'
+        with self.state.lock:
+            exists = (bucket, path) in self.state.objects
+            if not exists or upsert:
+                self.state.objects[(bucket, path)] = content
+        if exists and not upsert:
+            return self._send(route, len(body), 400,
+                              {'statusCode': '409', 'error': 'Duplicate', 'message': 'The resource already exists'})
+        self._send(route, len(body), 200, {'Key': f"{bucket}/{path}", 'Id': f"{bucket}/{path}"})
+
+    def _matches(self, row, filters):
+        for column, condition in filters:
+            value = str(row.get(column))
+            operator, _, operand = condition.partition('.')
+            if operator == 'eq' and value != operand:
+                return False
+            if operator == 'in':
+                options = [option.strip().strip('"') for option in operand.strip('()').split(',')]
+                if value not in options:
+                    return False
+        return True
+
+    def _rest(self, route, body, table, query):
+        params = dict(query)
+        filters = [(column, condition) for column, condition in query
+                   if column not in ('select', 'on_conflict', 'columns', 'limit', 'offset', 'order')]
+        prefer = self.headers.get('Prefer', '')
+        representation = 'return=representation' in prefer
+
+        with self.state.lock:
+            rows = self.state.tables.setdefault(table, {})
+
+            if self.command == 'GET':
+                result = [row for row in rows.values() if self._matches(row, filters)]
+                status = 200
+            elif self.command == 'POST':
+                payload = json.loads(body or b'[]')
+                payload = payload if isinstance(payload, list) else [payload]
+                key = params.get('on_conflict', self.state.primary_key)
+                merge = 'resolution=merge-duplicates' in prefer
+                for row in payload:
+                    row_key = str(row.get(key))
+                    if row_key in rows and not merge:
+                        conflict = {'code': '23505', 'message': f'duplicate key value violates unique constraint on "{key}"'}
+                        return self._send(route, len(body), 409, conflict)
+                    rows[row_key] = dict(rows.get(row_key, {}), **row) if merge else row
+                result = payload
+                status = 201
+            elif self.command == 'PATCH':
+                changes = json.loads(body or b'{}')
+                result = []
+                for row in rows.values():
+                    if self._matches(row, filters):
+                        row.update(changes)
+                        result.append(row)
+                status = 200
+            else:
+                return self._send(route, len(body), 405, {'message': 'Method not supported by the stand-in'})
+
+        self._send(route, len(body), status, result if representation or self.command == 'GET' else b'')
+
+
+def start_server(host='127.0.0.1', port=0, **options):
+    """
+    Start the stand-in on a background thread.
+
+    Args:
+        host (str): The interface to listen on.
+        port (int): The port to listen on. 0 picks a free port.
+        **options: Passed to StandinState (latency_ms, jitter_ms, failure_rate, failure_status, primary_key).
+
+    Returns:
+        tuple: (server, base URL). Call server.shutdown() to stop it; server.state holds the statistics.
+    """
+    state = StandinState(**options)
+    handler = type('BoundStandinHandler', (StandinHandler,), {'state': state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Supabase storage and PostgREST APIs.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Interface to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=54321, help="Port to listen on (default: 54321)")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Delay added to every request in milliseconds")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Random extra delay of up to this many milliseconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of requests answered with --failure-status")
+    parser.add_argument("--failure-status", type=int, default=503, help="Status code of injected failures (default: 503)")
+    parser.add_argument("--primary-key", type=str, default="product_id", help="Column upserts conflict on (default: product_id)")
+    args = parser.parse_args()
+
+    server, url = start_server(args.host, args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                               failure_rate=args.failure_rate, failure_status=args.failure_status,
+                               primary_key=args.primary_key)
+    print(f"Supabase stand-in listening on {url} (key: {STANDIN_KEY}). Statistics at {url}/__stats")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,419 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from lazy_imports import lazy_import
+from log_setup import CONSOLE
+from snapshot_store import latest_backup
+
+pd = lazy_import('pandas')
+
+# Folder holding the per-retailer row hashes of the last successful upsert
+SNAPSHOT_FOLDER = "snapshots"
+# Folder daily_scrape.py moves the previous products.csv into
+BACKUP_FOLDER = "backup"
+
+# Primary key of the Products table and the columns that make up a row's content
+KEY_COLUMN = 'product_id'
+HASHED_COLUMNS = ['product_id', 'name', 'price', 'promotion_price', 'retailer', 'image_url', 'promotion_valid']
+# Columns that exist on the Products table. Columns only kept in the CSV outputs are not sent.
+PRODUCTS_TABLE_COLUMNS = ['product_id', 'name', 'price', 'promotion_price', 'retailer', 'image_url', 'promotion_valid']
+
+# Column flipped to False for products that disappeared from the retailer's catalogue
+SOFT_DELETE_COLUMN = 'is_active'
+
+# Bulk loader limits: batches sent concurrently, and the largest batch by payload and row count
+UPSERT_MAX_IN_FLIGHT = 4
+UPSERT_MAX_BATCH_BYTES = 512 * 1024
+UPSERT_MAX_BATCH_ROWS = 500
+# HTTP statuses a single row can cause (bad value, conflict, payload too large); only these split a batch
+UPSERT_ROW_ERROR_STATUSES = {400, 409, 413, 422}
+# HTTP statuses worth retrying; connection errors and timeouts are retried too
+UPSERT_TRANSIENT_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+def retailer_slug(retailer):
+    """Turn a retailer name such as 'Pick n Pay' into a file-name friendly slug."""
+    return re.sub(r'[^a-z0-9]+', '_', retailer.lower()).strip('_')
+
+
+def _normalize(value):
+    if value is None or (isinstance(value, float) and value != value):
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def row_key(row):
+    """
+    Identify a product within a retailer's catalogue.
+
+    Args:
+        row (dict): A product row.
+
+    Returns:
+        str: The row's product ID, or '<retailer>|<name>' for rows written before product IDs existed.
+    """
+    return _normalize(row.get(KEY_COLUMN)) or f"{_normalize(row.get('retailer'))}|{_normalize(row.get('name'))}"
+
+
+def row_keys(df):
+    """
+    Apply row_key to every row of a DataFrame.
+
+    Args:
+        df (pd.DataFrame): Product rows.
+
+    Returns:
+        list: The key of each row, in order.
+    """
+    columns = [column for column in (KEY_COLUMN, 'retailer', 'name') if column in df.columns]
+    return [row_key(row) for row in df[columns].to_dict('records')]
+
+
+def row_hash(row):
+    """
+    Hash the content of a product row so unchanged rows can be detected cheaply.
+
+    Args:
+        row (dict): A product row.
+
+    Returns:
+        str: A hex digest of the normalized hashed columns.
+    """
+    content = '\x1f'.join(_normalize(row.get(column)) for column in HASHED_COLUMNS)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def table_row(row):
+    """Keep only the columns of a row that exist on the Products table."""
+    return {column: row[column] for column in PRODUCTS_TABLE_COLUMNS if column in row}
+
+
+def hash_store_path(retailer):
+    return os.path.join(SNAPSHOT_FOLDER, f"{retailer_slug(retailer)}_hashes.json")
+
+
+def latest_backup_file(backup_folder=BACKUP_FOLDER):
+    """Return the newest backup of products.csv in the backup folder as a CSV path, or None."""
+    return latest_backup(backup_folder)
+
+
+def rows_to_publish(csv_file, retailer):
+    """
+    Read a retailer's deduplicated output as the rows to upsert, one per product ID.
+
+    Rows of other retailers are dropped and missing values become ' ', as in the scrapers'
+    load_existing_data. Unlike load_existing_data, which keys rows by name for the image
+    lookups, products that share a name stay separate rows.
+
+    Returns:
+        list: The rows as dictionaries.
+    """
+    try:
+        df = pd.read_csv(csv_file, encoding='utf-8')
+    except UnicodeDecodeError:
+        df = pd.read_csv(csv_file, encoding='latin1')
+    df = df[df['retailer'] == retailer].fillna(' ')
+    return df.drop_duplicates(subset=[KEY_COLUMN], keep='first').to_dict('records')
+
+
+def hashes_from_rows(rows):
+    """
+    Build a hash store from product rows.
+
+    Returns:
+        dict: Maps row key to [row hash, primary key value].
+    """
+    return {row_key(row): [row_hash(row), _normalize(row.get(KEY_COLUMN))] for row in rows}
+
+
+def load_previous_hashes(retailer, backup_folder=BACKUP_FOLDER):
+    """
+    Load the row hashes of the previous snapshot for a retailer.
+
+    The hash store written after the last successful upsert is preferred. When it does not
+    exist yet, the newest products.csv copy in the backup folder is hashed instead.
+
+    Args:
+        retailer (str): The retailer name as written in the 'retailer' column.
+        backup_folder (str): The folder written by backup_products_file.
+
+    Returns:
+        dict: Maps row key to [row hash, primary key value]. Empty if no snapshot exists.
+    """
+    path = hash_store_path(retailer)
+    if os.path.exists(path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not read hash store {path}: {e}. Falling back to backups.")
+
+    backup_file = latest_backup_file(backup_folder)
+    if not backup_file:
+        logging.info(f"No previous snapshot found for {retailer}. All rows will be treated as new.")
+        return {}
+
+    try:
+        df = pd.read_csv(backup_file, encoding='utf-8')
+    except UnicodeDecodeError:
+        df = pd.read_csv(backup_file, encoding='latin1')
+    df = df[df['retailer'] == retailer]
+    logging.info(f"Using {backup_file} as the previous snapshot for {retailer} ({len(df)} rows).")
+    return hashes_from_rows(df.to_dict('records'))
+
+
+def save_hashes(retailer, hashes):
+    """Atomically write the hash store for a retailer."""
+    os.makedirs(SNAPSHOT_FOLDER, exist_ok=True)
+    path = hash_store_path(retailer)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(hashes, f)
+    os.replace(tmp_path, path)
+
+
+def classify_rows(rows, previous_hashes):
+    """
+    Compare fresh rows against the previous snapshot.
+
+    Args:
+        rows (list): The freshly scraped product rows.
+        previous_hashes (dict): The hash store returned by load_previous_hashes.
+
+    Returns:
+        dict: 'new', 'changed' and 'unchanged' lists of rows, and 'disappeared', a dict of
+              row key to the primary key value the row had in the previous snapshot.
+    """
+    result = {'new': [], 'changed': [], 'unchanged': [], 'disappeared': {}}
+    seen = set()
+
+    for row in rows:
+        key = row_key(row)
+        seen.add(key)
+        previous = previous_hashes.get(key)
+        if previous is None:
+            result['new'].append(row)
+        elif previous[0] != row_hash(row):
+            result['changed'].append(row)
+        else:
+            result['unchanged'].append(row)
+
+    result['disappeared'] = {key: value[1] for key, value in previous_hashes.items() if key not in seen}
+    return result
+
+
+def build_batches(rows, max_batch_bytes=UPSERT_MAX_BATCH_BYTES, max_batch_rows=UPSERT_MAX_BATCH_ROWS):
+    """
+    Split rows into batches bounded by their JSON payload size.
+
+    Args:
+        rows (list): The rows to send.
+        max_batch_bytes (int): The largest payload a batch may serialize to.
+        max_batch_rows (int): The largest number of rows in a batch.
+
+    Returns:
+        list: A list of row lists.
+    """
+    batches = []
+    batch, batch_bytes = [], 2  # The enclosing '[]'
+    for row in rows:
+        row_bytes = len(json.dumps(row, default=str)) + 1
+        if batch and (batch_bytes + row_bytes > max_batch_bytes or len(batch) >= max_batch_rows):
+            batches.append(batch)
+            batch, batch_bytes = [], 2
+        batch.append(row)
+        batch_bytes += row_bytes
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _error_status(error):
+    """Return the HTTP status of an upsert error, or None if it has none, e.g. a connection error."""
+    status = getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+    # postgrest's APIError carries the status as its code when the response body was not JSON
+    code = getattr(error, 'code', None)
+    if status is None and str(code).isdigit() and len(str(code)) == 3:
+        status = int(code)
+    return status
+
+
+def is_row_error(error):
+    """
+    Return whether an upsert error can be caused by the rows of the batch, so sending smaller
+    batches can isolate the bad rows.
+
+    These are 400/409/413/422 responses and PostgreSQL data exceptions and constraint
+    violations (SQLSTATE classes 22 and 23). Connection errors, timeouts, 401/403 and 5xx
+    responses fail every batch alike.
+    """
+    status = _error_status(error)
+    if status is not None:
+        return status in UPSERT_ROW_ERROR_STATUSES
+    code = str(getattr(error, 'code', '') or '')
+    return code[:2] in ('22', '23') or code.startswith('PGRST1')
+
+
+def is_transient_error(error):
+    """Return whether an upsert error is worth retrying: a timeout, a connection error, 429 or a 5xx."""
+    status = _error_status(error)
+    if status is not None:
+        return status in UPSERT_TRANSIENT_STATUSES
+    return not is_row_error(error) and not getattr(error, 'code', None)
+
+
+def _upsert_batch(client_factory, local, table, batch, retries, backoff_factor):
+    if not hasattr(local, 'client'):
+        local.client = client_factory()
+
+    attempt = 0
+    while True:
+        try:
+            local.client.table(table).upsert(batch, on_conflict=KEY_COLUMN).execute()
+            return None
+        except Exception as e:
+            attempt += 1
+            if attempt >= retries or not is_transient_error(e):
+                return e
+            time.sleep(backoff_factor ** attempt)
+
+
+def bulk_upsert(client_factory, rows, table='Products', max_in_flight=UPSERT_MAX_IN_FLIGHT,
+                max_batch_bytes=UPSERT_MAX_BATCH_BYTES, max_batch_rows=UPSERT_MAX_BATCH_ROWS,
+                retries=3, backoff_factor=2):
+    """
+    Upserts rows with several batches in flight at once.
+
+    Batches are sized by payload bytes. Timeouts, connection errors, 429 and 5xx responses are
+    retried. A batch rejected for its rows (see is_row_error) is split in half and both halves
+    are sent again, so one bad row only fails on its own. Any other failure, such as an outage
+    or an auth error, would fail every batch, so the batches not yet sent are given up at once.
+
+    Args:
+        client_factory (callable): Returns a new Supabase client. Each worker thread creates its own.
+        rows (list): The rows to upsert.
+        table (str): The table to upsert into (default: 'Products').
+        max_in_flight (int): The most batches sent concurrently.
+        max_batch_bytes (int): The largest JSON payload of a batch.
+        max_batch_rows (int): The largest number of rows in a batch.
+        retries (int): Attempts per batch at transient errors.
+        backoff_factor (int): Base of the exponential sleep between attempts.
+
+    Returns:
+        dict: 'succeeded' rows, 'failed' rows with their 'errors', the number of 'batches'
+              completed, 'elapsed' seconds and 'rows_per_second'.
+    """
+    local = threading.local()
+    report = {'succeeded': [], 'failed': [], 'errors': [], 'batches': 0}
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max(1, max_in_flight)) as executor:
+        in_flight = {}
+
+        def submit(batch):
+            future = executor.submit(_upsert_batch, client_factory, local, table, batch, retries, backoff_factor)
+            in_flight[future] = batch
+
+        for batch in build_batches(rows, max_batch_bytes, max_batch_rows):
+            submit(batch)
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = in_flight.pop(future)
+                error = future.result()
+                report['batches'] += 1
+                if error is None:
+                    report['succeeded'].extend(batch)
+                elif not is_row_error(error):
+                    cancelled = [pending for pending, rows in list(in_flight.items()) if pending.cancel()]
+                    given_up = batch + [row for pending in cancelled for row in in_flight.pop(pending)]
+                    logging.error(f"Upsert failed ({error}). Giving up {len(given_up)} rows without sending the "
+                                  f"{len(cancelled)} remaining batches.")
+                    report['failed'].extend(given_up)
+                    report['errors'].append(str(error))
+                elif len(batch) > 1:
+                    middle = len(batch) // 2
+                    logging.warning(f"Batch of {len(batch)} rows rejected ({error}). Splitting and retrying.")
+                    submit(batch[:middle])
+                    submit(batch[middle:])
+                else:
+                    logging.error(f"Row {row_key(batch[0])} failed permanently: {error}")
+                    report['failed'].extend(batch)
+                    report['errors'].append(str(error))
+
+    report['elapsed'] = time.perf_counter() - started
+    report['rows_per_second'] = len(report['succeeded']) / report['elapsed'] if report['elapsed'] else 0.0
+    return report
+
+
+def delta_upsert(client_factory, data, retailer, batch_size=UPSERT_MAX_BATCH_ROWS, soft_delete_missing=False,
+                 table='Products', max_in_flight=UPSERT_MAX_IN_FLIGHT, max_batch_bytes=UPSERT_MAX_BATCH_BYTES):
+    """
+    Upserts only the new and changed rows of a retailer's catalogue to Supabase.
+
+    Only rows that were upserted successfully are written to the hash store, so rows that
+    failed are sent again on the next run.
+
+    Args:
+        client_factory (callable): Returns a new Supabase client, e.g. a call to supabase.create_client.
+        data (list): All product rows scraped for the retailer in this run.
+        retailer (str): The retailer name as written in the 'retailer' column.
+        batch_size (int): The most rows in each batch (default: 500).
+        soft_delete_missing (bool): Mark rows that disappeared since the previous snapshot as
+            inactive through SOFT_DELETE_COLUMN instead of leaving them untouched.
+        table (str): The table to upsert into (default: 'Products').
+        max_in_flight (int): The most batches sent concurrently.
+        max_batch_bytes (int): The largest JSON payload of a batch.
+
+    Returns:
+        dict: The row counts per classification, plus the rows that 'failed' permanently.
+    """
+    previous_hashes = load_previous_hashes(retailer)
+    delta = classify_rows(data, previous_hashes)
+    counts = {name: len(rows) for name, rows in delta.items()}
+    logging.info(f"{retailer} change detection: {counts}", extra=CONSOLE)
+
+    hashes = dict(previous_hashes)
+    if not soft_delete_missing:
+        for key in delta['disappeared']:
+            hashes.pop(key)
+    pending = [table_row(row) for row in delta['new'] + delta['changed']]
+    if soft_delete_missing:
+        pending = [dict(row, **{SOFT_DELETE_COLUMN: True}) for row in pending]
+    counts['failed'] = []
+
+    try:
+        report = bulk_upsert(client_factory, pending, table=table, max_in_flight=max_in_flight,
+                             max_batch_bytes=max_batch_bytes, max_batch_rows=batch_size)
+        hashes.update(hashes_from_rows(report['succeeded']))
+        counts['failed'] = report['failed']
+        summary = (f"Upserted {len(report['succeeded'])}/{len(pending)} {retailer} rows in "
+                   f"{report['elapsed']:.1f}s ({report['rows_per_second']:.0f} rows/s, "
+                   f"{report['batches']} batches, {len(report['failed'])} failed)")
+        logging.info(summary, extra=CONSOLE)
+
+        if soft_delete_missing and delta['disappeared']:
+            supabase = client_factory()
+            keys = [value for value in delta['disappeared'].values() if value != '']
+            for start in range(0, len(keys), batch_size):
+                supabase.table(table).update({SOFT_DELETE_COLUMN: False}).in_(KEY_COLUMN, keys[start:start + batch_size]).execute()
+            for key in delta['disappeared']:
+                hashes.pop(key)
+            logging.info(f"Soft-deleted {len(keys)} disappeared {retailer} rows.")
+
+    except Exception as e:
+        logging.error(f"Error upserting to Supabase: {e}")
+
+    finally:
+        save_hashes(retailer, hashes)
+
+    return counts
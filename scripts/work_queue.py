@@ -0,0 +1,769 @@
+import argparse
+import hmac
+import json
+import logging
+import os
+import secrets
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from crawl_checkpoint import CHECKPOINT_FOLDER
+from http_transport import sessions
+from lazy_imports import lazy_import
+from log_setup import CONSOLE, setup_logging
+from supabase_sync import retailer_slug, rows_to_publish
+
+pd = lazy_import('pandas')
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+QUEUE_FILE = os.path.join(CHECKPOINT_FOLDER, "work_queue.sqlite")
+# Seconds a worker holds a task; it renews the lease while the task runs, so this only
+# decides how soon the task of a worker that died is handed to another worker
+LEASE_SECONDS = 120
+# Runs of a task, lease expiries included, before it is given up as failed
+MAX_ATTEMPTS = 3
+# Seconds before a failed task is retried, doubled on each further attempt
+RETRY_BACKOFF_SECONDS = 30
+# Seconds an idle worker waits before asking for a task again
+POLL_SECONDS = 2
+# Seconds between progress lines while the coordinator waits for a run
+PROGRESS_SECONDS = 30
+# Port of the queue's HTTP front, for workers on other machines
+DEFAULT_PORT = 8765
+# Address the HTTP front listens on; pass --host 0.0.0.0 to let other machines reach it
+DEFAULT_HOST = "127.0.0.1"
+# Shared secret remote workers send in TOKEN_HEADER; copy it to every worker machine
+TOKEN_FILE = os.path.join(CHECKPOINT_FOLDER, "work_queue.token")
+TOKEN_HEADER = "X-Queue-Token"
+# Pick n Pay listing referer, as daily_scrape.py passes it to scrape_pnp.py
+PNP_REFERER_URL = "https://www.pnp.co.za/c/pnpbase"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    retailers TEXT NOT NULL,
+    created REAL NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    key TEXT PRIMARY KEY,
+    run_id TEXT NOT NULL,
+    retailer TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_expires REAL,
+    result TEXT,
+    error TEXT,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, available_at);
+CREATE INDEX IF NOT EXISTS tasks_run ON tasks (run_id, retailer, status);
+CREATE TABLE IF NOT EXISTS throttle (
+    retailer TEXT PRIMARY KEY,
+    last_lease REAL NOT NULL
+);
+"""
+
+
+class TaskDeferred(Exception):
+    """Raised by a task that can't run yet, e.g. outside the site's visit window; it does not use up an attempt."""
+
+    def __init__(self, message, retry_at):
+        super().__init__(message)
+        self.retry_at = retry_at
+
+
+def queue_token(path=TOKEN_FILE, create=False):
+    """
+    Return the shared token of the queue's HTTP front, read from path.
+
+    Args:
+        path (str): The token file.
+        create (bool): Write a new random token, readable only by this user, if the file does not exist.
+
+    Raises:
+        FileNotFoundError: If the file does not exist and create is not set.
+    """
+    if create and not os.path.exists(path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_urlsafe(32))
+    with open(path) as f:
+        return f.read().strip()
+
+
+def task_key(run_id, retailer, payload):
+    """Return the key that deduplicates a task within a run."""
+    return f"{run_id}:{retailer_slug(retailer)}:{json.dumps(payload, sort_keys=True)}"
+
+
+class WorkQueue:
+    """
+    A durable queue of page tasks in SQLite, shared by any number of worker processes.
+
+    A worker leases a task for lease_seconds and renews the lease while it runs. A task whose
+    lease expires, because its worker died or lost its connection, is handed to the next
+    worker that asks, until it has used up MAX_ATTEMPTS. Tasks are keyed by run, retailer and
+    payload, so enqueuing a task twice adds it once, and only the first result reported for
+    a task is kept, so a task that ran twice after a lease expired is still counted once.
+
+    Retailers with a crawl delay are leased at most once per delay across all workers.
+    The database runs in WAL mode and every change is a short IMMEDIATE transaction, so
+    processes on this machine share it directly; other machines go through serve().
+    """
+
+    def __init__(self, path=QUEUE_FILE, min_intervals=None):
+        self.path = path
+        self.min_intervals = min_intervals if min_intervals is not None else \
+            {retailer: tasks.min_interval for retailer, tasks in RETAILER_TASKS.items() if tasks.min_interval}
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db().executescript(_SCHEMA)
+
+    def _db(self):
+        # sqlite3 connections can't be shared between threads, so each thread opens its own
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def new_run(self, retailers):
+        """
+        Start a run of the given retailers and cancel the unfinished tasks of earlier runs.
+
+        Returns:
+            str: The run ID.
+        """
+        run_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        now = time.time()
+        with self._transaction() as db:
+            db.execute("UPDATE tasks SET status = 'cancelled', updated = ? WHERE status IN ('pending', 'leased')", (now,))
+            db.execute("UPDATE runs SET finished = ? WHERE finished IS NULL", (now,))
+            db.execute("INSERT INTO runs (run_id, retailers, created) VALUES (?, ?, ?)", (run_id, json.dumps(retailers), now))
+        return run_id
+
+    def enqueue(self, run_id, retailer, payloads):
+        """
+        Add tasks to a run, skipping any the run already has.
+
+        Returns:
+            int: The number of tasks added.
+        """
+        now = time.time()
+        rows = [(task_key(run_id, retailer, payload), run_id, retailer, json.dumps(payload), now) for payload in payloads]
+        with self._transaction() as db:
+            before = db.total_changes
+            db.executemany("INSERT OR IGNORE INTO tasks (key, run_id, retailer, payload, updated) VALUES (?, ?, ?, ?, ?)", rows)
+            added = db.total_changes - before
+        return added
+
+    def lease(self, worker, retailers=None, lease_seconds=LEASE_SECONDS):
+        """
+        Lease the next task that is due, or one whose lease has expired.
+
+        Args:
+            worker (str): The worker's ID.
+            retailers (list): Only lease tasks of these retailers (default: all).
+            lease_seconds (float): How long the lease lasts unless renewed.
+
+        Returns:
+            dict: The task's 'key', 'run_id', 'retailer', 'payload' and 'attempts', or None if no task is due.
+        """
+        now = time.time()
+        with self._transaction() as db:
+            # Tasks whose lease expired on their last attempt are given up
+            db.execute("UPDATE tasks SET status = 'failed', error = 'lease expired', updated = ? "
+                       "WHERE status = 'leased' AND lease_expires <= ? AND attempts >= ?", (now, now, MAX_ATTEMPTS))
+            throttled = [row['retailer'] for row in db.execute("SELECT retailer, last_lease FROM throttle")
+                         if now - row['last_lease'] < self.min_intervals.get(row['retailer'], 0)]
+            query = ("SELECT key, run_id, retailer, payload, attempts FROM tasks "
+                     "WHERE ((status = 'pending' AND available_at <= ?) OR (status = 'leased' AND lease_expires <= ?))")
+            params = [now, now]
+            if retailers is not None:
+                query += f" AND retailer IN ({', '.join('?' * len(retailers))})"
+                params += list(retailers)
+            if throttled:
+                query += f" AND retailer NOT IN ({', '.join('?' * len(throttled))})"
+                params += throttled
+            row = db.execute(query + " ORDER BY available_at, rowid LIMIT 1", params).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE tasks SET status = 'leased', attempts = attempts + 1, worker = ?, lease_expires = ?, updated = ? "
+                       "WHERE key = ?", (worker, now + lease_seconds, now, row['key']))
+            if row['retailer'] in self.min_intervals:
+                db.execute("INSERT OR REPLACE INTO throttle (retailer, last_lease) VALUES (?, ?)", (row['retailer'], now))
+        return {'key': row['key'], 'run_id': row['run_id'], 'retailer': row['retailer'],
+                'payload': json.loads(row['payload']), 'attempts': row['attempts'] + 1}
+
+    def renew(self, key, worker, lease_seconds=LEASE_SECONDS):
+        """Extend a lease the worker still holds. Returns False if the lease was lost."""
+        now = time.time()
+        with self._transaction() as db:
+            cursor = db.execute("UPDATE tasks SET lease_expires = ?, updated = ? WHERE key = ? AND status = 'leased' AND worker = ?",
+                                (now + lease_seconds, now, key, worker))
+        return cursor.rowcount == 1
+
+    def complete(self, key, worker, result):
+        """
+        Record a task's result, unless another run of the task has already reported one.
+
+        Returns:
+            bool: True if this result was recorded.
+        """
+        now = time.time()
+        with self._transaction() as db:
+            cursor = db.execute("UPDATE tasks SET status = 'done', worker = ?, result = ?, error = NULL, updated = ? "
+                                "WHERE key = ? AND status IN ('pending', 'leased')", (worker, json.dumps(result), now, key))
+        return cursor.rowcount == 1
+
+    def fail(self, key, worker, error):
+        """
+        Record a failed attempt; the task is retried after a backoff until it has used up MAX_ATTEMPTS.
+
+        Returns:
+            str: The task's new status, or None if the worker no longer held the lease.
+        """
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute("SELECT attempts FROM tasks WHERE key = ? AND status = 'leased' AND worker = ?", (key, worker)).fetchone()
+            if row is None:
+                return None
+            status = 'failed' if row['attempts'] >= MAX_ATTEMPTS else 'pending'
+            db.execute("UPDATE tasks SET status = ?, available_at = ?, error = ?, updated = ? WHERE key = ?",
+                       (status, now + RETRY_BACKOFF_SECONDS * 2 ** (row['attempts'] - 1), str(error), now, key))
+        return status
+
+    def release(self, key, worker, retry_at):
+        """Hand a leased task back without using up an attempt, to be run again from retry_at."""
+        now = time.time()
+        with self._transaction() as db:
+            db.execute("UPDATE tasks SET status = 'pending', attempts = attempts - 1, available_at = ?, updated = ? "
+                       "WHERE key = ? AND status = 'leased' AND worker = ?", (retry_at, now, key, worker))
+
+    def counts(self, run_id=None):
+        """
+        Return the number of tasks per retailer and status, of one run or of every unfinished run.
+
+        Returns:
+            dict: {retailer: {status: count}}.
+        """
+        if run_id is None:
+            rows = self._db().execute("SELECT retailer, status, COUNT(*) AS n FROM tasks WHERE run_id IN "
+                                      "(SELECT run_id FROM runs WHERE finished IS NULL) GROUP BY retailer, status")
+        else:
+            rows = self._db().execute("SELECT retailer, status, COUNT(*) AS n FROM tasks WHERE run_id = ? "
+                                      "GROUP BY retailer, status", (run_id,))
+        counts = {}
+        for row in rows:
+            counts.setdefault(row['retailer'], {})[row['status']] = row['n']
+        return counts
+
+    def results(self, run_id, retailer):
+        """Yield the result of every completed task of a retailer in a run."""
+        rows = self._db().execute("SELECT result FROM tasks WHERE run_id = ? AND retailer = ? AND status = 'done' ORDER BY rowid",
+                                  (run_id, retailer))
+        for row in rows:
+            yield json.loads(row['result'])
+
+    def failures(self, run_id, retailer):
+        """Return the payload and last error of every task of a retailer in a run that was given up."""
+        rows = self._db().execute("SELECT payload, error FROM tasks WHERE run_id = ? AND retailer = ? AND status = 'failed'",
+                                  (run_id, retailer))
+        return [(json.loads(row['payload']), row['error']) for row in rows]
+
+    def finish_run(self, run_id):
+        with self._transaction() as db:
+            db.execute("UPDATE runs SET finished = ? WHERE run_id = ?", (time.time(), run_id))
+
+    def latest_run(self, unfinished=False):
+        query = "SELECT run_id FROM runs" + (" WHERE finished IS NULL" if unfinished else "") + " ORDER BY created DESC LIMIT 1"
+        row = self._db().execute(query).fetchone()
+        return row['run_id'] if row else None
+
+
+class RemoteQueue:
+    """The worker side of WorkQueue, for workers on another machine talking to serve() with its token."""
+
+    def __init__(self, url, token):
+        self.url = url.rstrip('/')
+        self.token = token
+
+    def _call(self, method, **arguments):
+        response = sessions.session(self.url).post(f"{self.url}/{method}", json=arguments, timeout=60,
+                                                   headers={TOKEN_HEADER: self.token})
+        response.raise_for_status()
+        return response.json()
+
+    def lease(self, worker, retailers=None, lease_seconds=LEASE_SECONDS):
+        return self._call('lease', worker=worker, retailers=retailers, lease_seconds=lease_seconds)
+
+    def renew(self, key, worker, lease_seconds=LEASE_SECONDS):
+        return self._call('renew', key=key, worker=worker, lease_seconds=lease_seconds)
+
+    def complete(self, key, worker, result):
+        return self._call('complete', key=key, worker=worker, result=result)
+
+    def fail(self, key, worker, error):
+        return self._call('fail', key=key, worker=worker, error=error)
+
+    def release(self, key, worker, retry_at):
+        return self._call('release', key=key, worker=worker, retry_at=retry_at)
+
+    def enqueue(self, run_id, retailer, payloads):
+        return self._call('enqueue', run_id=run_id, retailer=retailer, payloads=payloads)
+
+    def counts(self, run_id=None):
+        return self._call('counts', run_id=run_id)
+
+
+class QueueHandler(BaseHTTPRequestHandler):
+    """
+    Exposes the worker side of a WorkQueue as POST /<method> with the arguments as a JSON object.
+
+    Requests without the queue's token in TOKEN_HEADER are refused before their body is read.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    queue = None
+    token = None
+    methods = ('lease', 'renew', 'complete', 'fail', 'release', 'enqueue', 'counts')
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        method = self.path.strip('/')
+        if not self.token or not hmac.compare_digest(self.headers.get(TOKEN_HEADER, '').encode('utf-8'), self.token.encode('utf-8')):
+            logging.warning(f"Refused work queue request {method} from {self.client_address[0]}: missing or wrong token.")
+            self.close_connection = True
+            return self._send(401, {'error': 'missing or wrong token'})
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            arguments = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._send(400, {'error': 'invalid JSON'})
+        if method not in self.methods:
+            return self._send(404, {'error': f"unknown method {method}"})
+        try:
+            self._send(200, getattr(self.queue, method)(**arguments))
+        except Exception as e:
+            logging.error(f"Work queue request {method} failed: {e}")
+            self._send(500, {'error': str(e)})
+
+
+def serve(queue, host=DEFAULT_HOST, port=DEFAULT_PORT, token=None):
+    """
+    Serve the queue to workers on other machines from a background thread.
+
+    Args:
+        queue (WorkQueue): The queue to serve.
+        host (str): Address to listen on; only this machine can connect by default.
+        port (int): Port to listen on.
+        token (str): Token workers must send (default: the one in TOKEN_FILE, created if missing).
+
+    Returns:
+        ThreadingHTTPServer: The server; call shutdown() to stop it.
+    """
+    token = token or queue_token(create=True)
+    handler = type('BoundQueueHandler', (QueueHandler,), {'queue': queue, 'token': token})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='work-queue-server', daemon=True).start()
+    logging.info(f"Serving the work queue on {host}:{server.server_address[1]}.")
+    return server
+
+
+class RetailerTasks:
+    """
+    How one retailer's crawl is split into tasks, how a task runs, and how the results are published.
+
+    run() returns the task's product records and any further tasks it discovered, such as the
+    remaining pages of a category once its first page reports the page count.
+    """
+
+    retailer = None
+    # Minimum seconds between two leases of this retailer across all workers
+    min_interval = 0
+
+    def initial_tasks(self):
+        raise NotImplementedError
+
+    def run(self, payload):
+        raise NotImplementedError
+
+    def publish(self, filename):
+        raise NotImplementedError
+
+    def close(self):
+        """Remove anything the worker kept on disk for this retailer's tasks."""
+
+
+def write_records(records, filename):
+    """Write product records to a retailer's output CSV, product ID first, as the scrapers save them."""
+    from product_ids import ensure_product_ids
+    df = pd.DataFrame(records)
+    if df.empty:
+        return 0
+    df = ensure_product_ids(df).drop_duplicates(subset=['product_id']).set_index('product_id')
+    df.to_csv(filename, encoding='utf-8')
+    return len(df)
+
+
+class ListingPageTasks(RetailerTasks):
+    """Checkers and Shoprite: one task per page of the all-products listing."""
+
+    def __init__(self, retailer, module):
+        self.retailer = retailer
+        self.module = lazy_import(module)
+        self.scratch_file = os.path.join(CHECKPOINT_FOLDER, f"{retailer_slug(retailer)}_queue_{os.getpid()}.csv")
+        self._existing_data = None
+
+    def initial_tasks(self):
+        return [{'page': page} for page in range(self.module.LAST_PAGE + 1)]
+
+    def run(self, payload):
+        if self._existing_data is None:
+            # Lets the scraper skip images it already has, as in a local run
+            self._existing_data = self.module.load_existing_data('products_old.csv')
+        records = self.module.scrape_page(self.module.BASE_URL, payload['page'], self._existing_data,
+                                          save_filename=self.scratch_file, raise_errors=True)
+        return records, []
+
+    def publish(self, filename):
+        from data_quality import quality_gate
+        self.module.load_and_fix_duplicates(filename)
+        if not quality_gate(self.retailer, filename).passed:
+            return
+        self.module.upsert_to_supabase(rows_to_publish(filename, self.retailer))
+
+    def close(self):
+        if os.path.exists(self.scratch_file):
+            os.remove(self.scratch_file)
+
+
+class PnPTasks(RetailerTasks):
+    """Pick n Pay: one task per search results page, leased no faster than the site's crawl delay."""
+
+    retailer = 'Pick n Pay'
+    min_interval = 10
+
+    def __init__(self):
+        self.module = lazy_import('scrape_pnp')
+        self._scraper = None
+
+    def scraper(self):
+        if self._scraper is None:
+            self._scraper = self.module.Scraper(self.min_interval, PNP_REFERER_URL)
+        return self._scraper
+
+    def initial_tasks(self):
+        from crawl_planner import CrawlPlanner, CrawlWindow
+        # The planner keeps the page count the site last reported
+        planner = CrawlPlanner(self.retailer, CrawlWindow(self.module.ALLOWED_START, self.module.ALLOWED_END),
+                               self.min_interval, self.module.EXPECTED_PAGES)
+        return [{'page': page} for page in range(planner.page_count)]
+
+    def run(self, payload):
+        from crawl_planner import CrawlWindow
+        window = CrawlWindow(self.module.ALLOWED_START, self.module.ALLOWED_END)
+        now = datetime.now(timezone.utc)
+        if not window.is_open(now):
+            opens, _ = window.bounds(now)
+            if opens < now:
+                opens += timedelta(days=1)
+            raise TaskDeferred(f"outside the allowed visit time ({window})", opens.timestamp())
+        response = self.scraper().request(payload['page'])
+        if not response:
+            raise RuntimeError(f"no response for page {payload['page']}")
+        follow_ups = []
+        if payload['page'] == 0:
+            follow_ups = [{'page': page} for page in range(response.get('pagination', {}).get('totalPages') or 0)]
+        return self.scraper().process(response).to_dict('records'), follow_ups
+
+    def publish(self, filename):
+        from data_quality import quality_gate
+        scraper = self.scraper()
+        scraper.load_and_fix_duplicates(filename)
+        if not quality_gate(self.retailer, filename).passed:
+            return
+        scraper.upsert_to_supabase(rows_to_publish(filename, self.retailer))
+
+
+class WoolworthsTasks(RetailerTasks):
+    """Woolworths: one task per category and offset; the first page of a category adds the rest."""
+
+    retailer = 'Woolworths'
+    min_interval = 5
+
+    def __init__(self):
+        self.module = lazy_import('scrape_woolworths')
+        self._offer_valid_sentence = None
+
+    def offer_valid_sentence(self, scraper):
+        if self._offer_valid_sentence is None:
+            try:
+                sentences = scraper.extract_offer_valid_sentences(scraper.request_offer_valid())
+            except Exception as e:
+                logging.error(f"Error extracting offer valid sentences: {e}")
+                sentences = []
+            self._offer_valid_sentence = sentences[0] if sentences else " "
+        return self._offer_valid_sentence
+
+    def initial_tasks(self):
+        return [{'category': category, 'code': code, 'page': 0} for category, code in self.module.categories.items()]
+
+    def run(self, payload):
+        from product_ids import ensure_product_ids
+        scraper = self.module.Scraper(self.module.params, payload['category'], payload['code'])
+        response = scraper.request(payload['page'])
+        df, page_end = scraper.process(response, self.offer_valid_sentence(scraper))
+        follow_ups = []
+        if payload['page'] == 0:
+            follow_ups = [dict(payload, page=page) for page in range(1, int(page_end) + 1)]
+        if df.empty:
+            return [], follow_ups
+        return ensure_product_ids(df).to_dict('records'), follow_ups
+
+    def publish(self, filename):
+        # Scraper.publish reads the retailer's usual output file
+        self.module.Scraper(self.module.params, None, None).publish()
+
+
+RETAILER_TASKS = {
+    'Checkers': ListingPageTasks('Checkers', 'scrape_checkers'),
+    'Shoprite': ListingPageTasks('Shoprite', 'scrape_shoprite'),
+    'Pick n Pay': PnPTasks(),
+    'Woolworths': WoolworthsTasks(),
+}
+
+
+def run_worker(queue, worker_id, retailers=None, exit_when_idle=False, stop=None):
+    """
+    Lease and run tasks until stopped, or until no task is pending or leased if exit_when_idle.
+
+    Returns:
+        int: The number of tasks completed.
+    """
+    stop = stop or threading.Event()
+    completed = 0
+    while not stop.is_set():
+        task = queue.lease(worker_id, retailers)
+        if task is None:
+            if exit_when_idle and not any(counts.get('pending') or counts.get('leased')
+                                          for counts in queue.counts().values()):
+                break
+            stop.wait(POLL_SECONDS)
+            continue
+
+        # Keep the lease while the task runs, so only a dead worker's tasks are handed on
+        done = threading.Event()
+
+        def keep_lease():
+            while not done.wait(LEASE_SECONDS / 3):
+                try:
+                    if not queue.renew(task['key'], worker_id):
+                        logging.warning(f"{worker_id} lost the lease on {task['key']}.")
+                        return
+                except Exception as e:
+                    logging.warning(f"{worker_id} could not renew the lease on {task['key']}: {e}")
+
+        renewer = threading.Thread(target=keep_lease, daemon=True)
+        renewer.start()
+        retailer, payload = task['retailer'], task['payload']
+        try:
+            records, follow_ups = RETAILER_TASKS[retailer].run(payload)
+            if follow_ups:
+                queue.enqueue(task['run_id'], retailer, follow_ups)
+            if queue.complete(task['key'], worker_id, records):
+                completed += 1
+            logging.info(f"{worker_id} finished {retailer} {payload}: {len(records)} products.")
+        except TaskDeferred as e:
+            logging.info(f"{worker_id} deferred {retailer} {payload}: {e}.")
+            queue.release(task['key'], worker_id, e.retry_at)
+        except Exception as e:
+            status = queue.fail(task['key'], worker_id, str(e))
+            logging.error(f"{worker_id} failed {retailer} {payload} (attempt {task['attempts']}, now {status}): {e}")
+        finally:
+            done.set()
+            renewer.join()
+    return completed
+
+
+def start_local_workers(count, retailers=None, queue_file=QUEUE_FILE):
+    """Start worker processes on this machine that exit once the queue is empty."""
+    command = [sys.executable, os.path.join(SCRIPTS_DIR, 'work_queue.py'), '--queue', queue_file, 'worker', '--exit-when-idle']
+    if retailers is not None:
+        command += ['--retailers'] + [retailer_slug(retailer) for retailer in retailers]
+    return [subprocess.Popen(command) for _ in range(count)]
+
+
+def publish_run(queue, run_id, retailer, filename):
+    """Write a retailer's results to its output file, then deduplicate and upsert them as its scraper does."""
+    failures = queue.failures(run_id, retailer)
+    for payload, error in failures:
+        logging.error(f"{retailer} task {payload} was given up: {error}")
+    records = [record for result in queue.results(run_id, retailer) for record in result]
+    written = write_records(records, filename)
+    logging.info(f"{retailer}: {written} products from run {run_id} written to {filename}, {len(failures)} tasks failed.")
+    if written:
+        RETAILER_TASKS[retailer].publish(filename)
+
+
+def coordinate(output_files, workers=0, port=None, resume=False, queue_file=QUEUE_FILE, host=DEFAULT_HOST):
+    """
+    Crawl the given retailers through the work queue and publish their results.
+
+    Enqueues every retailer's initial tasks as a new run, or picks up the last unfinished run
+    if resume is set, optionally starts local workers and serves the queue to workers on other
+    machines, waits until no task is pending or leased, then writes each retailer's output
+    file and upserts it.
+
+    Args:
+        output_files (dict): Output CSV per retailer to crawl.
+        workers (int): Worker processes to start on this machine.
+        port (int): Serve the queue on this port for remote workers (default: not served).
+        resume (bool): Continue the last run the coordinator did not finish.
+        queue_file (str): The queue database.
+        host (str): Address the served queue listens on.
+
+    Returns:
+        str: The run ID.
+    """
+    queue = WorkQueue(queue_file)
+    run_id = queue.latest_run(unfinished=True) if resume else None
+    if run_id is not None:
+        logging.info(f"Resuming run {run_id}.")
+    else:
+        run_id = queue.new_run(list(output_files))
+        for retailer in output_files:
+            added = queue.enqueue(run_id, retailer, RETAILER_TASKS[retailer].initial_tasks())
+            logging.info(f"Run {run_id}: enqueued {added} {retailer} tasks.")
+    server = serve(queue, host=host, port=port) if port else None
+    processes = start_local_workers(workers, list(output_files), queue_file) if workers else []
+    try:
+        last_progress = 0
+        while True:
+            counts = queue.counts(run_id)
+            if not any(status.get('pending') or status.get('leased') for status in counts.values()):
+                break
+            if time.time() - last_progress >= PROGRESS_SECONDS:
+                last_progress = time.time()
+                progress = '; '.join(f"{retailer} {status.get('done', 0)}/{sum(status.values())} done"
+                                     for retailer, status in counts.items())
+                logging.info(f"Run {run_id}: {progress}", extra=CONSOLE)
+            time.sleep(POLL_SECONDS)
+    finally:
+        for process in processes:
+            process.wait()
+        if server is not None:
+            server.shutdown()
+    for retailer, filename in output_files.items():
+        try:
+            publish_run(queue, run_id, retailer, filename)
+        except Exception as e:
+            logging.error(f"Failed to publish {retailer} results of run {run_id}: {e}")
+    queue.finish_run(run_id)
+    return run_id
+
+
+def print_status(queue, run_id=None):
+    run_id = run_id or queue.latest_run()
+    if run_id is None:
+        print("The work queue is empty.")
+        return
+    print(f"Run {run_id}")
+    for retailer, status in sorted(queue.counts(run_id).items()):
+        print(f"  {retailer:<12} " + ', '.join(f"{count} {name}" for name, count in sorted(status.items())))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Spread page crawls over worker processes and machines through a durable queue.")
+    parser.add_argument("--queue", default=QUEUE_FILE, help=f"Queue database, or the URL of a served queue for workers (default: {QUEUE_FILE})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    retailer_choices = [retailer_slug(retailer) for retailer in RETAILER_TASKS]
+    coordinate_parser = commands.add_parser("coordinate", help="Enqueue a crawl, wait for the workers and publish the results")
+    coordinate_parser.add_argument("--retailers", nargs="+", choices=retailer_choices, help="Crawl only these retailers")
+    coordinate_parser.add_argument("--workers", type=int, default=0, help="Worker processes to start on this machine")
+    coordinate_parser.add_argument("--port", type=int, help=f"Serve the queue to workers on other machines (e.g. {DEFAULT_PORT})")
+    coordinate_parser.add_argument("--host", default=DEFAULT_HOST, help=f"Address to serve the queue on (default: {DEFAULT_HOST})")
+    coordinate_parser.add_argument("--resume", action="store_true", help="Continue the last unfinished run")
+    worker_parser = commands.add_parser("worker", help="Lease and run tasks")
+    worker_parser.add_argument("--retailers", nargs="+", choices=retailer_choices, help="Only run tasks of these retailers")
+    worker_parser.add_argument("--threads", type=int, default=1, help="Tasks run at a time (default: 1)")
+    worker_parser.add_argument("--exit-when-idle", action="store_true", help="Exit once no task is pending or leased")
+    worker_parser.add_argument("--token-file", default=TOKEN_FILE, help=f"Token of a served queue (default: {TOKEN_FILE})")
+    serve_parser = commands.add_parser("serve", help="Serve the queue to workers on other machines")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port (default: {DEFAULT_PORT})")
+    serve_parser.add_argument("--host", default=DEFAULT_HOST, help=f"Address (default: {DEFAULT_HOST})")
+    status_parser = commands.add_parser("status", help="Show the task counts of a run")
+    status_parser.add_argument("--run", help="Run ID (default: the latest run)")
+    args = parser.parse_args()
+    retailers = None if getattr(args, 'retailers', None) is None else \
+        [retailer for retailer in RETAILER_TASKS if retailer_slug(retailer) in args.retailers]
+
+    if args.command == "coordinate":
+        from daily_scrape import RETAILERS
+        setup_logging('work_queue')
+        coordinate({retailer: file for retailer, (_, file) in RETAILERS.items() if retailers is None or retailer in retailers},
+                   workers=args.workers, port=args.port, resume=args.resume, queue_file=args.queue, host=args.host)
+    elif args.command == "worker":
+        setup_logging('worker')
+        if args.queue.startswith(('http://', 'https://')):
+            queue = RemoteQueue(args.queue, queue_token(args.token_file))
+        else:
+            queue = WorkQueue(args.queue)
+        worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        threads = [threading.Thread(target=run_worker, args=(queue, f"{worker_id}-{index}", retailers, args.exit_when_idle))
+                   for index in range(args.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for tasks in RETAILER_TASKS.values():
+            tasks.close()
+    elif args.command == "serve":
+        setup_logging('work_queue')
+        server = serve(WorkQueue(args.queue), host=args.host, port=args.port)
+        print(f"Serving {args.queue} on {args.host}:{server.server_address[1]}. Workers need the token in {TOKEN_FILE}. "
+              f"Press Ctrl+C to stop.")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+    else:
+        print_status(WorkQueue(args.queue), args.run)